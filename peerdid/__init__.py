@@ -1,23 +1,27 @@
 import re
+from typing import Iterable, List
 
 PEER_DID_PAT = re.compile(r'^did:peer:(1)(z)([1-9a-km-zA-HJ-NP-Z]{45})$')
 
+# A peer DID is always 11 chars of prefix plus 45 of base58.
+_PEER_DID_LEN = 56
+_match = PEER_DID_PAT.match
+
 
 def is_valid_peer_did(did: str):
     if did:
         return bool(PEER_DID_PAT.match(did))
 
 
+def _is_reserved(did) -> bool:
+    # Reserved DIDs repeat one char (ignoring case) 45 times. Comparing whole strings
+    # is cheap, so do that before the regex, which only reserved candidates need.
+    return isinstance(did, str) and len(did) == _PEER_DID_LEN and \
+        did[11:].lower() == did[11].lower() * 45 and _match(did) is not None
+
+
 def is_reserved_peer_did(did: str):
-    if did:
-        m = PEER_DID_PAT.match(did)
-        if m:
-            c = did[11].lower()
-            for i in range(12, 56):
-                if did[i].lower() != c:
-                    return False
-            return True
-    return False
+    return _is_reserved(did)
 
 
 def compare_peer_dids(did_a, did_b):
@@ -26,3 +30,31 @@ def compare_peer_dids(did_a, did_b):
     assert did_a[10] == 'z'
     assert did_b[10] == 'z'
     return -1 if did_a < did_b else 1 if did_a > did_b else 0
+
+
+def are_valid_peer_dids(dids: Iterable[str]) -> List[bool]:
+    """
+    Batch form of is_valid_peer_did: a list of booleans, one per item in dids.
+    """
+    match = _match
+    return [isinstance(did, str) and match(did) is not None for did in dids]
+
+
+def are_reserved_peer_dids(dids: Iterable[str]) -> List[bool]:
+    """
+    Batch form of is_reserved_peer_did: a list of booleans, one per item in dids.
+    """
+    return [_is_reserved(did) for did in dids]
+
+
+def sort_peer_dids(dids: Iterable[str]) -> List[int]:
+    """
+    Return the indexes of dids in the order that compare_peer_dids sorts them, so
+    the same order can be applied to data that goes with the DIDs. Comparing
+    base58 peer DIDs is a plain comparison of their (ASCII) strings, so this lets
+    sort() do that in C instead of calling compare_peer_dids for each pair.
+    """
+    if not isinstance(dids, list):
+        dids = list(dids)
+    assert all(did[10] == 'z' for did in dids)
+    return sorted(range(len(dids)), key=dids.__getitem__)
@@ -0,0 +1,74 @@
+import asyncio
+import concurrent.futures
+import functools
+import weakref
+
+from .delta import Delta
+from .repo import Repo
+
+
+class AsyncRepo:
+    """
+    asyncio front end for a Repo. Blocking file I/O and replay run on a thread pool,
+    so the event loop never waits on disk. Writes to the same DID are serialized with
+    a per-DID lock. Results are exactly what the underlying Repo returns.
+    """
+    def __init__(self, path_or_repo, executor: concurrent.futures.Executor = None, max_workers: int = None,
+                 **repo_kwargs):
+        if isinstance(path_or_repo, Repo):
+            self.repo = path_or_repo
+        else:
+            self.repo = Repo(path_or_repo, **repo_kwargs)
+        self._own_executor = executor is None
+        self._executor = executor or concurrent.futures.ThreadPoolExecutor(max_workers)
+        # Locks disappear once no task holds or waits on them.
+        self._locks = weakref.WeakValueDictionary()
+
+    @property
+    def path(self):
+        return self.repo.path
+
+    def _lock(self, did) -> asyncio.Lock:
+        lock = self._locks.get(did)
+        if lock is None:
+            lock = self._locks[did] = asyncio.Lock()
+        return lock
+
+    async def _run(self, func, *args, **kwargs):
+        future = self._executor.submit(functools.partial(func, *args, **kwargs))
+        try:
+            return await asyncio.shield(asyncio.wrap_future(future))
+        except asyncio.CancelledError:
+            # If the work already started, it can't be stopped. Let it finish before
+            # giving up, so whoever holds a lock for it doesn't release it too early.
+            if not future.cancel():
+                await asyncio.wait([asyncio.wrap_future(future)])
+            raise
+
+    async def resolve(self, did, as_of_time=None):
+        return await self._run(self.repo.resolve, did, as_of_time)
+
+    async def resolve_as_of_times(self, did, times):
+        return await self._run(self.repo.resolve_as_of_times, did, times)
+
+    async def resolve_many(self, dids, as_of_time=None, executor=None, max_workers=None):
+        return await self._run(self.repo.resolve_many, dids, as_of_time, executor, max_workers)
+
+    async def new_doc(self, genesis_doc, signatures=[]):
+        did = 'did:peer:1z' + Delta(genesis_doc, signatures).encnumbasis
+        async with self._lock(did):
+            return await self._run(self.repo.new_doc, genesis_doc, signatures)
+
+    async def append(self, did, delta: Delta):
+        async with self._lock(did):
+            return await self._run(self.repo.append, did, delta)
+
+    def close(self):
+        if self._own_executor:
+            self._executor.shutdown(wait=False)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, exc_traceback):
+        self.close()
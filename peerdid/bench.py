@@ -0,0 +1,376 @@
+"""
+Benchmarks for peerdid's hot paths. Builds a synthetic repo of N DIDs x M deltas
+with the public Delta/File/Repo APIs, times each case, and writes the results as
+JSON. A second mode compares two result files and flags regressions.
+
+    python -m peerdid.bench run --dids 20 --deltas 200 --out before.json
+    python -m peerdid.bench compare before.json after.json --threshold 0.1
+"""
+
+import argparse
+from datetime import datetime, timedelta
+import functools
+import hashlib
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+from . import (are_reserved_peer_dids, are_valid_peer_dids, compare_peer_dids, is_reserved_peer_did,
+               is_valid_peer_did, sort_peer_dids)
+from .codec import decode_encnumbasis, did_to_digest, digest_to_did, encnumbasis
+from .delta import Delta
+from .diddoc import DIDDoc, get_predefined, get_path_where_diddocs_differ, validate
+from .file import File, canonical_fname
+from .repo import Repo
+
+
+CASES = []
+
+
+def case(name):
+    """
+    Register a benchmark. The function gets a Context and returns the number of
+    operations it performed, so results can be reported per operation.
+    """
+    def register(func):
+        CASES.append((name, func))
+        return func
+    return register
+
+
+_EPOCH = datetime(2019, 1, 1)
+
+
+def timestamp(i):
+    return (_EPOCH + timedelta(seconds=i)).isoformat()
+
+
+def genesis_doc(n):
+    doc = json.loads(get_predefined('1'))
+    del doc['id']
+    doc['publicKey'][0]['id'] = 'key-genesis-%d' % n
+    return json.dumps(doc)
+
+
+def change(i):
+    if i % 10 == 0:
+        key_id = 'key-%d' % i
+        return json.dumps({
+            "publicKey": [{"id": key_id, "type": "Ed25519VerificationKey2018",
+                           "publicKeyBase58": "GBMBzuhw7XgSdbNffh8HpoKWEdEN6hU2Q5WqL1KQTG5Z"}],
+            "authentication": ["#" + key_id],
+            "authorization": {"profiles": [{"key": "#" + key_id, "roles": ["edge"]}]}})
+    return json.dumps({"rules": [{"id": "rule-%d" % i, "grant": ["route"], "when": {"id": "#key-1"}}]})
+
+
+class Context:
+    """
+    A synthetic repo in a temp folder, plus a few values the cases share.
+    """
+    def __init__(self, dids, deltas):
+        self.n_dids = dids
+        self.n_deltas = deltas
+        self._tmp = tempfile.TemporaryDirectory()
+        self.path = self._tmp.name
+        repo = Repo(self.path, cache_entries=0)
+        self.dids = []
+        for n in range(dids):
+            did = repo.new_doc(genesis_doc(n))
+            f = File(os.path.join(self.path, canonical_fname(did)), autosave=False)
+            f.deltas[0] = Delta(f.deltas[0].change, [], timestamp(0))
+            for i in range(1, deltas):
+                f.append(Delta(change(i), [], timestamp(i)))
+            f.save(rewrite=True)
+            self.dids.append(did)
+        self.paths = [os.path.join(self.path, canonical_fname(did)) for did in self.dids]
+        self.changes = [change(i) for i in range(1, deltas)]
+        self.digests = [hashlib.sha256(c.encode('utf-8')).digest() for c in self.changes]
+        self.midpoint = timestamp(deltas // 2)
+        self.resolved = [DIDDoc(p).resolve() for p in self.paths]
+        self.warm_repo = Repo(self.path)
+        for did in self.dids:
+            self.warm_repo.resolve(did)
+        self._did_batch = None
+        self.sidecar_path = os.path.join(self.path, 'sidecars')
+        os.mkdir(self.sidecar_path)
+        primed = Repo(self.path, sidecar=self.sidecar_path)
+        for did in self.dids:
+            primed.resolve(did)
+
+    @property
+    def did_batch(self):
+        """
+        Ten thousand DIDs, a few of them reserved, for the batch validation cases.
+        """
+        if self._did_batch is None:
+            batch = []
+            for i in range(10000):
+                digest = hashlib.sha256(str(i).encode('ascii')).digest()
+                batch.append(digest_to_did(digest))
+            for i in range(0, len(batch), 500):
+                batch[i] = 'did:peer:1z' + '12345678ab'[i % 10] * 45
+            self._did_batch = batch
+        return self._did_batch
+
+    def cleanup(self):
+        self._tmp.cleanup()
+
+
+@case('delta.construct')
+def _(ctx):
+    for c in ctx.changes:
+        Delta(c, [], _EPOCH.isoformat())
+    return len(ctx.changes)
+
+
+@case('delta.encnumbasis')
+def _(ctx):
+    # Fresh deltas each time, so memoization doesn't hide the cost.
+    for c in ctx.changes:
+        Delta(c, []).encnumbasis
+    return len(ctx.changes)
+
+
+@case('codec.encode')
+def _(ctx):
+    encnumbasis.cache_clear()
+    digests = ctx.digests
+    for digest in digests:
+        encnumbasis(digest)
+    return len(digests)
+
+
+@case('codec.decode')
+def _(ctx):
+    decode_encnumbasis.cache_clear()
+    dids = ctx.did_batch
+    for did in dids:
+        try:
+            did_to_digest(did)
+        except ValueError:
+            pass  # reserved
+    return len(dids)
+
+
+@case('file.load')
+def _(ctx):
+    for p in ctx.paths:
+        File(p)
+    return len(ctx.paths)
+
+
+@case('file.save')
+def _(ctx):
+    for p in ctx.paths:
+        File(p).save(rewrite=True)
+    return len(ctx.paths)
+
+
+@case('file.append')
+def _(ctx):
+    tmp = tempfile.TemporaryDirectory()
+    try:
+        f = File(os.path.join(tmp.name, 'x.ddd'))
+        for c in ctx.changes:
+            f.append(Delta(c, []))
+    finally:
+        tmp.cleanup()
+    return len(ctx.changes)
+
+
+@case('diddoc.resolve')
+def _(ctx):
+    for p in ctx.paths:
+        DIDDoc(p).resolve()
+    return len(ctx.paths)
+
+
+@case('diddoc.resolve_as_of')
+def _(ctx):
+    for p in ctx.paths:
+        DIDDoc(p).resolve(ctx.midpoint)
+    return len(ctx.paths)
+
+
+@case('diddoc.resolve_as_of_times')
+def _(ctx):
+    times = [timestamp(i) for i in range(0, ctx.n_deltas, max(1, ctx.n_deltas // 10))]
+    for p in ctx.paths:
+        DIDDoc(p).resolve_as_of_times(times)
+    return len(ctx.paths) * len(times)
+
+
+@case('repo.resolve_cold')
+def _(ctx):
+    repo = Repo(ctx.path, cache_entries=0)
+    for did in ctx.dids:
+        repo.resolve(did)
+    return len(ctx.dids)
+
+
+@case('repo.resolve_cold_sidecar')
+def _(ctx):
+    repo = Repo(ctx.path, cache_entries=0, sidecar=ctx.sidecar_path)
+    for did in ctx.dids:
+        repo.resolve(did)
+    return len(ctx.dids)
+
+
+@case('repo.contains')
+def _(ctx):
+    for did in ctx.dids:
+        did in ctx.warm_repo
+    return len(ctx.dids)
+
+
+@case('repo.resolve_warm')
+def _(ctx):
+    for did in ctx.dids:
+        ctx.warm_repo.resolve(did)
+    return len(ctx.dids)
+
+
+@case('diddoc.differ')
+def _(ctx):
+    a = ctx.resolved
+    for i in range(len(a)):
+        get_path_where_diddocs_differ(a[i], a[i])
+        get_path_where_diddocs_differ(a[i], a[i - 1])
+    return 2 * len(a)
+
+
+@case('diddoc.validate')
+def _(ctx):
+    docs = [get_predefined(c) for c in '12345d']
+    for doc in docs:
+        validate(doc)
+    return len(docs)
+
+
+@case('did.valid_scalar')
+def _(ctx):
+    for did in ctx.did_batch:
+        is_valid_peer_did(did)
+    return len(ctx.did_batch)
+
+
+@case('did.valid_batch')
+def _(ctx):
+    are_valid_peer_dids(ctx.did_batch)
+    return len(ctx.did_batch)
+
+
+@case('did.reserved_scalar')
+def _(ctx):
+    for did in ctx.did_batch:
+        is_reserved_peer_did(did)
+    return len(ctx.did_batch)
+
+
+@case('did.reserved_batch')
+def _(ctx):
+    are_reserved_peer_dids(ctx.did_batch)
+    return len(ctx.did_batch)
+
+
+@case('did.sort_scalar')
+def _(ctx):
+    sorted(ctx.did_batch, key=functools.cmp_to_key(compare_peer_dids))
+    return len(ctx.did_batch)
+
+
+@case('did.sort_batch')
+def _(ctx):
+    sort_peer_dids(ctx.did_batch)
+    return len(ctx.did_batch)
+
+
+def run(dids=20, deltas=200, repeat=5, only=None) -> dict:
+    ctx = Context(dids, deltas)
+    try:
+        results = {}
+        for name, func in CASES:
+            if only and not any(name.startswith(prefix) for prefix in only):
+                continue
+            samples = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                ops = func(ctx)
+                samples.append((time.perf_counter() - start) / max(ops, 1))
+            results[name] = {
+                "ops": ops,
+                "min": min(samples),
+                "median": statistics.median(samples),
+            }
+    finally:
+        ctx.cleanup()
+    return {
+        "meta": {
+            "dids": dids, "deltas": deltas, "repeat": repeat,
+            "python": platform.python_version(), "platform": platform.platform(),
+            "when": datetime.utcnow().isoformat(),
+        },
+        "results": results,
+    }
+
+
+def compare(baseline: dict, current: dict, threshold: float = 0.1) -> list:
+    """
+    Return (name, baseline, current, ratio) for each case whose median seconds per
+    op got worse by more than threshold (0.1 = 10%).
+    """
+    regressions = []
+    for name, now in current["results"].items():
+        before = baseline["results"].get(name)
+        if before and before["median"] > 0:
+            ratio = now["median"] / before["median"]
+            if ratio > 1 + threshold:
+                regressions.append((name, before["median"], now["median"], ratio))
+    return regressions
+
+
+def main(argv=None):
+    syntax = argparse.ArgumentParser(description='Benchmark peerdid hot paths.')
+    sub = syntax.add_subparsers(dest='cmd')
+    cmd = sub.add_parser('run', help='Run benchmarks and write JSON results.')
+    cmd.add_argument('--dids', type=int, default=20)
+    cmd.add_argument('--deltas', type=int, default=200)
+    cmd.add_argument('--repeat', type=int, default=5)
+    cmd.add_argument('--only', nargs='*', help='case name prefixes to run')
+    cmd.add_argument('--out', help='where to write results (default: stdout)')
+    cmd = sub.add_parser('compare', help='Flag regressions between two result files.')
+    cmd.add_argument('baseline')
+    cmd.add_argument('current')
+    cmd.add_argument('--threshold', type=float, default=0.1)
+    args = syntax.parse_args(argv)
+    if args.cmd == 'run':
+        report = json.dumps(run(args.dids, args.deltas, args.repeat, args.only), indent=2)
+        if args.out:
+            with open(args.out, 'wt') as f:
+                f.write(report + '\n')
+        else:
+            print(report)
+    elif args.cmd == 'compare':
+        with open(args.baseline, 'rt') as f:
+            baseline = json.load(f)
+        with open(args.current, 'rt') as f:
+            current = json.load(f)
+        regressions = compare(baseline, current, args.threshold)
+        for name in sorted(current["results"]):
+            now = current["results"][name]["median"]
+            before = baseline["results"].get(name, {}).get("median")
+            trend = ' %+.1f%%' % (100 * (now / before - 1)) if before else ' (new)'
+            print('%-24s %12.3f us/op%s' % (name, now * 1e6, trend))
+        for name, before, now, ratio in regressions:
+            print('REGRESSION: %s is %.2fx slower' % (name, ratio))
+        return 1 if regressions else 0
+    else:
+        syntax.print_help()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
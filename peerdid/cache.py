@@ -0,0 +1,71 @@
+from collections import OrderedDict
+import threading
+
+
+class LRUCache:
+    """
+    A bounded, thread-safe, least-recently-used cache. Bounded by number of entries
+    and, optionally, by the total of the sizes that callers report for the values.
+    Each entry can carry a version; a lookup that names a different version treats
+    the entry as stale, drops it, and counts a miss.
+    """
+    def __init__(self, max_entries: int = 1024, max_bytes: int = None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, version=None, default=None):
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None:
+                value, size, item_version = item
+                if item_version == version:
+                    self._items.move_to_end(key)
+                    self.hits += 1
+                    return value
+                self._discard(key)
+            self.misses += 1
+            return default
+
+    def put(self, key, value, size: int = 0, version=None):
+        with self._lock:
+            self._discard(key)
+            if self.max_entries <= 0 or (self.max_bytes is not None and size > self.max_bytes):
+                return
+            self._items[key] = (value, size, version)
+            self.bytes += size
+            while len(self._items) > self.max_entries or \
+                    (self.max_bytes is not None and self.bytes > self.max_bytes):
+                _, (_, old_size, _) = self._items.popitem(last=False)
+                self.bytes -= old_size
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            self._discard(key)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.bytes = 0
+
+    def _discard(self, key):
+        item = self._items.pop(key, None)
+        if item is not None:
+            self.bytes -= item[1]
+
+    @property
+    def stats(self) -> dict:
+        return {"entries": len(self._items), "bytes": self.bytes, "hits": self.hits,
+                "misses": self.misses, "evictions": self.evictions}
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        return key in self._items
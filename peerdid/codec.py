@@ -0,0 +1,71 @@
+"""
+Encoding of the numeric basis of peer DIDs. A peer DID ends with the encnumbasis of
+its genesis delta: base58 (bitcoin alphabet) of b'\\x12' (sha256, in multicodec)
+followed by the 32-byte digest. That is always 33 bytes in and 45 chars out, so we
+can skip the leading-zero handling of general base58 and convert two digits per
+big-integer division. Results are memoized, since the same few DIDs tend to be
+encoded and decoded over and over.
+"""
+
+import functools
+
+ALPHABET = '123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz'
+SHA256_PREFIX = b'\x12'
+DIGEST_LEN = 32
+ENCNUMBASIS_LEN = 45
+PEER_DID_PREFIX = 'did:peer:1z'
+
+_PAIRS = [a + b for a in ALPHABET for b in ALPHABET]
+_VALUES = {c: i for i, c in enumerate(ALPHABET)}
+
+
+@functools.lru_cache(maxsize=4096)
+def encnumbasis(digest: bytes) -> str:
+    """
+    The 45-char base58 encnumbasis for a sha256 digest.
+    """
+    if len(digest) != DIGEST_LEN:
+        raise ValueError('Expected a %d-byte sha256 digest, not %d bytes.' % (DIGEST_LEN, len(digest)))
+    n = int.from_bytes(SHA256_PREFIX + digest, 'big')
+    digits = []
+    for _ in range(ENCNUMBASIS_LEN // 2):
+        n, pair = divmod(n, 58 * 58)
+        digits.append(_PAIRS[pair])
+    digits.append(ALPHABET[n])
+    digits.reverse()
+    return ''.join(digits)
+
+
+@functools.lru_cache(maxsize=4096)
+def decode_encnumbasis(text: str) -> bytes:
+    """
+    Inverse of encnumbasis: the 32-byte digest that text encodes. Raises ValueError
+    if text isn't the encnumbasis of a sha256 digest (reserved DIDs aren't).
+    """
+    if len(text) != ENCNUMBASIS_LEN:
+        raise ValueError('Expected %d chars of base58, not "%s".' % (ENCNUMBASIS_LEN, text))
+    n = 0
+    try:
+        for c in text:
+            n = n * 58 + _VALUES[c]
+    except KeyError:
+        raise ValueError('"%s" is not base58.' % text)
+    if n >> (DIGEST_LEN * 8) != SHA256_PREFIX[0]:
+        raise ValueError('"%s" does not encode a sha256 digest.' % text)
+    return n.to_bytes(DIGEST_LEN + 1, 'big')[1:]
+
+
+def did_to_digest(did_or_name: str) -> bytes:
+    """
+    The digest that a peer DID encodes. Also accepts a bare encnumbasis, or the
+    canonical file name of a DID.
+    """
+    if did_or_name.startswith(PEER_DID_PREFIX):
+        did_or_name = did_or_name[len(PEER_DID_PREFIX):]
+    elif did_or_name.endswith('.ddd'):
+        did_or_name = did_or_name[:-4]
+    return decode_encnumbasis(did_or_name)
+
+
+def digest_to_did(digest: bytes) -> str:
+    return PEER_DID_PREFIX + encnumbasis(digest)
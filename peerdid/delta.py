@@ -1,19 +1,42 @@
 import base64
-import base58
 from datetime import datetime
 import hashlib
 import json
+from types import MappingProxyType
 from typing import Union, List
 
+from .codec import encnumbasis
 from .jsondetect import str_seems_like_json, bytes_seems_like_json
 
 
-def _is_base64(txt):
+def _decode_base64(txt):
     try:
-        base64.b64decode(txt, validate=True)
-        return True
+        return base64.b64decode(txt, validate=True)
     except:
-        return False
+        return None
+
+
+def freeze_json(value):
+    """
+    Return a read-only version of parsed JSON: dicts become MappingProxyType, lists
+    become tuples.
+    """
+    if isinstance(value, dict):
+        return MappingProxyType({k: freeze_json(v) for k, v in value.items()})
+    if isinstance(value, list):
+        return tuple(freeze_json(v) for v in value)
+    return value
+
+
+def thaw_json(value):
+    """
+    Inverse of freeze_json: return a plain, mutable (and json-serializable) copy.
+    """
+    if isinstance(value, (dict, MappingProxyType)):
+        return {k: thaw_json(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [thaw_json(v) for v in value]
+    return value
 
 
 _bad_json = ValueError('change should be JSON str/bytes/dict, or base64 text.')
@@ -22,49 +45,63 @@ class Delta:
     """
     An immutable {change, by, when} object. Also has an .encnumbasis property that uniquely
     identifies it.
+
+    The change is held as decoded JSON bytes; its base64 form is only produced when
+    the delta is serialized. (A delta loaded lazily holds the base64 text until its
+    change is first used, then swaps it for the decoded bytes.) Hash, encnumbasis and
+    the read-only parse of the change are computed once.
     """
+    __slots__ = ('_raw', '_b64', '_by', '_when', '_hash', '_encnumbasis', '_view')
+
     def __init__(self, change_json: Union[str, bytes, dict], by: List, when: str = None):
+        raw = None
         if isinstance(change_json, str):
             if str_seems_like_json(change_json):
-                self._change = base64.b64encode(change_json.encode('utf-8')).decode('ascii')
-            elif _is_base64(change_json):
-                self._change = change_json
+                raw = change_json.encode('utf-8')
             else:
-                raise _bad_json
+                raw = _decode_base64(change_json)
         elif isinstance(change_json, bytes):
             if bytes_seems_like_json(change_json):
-                self._change = base64.b64encode(change_json).decode('ascii')
-            elif _is_base64(change_json):
-                self._change = change_json.decode('ascii')
+                raw = change_json
             else:
-                raise _bad_json
+                raw = _decode_base64(change_json)
         elif isinstance(change_json, dict):
-            self._change = base64.b64encode(json.dumps(change_json, indent=2).encode('utf-8')).decode('ascii')
-        else:
+            raw = json.dumps(change_json, indent=2).encode('utf-8')
+        if raw is None:
             raise _bad_json
+        self._raw = raw
+        self._b64 = None
         self._by = by
         if when is None:
             when = datetime.utcnow().isoformat()
         self._when = when
         self._hash = None
+        self._encnumbasis = None
+        self._view = None
 
     @property
-    def hash(self) -> str:
+    def hash(self) -> bytes:
         if not self._hash:
             self._hash = hashlib.sha256(self.change_json_bytes).digest()
         return self._hash
 
     @property
     def hexhash(self) -> str:
-        return hex(self.hash)
+        return self.hash.hex()
 
     @property
     def encnumbasis(self) -> str:
-        return base58.b58encode(b'\x12' + self.hash).decode('ascii')
+        if self._encnumbasis is None:
+            self._encnumbasis = encnumbasis(self.hash)
+        return self._encnumbasis
 
     @property
     def change(self) -> str:
-        return self._change
+        # Read _b64 before _raw; see change_json_bytes for the order they're swapped.
+        b64, raw = self._b64, self._raw
+        if raw is None:
+            return b64
+        return base64.b64encode(raw).decode('ascii')
 
     @property
     def by(self) -> List:
@@ -76,7 +113,16 @@ class Delta:
 
     @property
     def change_json_bytes(self) -> bytes:
-        return base64.b64decode(self._change)
+        raw = self._raw
+        if raw is None:
+            b64 = self._b64
+            if b64 is None:
+                # Another thread just swapped it in.
+                return self._raw
+            raw = base64.b64decode(b64)
+            self._raw = raw
+            self._b64 = None
+        return raw
 
     @property
     def change_json_str(self) -> str:
@@ -84,15 +130,46 @@ class Delta:
 
     @property
     def change_json_dict(self) -> dict:
+        """
+        A new, mutable dict parsed from the change. See .change_json_view for a
+        cheaper, shared, read-only alternative.
+        """
         return json.loads(self.change_json_bytes)
 
+    @property
+    def change_json_view(self):
+        """
+        The change, parsed once and frozen (see freeze_json). Use thaw_json to get a
+        mutable copy of any part of it.
+        """
+        if self._view is None:
+            self._view = freeze_json(json.loads(self.change_json_bytes))
+        return self._view
+
     @classmethod
-    def from_dict(cls, src: dict):
+    def from_dict(cls, src: dict, lazy: bool = False):
+        """
+        Build a Delta from its serialized form. If lazy, trust that "change" is the
+        base64 text we wrote, and skip validating it; it is only decoded when used.
+        """
+        if lazy:
+            change = src.get("change")
+            if not isinstance(change, str):
+                raise _bad_json
+            d = cls.__new__(cls)
+            d._raw = None
+            d._b64 = change
+            d._by = src.get("by")
+            d._when = src.get("when") or datetime.utcnow().isoformat()
+            d._hash = None
+            d._encnumbasis = None
+            d._view = None
+            return d
         return Delta(src.get("change"), src.get("by"), src.get("when"))
 
     @classmethod
-    def from_json(cls, json_text: Union[str, bytes]):
-        return Delta.from_dict(json.loads(json_text))
+    def from_json(cls, json_text: Union[str, bytes], lazy: bool = False):
+        return Delta.from_dict(json.loads(json_text), lazy)
 
     def to_dict(self):
         return {"change": self.change, "by": self._by, "when": self._when}
@@ -1,14 +1,18 @@
+import copy
 import json
 import os
-import re
-from typing import Union
+from typing import List, Union
 
+from .delta import thaw_json
 from .file import File, canonical_fname
 from .jsondetect import str_seems_like_json, bytes_seems_like_json
+from .resolver import Replay, Resolver
+from .validation import ValidationError, validate, validate_many, fragment
 
 
 class DIDDoc:
-    def __init__(self, path_or_File: Union[str, File]):
+    def __init__(self, path_or_File: Union[str, File], resolver: Resolver = None):
+        self._resolver = resolver
         if isinstance(path_or_File, File):
             self._file = path_or_File
             self._folder = None
@@ -42,37 +46,15 @@ class DIDDoc:
         if f:
             return f.path
 
-    def apply_delta(self, json_dict, delta):
-        change_fragment = delta.change_json_dict
-
-        def add_to_list(list_name, container):
-            d = container.get(list_name)
-            if d:
-                items = json_dict.get(list_name)
-                if not items:
-                    items = json_dict[list_name] = []
-                items.append(d[0])
-                return d[0]
-
-        def find_item_by_id(list, id):
-            if list:
-                for item in list:
-                    if item.id == id:
-                        return list, item
-
-        deleted_id = add_to_list('deleted', change_fragment)
-        if deleted_id:
-            list, found = find_item_by_id(json_dict.get('publicKey'), deleted_id)
-            if found:
-                list.remove(found)
-            json_dict.get('authentication', []).remove(deleted_id)
-            list, found = find_item_by_id(json_dict.get('authorization', {}).get('profiles'), deleted_id)
-            if found:
-                list.remove(found)
-        if add_to_list('publicKey', change_fragment):
-            add_to_list('authentication', change_fragment)
-            add_to_list('profiles', change_fragment.get('authorization', []))
-        add_to_list('rules', change_fragment)
+    @staticmethod
+    def apply_delta(json_dict, delta):
+        """
+        Apply one delta to json_dict, in place. To apply a run of deltas, a single
+        DocReplay is faster.
+        """
+        replay = DocReplay(json_dict)
+        replay.apply(delta)
+        replay.state()
 
     def resolve(self, as_of:str = None) -> dict:
         f = self.file
@@ -81,14 +63,40 @@ class DIDDoc:
         g = f.genesis
         if not g:
             return
-        json_dict = g.change_json_dict
-        for item in self.file.deltas[1:]:
-            if as_of and (item.when > as_of):
-                break
-            self.apply_delta(json_dict, item)
+        # An unloaded (lazy) file only needs to be read up to the as_of cutoff.
+        if f.loaded or not as_of:
+            end = f.time_index.cutoff(as_of) if as_of else None
+            json_dict = self.resolver.resolve(f.deltas, as_of, end=end)
+        else:
+            json_dict = self.resolver.resolve(list(f.iter_deltas(as_of)), as_of, partial=True)
         json_dict['id'] = self.did
         return json_dict
 
+    def resolve_as_of_times(self, times: List[str]) -> List[dict]:
+        """
+        Resolve the doc as of each of several times (None meaning now), with one
+        replay of its history. Returns a doc per time, in the same order.
+        """
+        f = self.file
+        if not (f and f.genesis):
+            return [None] * len(times)
+        index = f.time_index
+        docs = self.resolver.resolve_at(f.deltas, [index.cutoff(t) for t in times])
+        for json_dict in docs:
+            json_dict['id'] = self.did
+        return docs
+
+    @property
+    def resolver(self) -> Resolver:
+        """
+        Remembers checkpoints of resolved state, so repeated calls to .resolve() only
+        replay deltas added since the nearest checkpoint. Pass the same Resolver to
+        new DIDDoc instances for the same DID to share that work.
+        """
+        if self._resolver is None:
+            self._resolver = Resolver(DocReplay)
+        return self._resolver
+
     @property
     def did(self) -> str:
         f = self.file
@@ -96,6 +104,114 @@ class DIDDoc:
             return f.did
 
 
+# Marks the slot of a deleted item until its list is compacted.
+_GONE = object()
+
+
+class _ListIndex:
+    """
+    Maps the ids of the items in one list of a doc to their positions.
+    """
+    __slots__ = ('items', 'positions', 'holes')
+
+    def __init__(self, items: list):
+        self.items = items
+        self.positions = {}
+        self.holes = 0
+        for i, item in enumerate(items):
+            self.positions.setdefault(_item_id(item), []).append(i)
+
+
+def _item_id(item):
+    """
+    The id that a "deleted" entry would use for item: keys and rules have an "id",
+    authorization profiles name a "key", authentication can hold bare references.
+    "#key-1" and "key-1" are the same id.
+    """
+    if isinstance(item, dict):
+        item = item.get('id') or item.get('key')
+    if isinstance(item, str):
+        return fragment(item)
+
+
+class DocReplay(Replay):
+    """
+    Applies a run of deltas to a resolved doc. Lists that deltas delete from
+    (publicKey, authentication, authorization.profiles) get an id -> position index
+    the first time a delete touches them, which lives until .state(); deletes leave
+    a hole that .state() compacts away. So each add or delete costs O(1) amortized,
+    instead of a scan of the list.
+    """
+    _INDEXED = ('publicKey', 'authentication', 'profiles')
+
+    def __init__(self, state: dict):
+        Replay.__init__(self, state)
+        self._indexes = {}
+
+    def _list(self, name, create=False) -> list:
+        container = self._state
+        if name == 'profiles':
+            container = container.get('authorization')
+            if not isinstance(container, dict):
+                if not create:
+                    return
+                container = self._state['authorization'] = {}
+        items = container.get(name)
+        if not items and create:
+            items = container[name] = []
+        return items
+
+    def _add(self, name, items):
+        if not items:
+            return
+        target = self._list(name, True)
+        index = self._indexes.get(name)
+        for item in items:
+            item = thaw_json(item)
+            if index:
+                index.positions.setdefault(_item_id(item), []).append(len(target))
+            target.append(item)
+
+    def _remove(self, name, id):
+        index = self._indexes.get(name)
+        if index is None:
+            items = self._list(name)
+            if not items:
+                return
+            index = self._indexes[name] = _ListIndex(items)
+        positions = index.positions.get(id)
+        if positions:
+            index.items[positions.pop(0)] = _GONE
+            index.holes += 1
+            if not positions:
+                del index.positions[id]
+
+    def apply(self, delta):
+        # Read-only and shared; whatever goes into the doc is copied by _add().
+        change = delta.change_json_view
+        deleted = change.get('deleted')
+        if deleted:
+            self._add('deleted', deleted)
+            for ref in deleted:
+                id = _item_id(ref)
+                for name in self._INDEXED:
+                    self._remove(name, id)
+        if change.get('publicKey'):
+            self._add('publicKey', change['publicKey'])
+            self._add('authentication', change.get('authentication'))
+            authorization = change.get('authorization')
+            if authorization:
+                self._add('profiles', authorization.get('profiles'))
+        self._add('rules', change.get('rules'))
+
+    def state(self):
+        for index in self._indexes.values():
+            if index.holes:
+                index.items[:] = [item for item in index.items if item is not _GONE]
+        self._indexes.clear()
+        return self._state
+
+
 _predefined_diddoc_template = """\
 {
     "@context": "https://w3id.org/did/v1",
@@ -144,119 +260,66 @@ def get_predefined(which) -> str:
 """
 
 
-class ValidationError(BaseException):
-    def __init__(self, msg):
-        BaseException.__init__(self, msg)
-
-
-
-def _require(dict, key, value_type, contained_type=None, allow_empty=False, regex=None, allow_missing=False):
-    class Missing: pass
-    missing = Missing()
-    value = dict.get(key, missing)
-    if value is missing:
-        if not allow_missing:
-            raise ValidationError('Missing "%s" property' % key)
-    else:
-        if not isinstance(value, value_type):
-            raise ValidationError('Property "%s" is of wrong type. Expected %s, not %s.' % (
-                key, type(value).__name__, value_type.__name__))
-        if contained_type:
-            if len(x) == 0:
-                if not allow_empty:
-                    raise ValidationError('Property "%s" cannot be empty.' % key)
-            else:
-                i = 0
-                for item in value:
-                    if not isinstance(item, contained_type):
-                        raise ValidationError('Item %s[%d] is of wrong type. Expected %s, not %s.' % (
-                            key, i, contained_type.__name__, type(item).__name__
-                        ))
-                    i += 1
-                if regex:
-                    i = 0
-                    for item in value:
-                        if not regex.match(item):
-                            raise ValidationError('Item %s[%d] doesn\'t match regex "%s".' % (
-                                key, i, regex.pattern
-                            ))
-                        i += 1
-        elif regex:
-            if not regex.match(value):
-                raise ValidationError('Property "%s" doesn\'t match regex "%s".' % (
-                    key, regex.pattern
-                ))
-
-
-def validate(did_doc):
-    json_dict = None
-    if isinstance(did_doc, bytes):
-        json_text = did_doc.decode("utf-8")
-    elif isinstance(did_doc, str):
-        pass
-    elif isinstance(did_doc, dict):
-        json_dict = did_doc
-    else:
-        raise ValidationError('Bad datatype. Expected bytes, string, or JSON dict, not %s.' % did_doc.__class__.__name__)
-    if not json_dict:
-        json_dict = json.loads(did_doc)
-    _require(json_dict, '@context', str, regex=re.compile(r'https://w3id.org/did/v1'))
-
-
-def _get_object_subset(set_a, set_b):
-    matched = []
-    i = 0
-    for a_item in set_a:
-        found = False
-        for b_item in set_b:
-            if b_item not in matched:
-                path = _get_path_where_jsonld_objects_differ(a_item, b_item, '')
-                if not path:
-                    matched.append(b_item)
-                    found = True
-                    break
-        if not found:
-            return i, None
-    return None, matched
-
-
-def _get_path_where_jsonld_sets_differ(a_value, b_value, path):
+def _canonical(value, memo: dict) -> str:
+    """
+    A string that is equal for two JSON-LD values exactly when they are equivalent:
+    object keys are sorted, lists of scalars compare as sets, and lists of objects
+    (or of lists) compare as multisets. Computed once per container; memo maps
+    id(container) to its canonical form for the duration of one comparison.
+    """
+    if isinstance(value, dict):
+        c = memo.get(id(value))
+        if c is None:
+            c = memo[id(value)] = '{' + ','.join(
+                json.dumps(k) + ':' + _canonical(v, memo) for k, v in sorted(value.items())) + '}'
+        return c
+    if isinstance(value, list):
+        c = memo.get(id(value))
+        if c is None:
+            items = [_canonical(v, memo) for v in value]
+            if value and not isinstance(value[0], (dict, list)):
+                items = set(items)
+            c = memo[id(value)] = '[' + ','.join(sorted(items)) + ']'
+        return c
+    return json.dumps(value)
+
+
+def _get_path_where_jsonld_sets_differ(a_value, b_value, path, memo):
     if not a_value:
         if not b_value:
             return None
         return path
-    set_of_objects = bool(isinstance(a_value[0], dict))
-    if set_of_objects:
-        gap_idx, matches_in_b = _get_object_subset(a_value, b_value)
-        if gap_idx is not None:
-            return path + '[%d]' % gap_idx
-        # a_value is a subset of b. Prove that b is also a subset of a.
-        # Normally this should be trivial (make sure the lists are the same
-        # length) -- but it's possible for one list to contain the same item
-        # more than once. Since JSON-LD defines sequences as sets, not lists,
-        # comparison has to be a bit more careful.
-        if len(matches_in_b) < len(b_value):
-            remainder = [b_item for b_item in b_value if b_item not in matches_in_b]
-            gap_idx, matches_in_a = _get_object_subset(remainder, a_value)
-            if not matches_in_a:
-                return path
+    if isinstance(a_value[0], (dict, list)):
+        # Match the sets through a multiset of canonical forms, in one pass over
+        # each side, instead of comparing every pair of items.
+        remaining = {}
+        for b_item in b_value:
+            c = _canonical(b_item, memo)
+            remaining[c] = remaining.get(c, 0) + 1
+        for i, a_item in enumerate(a_value):
+            c = _canonical(a_item, memo)
+            n = remaining.get(c)
+            if not n:
+                return path + '[%d]' % i
+            remaining[c] = n - 1
+        # a_value is a subset of b. Anything left over in b means b is bigger.
+        # (JSON-LD sequences are sets, but an object that appears twice on one side
+        # has to appear twice on the other.)
+        if any(remaining.values()):
+            return path
         return None
     else:
-        set_of_sets = bool(isinstance(a_value[0], list))
-        if set_of_sets:
-            raise NotImplemented
-        else:
-            if set(a_value) != set(b_value):
-                return path
+        if {_canonical(x, memo) for x in a_value} != {_canonical(x, memo) for x in b_value}:
+            return path
 
 
-def _get_path_where_jsonld_objects_differ(a, b, path):
+def _get_path_where_jsonld_objects_differ(a, b, path, memo):
     a_keys = set(a.keys())
     b_keys = set(b.keys())
     if a_keys != b_keys:
         missing = {a for a in a_keys if a not in b_keys}
         missing = missing.union({b for b in b_keys if b not in a_keys})
-        return path + '.{' + ','.join(missing) + '}'
+        return path + '.{' + ','.join(sorted(missing)) + '}'
     for key, a_value in a.items():
         subpath = path + '.' + key
         a_type = type(a_value)
@@ -264,11 +327,11 @@ def _get_path_where_jsonld_objects_differ(a, b, path):
         if type(b_value) != a_type:
             return subpath
         if a_type is list:
-            diff_path = _get_path_where_jsonld_sets_differ(a_value, b_value, subpath)
+            diff_path = _get_path_where_jsonld_sets_differ(a_value, b_value, subpath, memo)
             if diff_path:
                 return diff_path
         elif a_type is dict:
-            diff_path = _get_path_where_jsonld_objects_differ(a_value, b_value)
+            diff_path = _get_path_where_jsonld_objects_differ(a_value, b_value, subpath, memo)
             if diff_path:
                 return diff_path
         else:
@@ -291,4 +354,151 @@ def as_dict(did_doc):
 def get_path_where_diddocs_differ(did_doc_1, did_doc_2):
     did_doc_1 = as_dict(did_doc_1)
     did_doc_2 = as_dict(did_doc_2)
-    return _get_path_where_jsonld_objects_differ(did_doc_1, did_doc_2, '')
\ No newline at end of file
+    return _get_path_where_jsonld_objects_differ(did_doc_1, did_doc_2, '', {})
+
+def _is_set_of_scalars(items):
+    return not any(isinstance(x, (dict, list)) for x in items)
+
+
+def _diff_objects(a, b, path, memo, patch):
+    for key, a_value in a.items():
+        subpath = path + [key]
+        if key not in b:
+            patch.append({"op": "removed", "path": subpath})
+            continue
+        b_value = b[key]
+        if type(a_value) != type(b_value):
+            patch.append({"op": "changed", "path": subpath, "value": b_value})
+        elif isinstance(a_value, dict):
+            _diff_objects(a_value, b_value, subpath, memo, patch)
+        elif isinstance(a_value, list):
+            _diff_sets(a_value, b_value, subpath, memo, patch)
+        elif a_value != b_value:
+            patch.append({"op": "changed", "path": subpath, "value": b_value})
+    for key, b_value in b.items():
+        if key not in a:
+            patch.append({"op": "added", "path": path + [key], "value": b_value})
+
+
+def _id_counts(items):
+    counts = {}
+    for x in items:
+        if isinstance(x, dict) and isinstance(x.get('id'), str):
+            counts[x['id']] = counts.get(x['id'], 0) + 1
+    return counts
+
+
+def _diff_sets(a_value, b_value, path, memo, patch):
+    if _is_set_of_scalars(a_value) and _is_set_of_scalars(b_value):
+        a_set = {_canonical(x, memo) for x in a_value}
+        b_set = {_canonical(x, memo) for x in b_value}
+        seen = set()
+        for x in a_value:
+            c = _canonical(x, memo)
+            if c not in b_set and c not in seen:
+                seen.add(c)
+                patch.append({"op": "removed", "path": path, "member": x})
+        for x in b_value:
+            c = _canonical(x, memo)
+            if c not in a_set and c not in seen:
+                seen.add(c)
+                patch.append({"op": "added", "path": path, "member": x})
+        return
+    remaining = {}
+    for x in b_value:
+        c = _canonical(x, memo)
+        remaining.setdefault(c, []).append(x)
+    a_left = []
+    for x in a_value:
+        matches = remaining.get(_canonical(x, memo))
+        if matches:
+            matches.pop()
+        else:
+            a_left.append(x)
+    b_left = [x for items in remaining.values() for x in items]
+    # Objects with the same id on both sides are the same thing, changed; describe
+    # the change inside them rather than as a removal plus an addition. A path can
+    # only name a member by id if no other member of the set shares it, though.
+    a_ids, b_ids = _id_counts(a_value), _id_counts(b_value)
+    b_by_id = {}
+    for x in b_left:
+        if isinstance(x, dict) and isinstance(x.get('id'), str):
+            b_by_id[x['id']] = x
+    paired = set()
+    for x in a_left:
+        key = x.get('id') if isinstance(x, dict) else None
+        if isinstance(key, str) and a_ids.get(key) == 1 and b_ids.get(key) == 1 and key in b_by_id:
+            y = b_by_id.pop(key)
+            paired.add(id(y))
+            _diff_objects(x, y, path + [{"id": key}], memo, patch)
+        else:
+            patch.append({"op": "removed", "path": path, "member": x})
+    for y in b_left:
+        if id(y) not in paired:
+            patch.append({"op": "added", "path": path, "member": y})
+
+
+def diff_diddocs(did_doc_1, did_doc_2) -> list:
+    """
+    Describe every difference between two DID docs, in one pass, as a patch that
+    apply_patch can replay: a list of JSON-serializable operations.
+
+        {"op": "added"|"changed", "path": [...], "value": v}  -- set a property
+        {"op": "removed", "path": [...]}                      -- delete a property
+        {"op": "added"|"removed", "path": [...], "member": v} -- add to/remove from a set
+
+    Paths are lists of property names; {"id": x} selects the member of a set whose
+    id is x. Sets follow JSON-LD semantics, as in get_path_where_diddocs_differ.
+    Returns [] if the docs are equivalent.
+    """
+    patch = []
+    _diff_objects(as_dict(did_doc_1), as_dict(did_doc_2), [], {}, patch)
+    return patch
+
+
+def _follow(container, segment):
+    if isinstance(segment, dict):
+        found = [item for item in container if isinstance(item, dict) and item.get('id') == segment['id']]
+        if len(found) != 1:
+            raise KeyError('%s item with id "%s".' % ('No' if not found else 'More than one', segment['id']))
+        return found[0]
+    return container[segment]
+
+
+def apply_patch(did_doc, patch: list) -> dict:
+    """
+    Apply a patch from diff_diddocs to a DID doc, returning the patched doc as a new
+    dict. Raises KeyError if the patch refers to something that isn't there.
+    """
+    doc = copy.deepcopy(as_dict(did_doc))
+    for op in patch:
+        path = op["path"]
+        if "member" in op:
+            target = doc
+            for segment in path:
+                target = _follow(target, segment)
+            member = op["member"]
+            memo = {}
+            c = _canonical(member, memo)
+            if op["op"] == "added":
+                if isinstance(member, (dict, list)) or c not in {_canonical(x, memo) for x in target}:
+                    target.append(copy.deepcopy(member))
+            else:
+                matches = [i for i, x in enumerate(target) if _canonical(x, memo) == c]
+                if not matches:
+                    raise KeyError('No such member at %s.' % path)
+                if not isinstance(member, (dict, list)):
+                    # A set of scalars; drop every copy.
+                    for i in reversed(matches):
+                        del target[i]
+                else:
+                    del target[matches[0]]
+        else:
+            parent = doc
+            for segment in path[:-1]:
+                parent = _follow(parent, segment)
+            if op["op"] == "removed":
+                del parent[path[-1]]
+            else:
+                parent[path[-1]] = copy.deepcopy(op["value"])
+    return doc
@@ -1,6 +1,8 @@
 import os
 
 from .delta import Delta
+from .resolver import TimeIndex
+from .storage import Storage, DirectoryStorage
 
 
 class FileMisuseError(IOError):
@@ -8,37 +10,189 @@ class FileMisuseError(IOError):
         IOError.__init__(self, msg)
 
 
+class _Deltas(list):
+    """
+    The list behind File.deltas. Notes when it is changed other than by adding to
+    the end, so that File.save() knows to rewrite the file instead of appending.
+    .edits counts those changes, for the Resolver and the TimeIndex, which keep
+    what they built from the deltas as long as the list is only appended to.
+    """
+    rewritten = False
+    edits = 0
+
+    def _edited(self):
+        self.rewritten = True
+        self.edits += 1
+
+    def __setitem__(self, i, value):
+        self._edited()
+        list.__setitem__(self, i, value)
+
+    def __delitem__(self, i):
+        self._edited()
+        list.__delitem__(self, i)
+
+    def __imul__(self, n):
+        self._edited()
+        return list.__imul__(self, n)
+
+    def insert(self, i, value):
+        self._edited()
+        list.insert(self, i, value)
+
+    def pop(self, i=-1):
+        self._edited()
+        return list.pop(self, i)
+
+    def remove(self, value):
+        self._edited()
+        list.remove(self, value)
+
+    def clear(self):
+        self._edited()
+        list.clear(self)
+
+    def reverse(self):
+        self._edited()
+        list.reverse(self)
+
+    def sort(self, *args, **kwargs):
+        self._edited()
+        list.sort(self, *args, **kwargs)
+
+
 class File:
     """
     Provides backing storage for a single peer DID.
+
+    Deltas are only ever added at the end, so saving normally appends just the new
+    lines (O_APPEND) instead of rewriting the file. Turn autosave off and call .save()
+    to commit several appends with a single write (and a single fsync, if fsync=True).
+    If the history itself changes (the .deltas list is edited rather than appended
+    to), .save() falls back to writing a temp file and atomically renaming it.
+
+    The actual I/O goes through a peerdid.storage backend. By default that is a
+    DirectoryStorage for the folder containing path; pass storage to keep the file
+    somewhere else, in which case the last component of path names it there.
+
+    With lazy=True, nothing is read until it's needed: .genesis (and so .did) reads
+    only the first line, .iter_deltas() streams, and each delta's change is decoded
+    only when it is accessed.
     """
 
-    def __init__(self, path, autosave=True):
+    def __init__(self, path, autosave=True, fsync=False, lazy=False, storage: Storage = None):
         self.path = os.path.normpath(path)
-        self.deltas = []
+        if storage is None:
+            storage = DirectoryStorage(os.path.dirname(self.path))
+        self.storage = storage
+        self.name = os.path.basename(self.path)
+        self._deltas = _Deltas()
         self.dirty = False
         self.autosave = autosave
+        self.fsync = fsync
+        self.lazy = lazy
         self._did = None
-        if os.path.exists(self.path):
+        self._genesis = None
+        # How many of .deltas are known to be on disk, and the last of them. Used to
+        # tell an append (write the tail) from a rewrite (write everything).
+        self._saved_count = 0
+        self._last_saved = None
+        self._time_index = None
+        self._time_indexed_last = None
+        self._time_indexed_edits = None
+        if storage.exists(self.name):
+            if lazy:
+                # Read on demand; see .deltas, .genesis and .iter_deltas().
+                self._deltas = None
+            else:
+                self.load()
+
+    @property
+    def deltas(self):
+        if self._deltas is None:
             self.load()
+        return self._deltas
+
+    @deltas.setter
+    def deltas(self, value):
+        self._deltas = _Deltas(value)
+        # A whole new list may differ from what's saved anywhere.
+        self._deltas.rewritten = True
+
+    @property
+    def loaded(self) -> bool:
+        return self._deltas is not None
 
     def load(self, ignore_dirty=False):
         if (not ignore_dirty) and self.dirty:
             raise FileMisuseError("Can't load while in the dirty state.")
-        self.deltas = []
-        with open(self.path, 'rt') as f:
-            for line in f:
-                line = line.strip()
-                if line.startswith('{') and line.endswith('}'):
-                    self.deltas.append(Delta.from_json(line))
+        self._deltas = _Deltas(self._read_deltas())
+        self._genesis = None
+        self._mark_saved()
+
+    def _read_deltas(self, as_of=None):
+        yield from parse_deltas(self.storage.iter_records(self.name), self.lazy, as_of)
+
+    def iter_deltas(self, as_of=None):
+        """
+        Yield deltas in order, stopping before the first one (after genesis) that is
+        newer than as_of. If the file hasn't been loaded yet, this streams from disk
+        and stops reading at the cutoff instead of loading everything.
+        """
+        if self._deltas is None:
+            yield from self._read_deltas(as_of)
+        else:
+            for i, d in enumerate(self._deltas):
+                if as_of and i and d.when > as_of:
+                    break
+                yield d
+
+    @property
+    def time_index(self) -> TimeIndex:
+        """
+        A TimeIndex over .deltas, built on first use and extended as deltas are
+        appended (rebuilt if the history was otherwise changed: edited in place,
+        see _Deltas.edits, or reloaded).
+        """
+        deltas = self.deltas
+        index = self._time_index
+        n = len(index) if index else 0
+        if n and (deltas.edits != self._time_indexed_edits or n > len(deltas) or
+                  deltas[n - 1] is not self._time_indexed_last):
+            index, n = None, 0
+        if index is None:
+            index = self._time_index = TimeIndex()
+        for i in range(n, len(deltas)):
+            index.add(deltas[i])
+        if deltas:
+            self._time_indexed_last = deltas[-1]
+        self._time_indexed_edits = deltas.edits
+        return index
+
+    def _mark_saved(self):
+        self._saved_count = len(self.deltas)
+        self._last_saved = self.deltas[-1] if self.deltas else None
+        self.deltas.rewritten = False
         self.dirty = False
 
-    def save(self):
-        if self.dirty:
-            with open(self.path, 'wt') as f:
-                for d in self.deltas:
-                    f.write(d.to_json() + '\n')
-            self.dirty = False
+    @property
+    def history_rewritten(self) -> bool:
+        """
+        True if deltas that are already on disk have been changed or removed.
+        """
+        n = self._saved_count
+        if n == 0:
+            return False
+        return self.deltas.rewritten or len(self.deltas) < n or self.deltas[n - 1] is not self._last_saved
+
+    def save(self, rewrite=False):
+        if self.dirty or rewrite:
+            if rewrite or self.history_rewritten or \
+                    (self._saved_count and not self.storage.exists(self.name)):
+                self.storage.replace(self.name, [d.to_json() for d in self.deltas], self.fsync)
+            else:
+                self.storage.append(self.name, [d.to_json() for d in self.deltas[self._saved_count:]], self.fsync)
+            self._mark_saved()
 
     def append(self, delta: Delta, autosave: bool = None):
         self.deltas.append(delta)
@@ -50,8 +204,12 @@ class File:
 
     @property
     def genesis(self) -> Delta:
-        if self.deltas:
-                return self.deltas[0]
+        if self._deltas is None:
+            if self._genesis is None:
+                self._genesis = next(self._read_deltas(), None)
+            return self._genesis
+        if self._deltas:
+                return self._deltas[0]
 
     @property
     def did(self) -> str:
@@ -62,7 +220,37 @@ class File:
         return self._did
 
 
+_OPEN = ('{', b'{')
+_CLOSE = ('}', b'}')
+
+
+def delta_lines(lines):
+    """
+    Yield the lines of .ddd text (str or UTF-8 bytes) that hold deltas, stripped,
+    skipping anything that isn't a whole JSON object (such as a torn write).
+    """
+    for line in lines:
+        line = line.strip()
+        if line[:1] in _OPEN and line[-1:] in _CLOSE:
+            yield line
+
+
+def parse_deltas(lines, lazy=False, as_of=None):
+    """
+    Yield the deltas stored in lines of .ddd text (str or UTF-8 bytes), skipping
+    anything that isn't a whole JSON object, and stopping before the first delta
+    (after genesis) that is newer than as_of.
+    """
+    first = True
+    for line in delta_lines(lines):
+        d = Delta.from_json(line, lazy)
+        if as_of and (not first) and d.when > as_of:
+            break
+        first = False
+        yield d
+
+
 def canonical_fname(did_or_hash):
     if did_or_hash.startswith('did:peer:1z'):
         did_or_hash = did_or_hash[11:]
-    return did_or_hash + ".ddd"
\ No newline at end of file
+    return did_or_hash + ".ddd"
@@ -0,0 +1,136 @@
+"""
+An in-memory index of the DIDs held in a storage backend, keyed by the 32-byte
+digest each DID encodes rather than by its 45-char string.
+"""
+
+from bisect import bisect_left
+import threading
+from typing import Iterator
+
+from .codec import ALPHABET, DIGEST_LEN, ENCNUMBASIS_LEN, PEER_DID_PREFIX, SHA256_PREFIX
+from .codec import did_to_digest, digest_to_did
+from .delta import Delta
+from .file import delta_lines
+from .storage import Storage
+
+
+class IndexEntry:
+    """
+    Where a DID's log is kept (its name in storage), how many deltas it holds and
+    the .when of the last one. count and when are None until first asked for.
+    """
+    __slots__ = ('name', 'count', 'when')
+
+    def __init__(self, name: str, count: int = None, when: str = None):
+        self.name = name
+        self.count = count
+        self.when = when
+
+
+_DIGEST_SPACE = 1 << (DIGEST_LEN * 8)
+_BASE = SHA256_PREFIX[0] << (DIGEST_LEN * 8)
+_VALUES = {c: i for i, c in enumerate(ALPHABET)}
+
+
+def _prefix_range(prefix: str):
+    """
+    The [low, high) range of digests whose DIDs start with prefix, as ints. Fixed
+    width base58 in this alphabet sorts like the number it encodes, so a prefix of
+    the string is a range of numbers.
+    """
+    if prefix.startswith(PEER_DID_PREFIX):
+        prefix = prefix[len(PEER_DID_PREFIX):]
+    elif PEER_DID_PREFIX.startswith(prefix):
+        return 0, _DIGEST_SPACE
+    if len(prefix) > ENCNUMBASIS_LEN or any(c not in _VALUES for c in prefix):
+        return 0, 0
+    n = 0
+    for c in prefix:
+        n = n * 58 + _VALUES[c]
+    scale = 58 ** (ENCNUMBASIS_LEN - len(prefix))
+    return max(n * scale - _BASE, 0), min((n + 1) * scale - _BASE, _DIGEST_SPACE)
+
+
+class DIDIndex:
+    """
+    Maps the digest of each DID in a storage backend to an IndexEntry. Built from
+    storage.names() (for a DirectoryStorage, one os.scandir()), then kept current
+    by whoever writes through it calling .added(); changes made behind its back are
+    only seen after a rebuild. Names that aren't a DID's canonical file name are
+    ignored. Thread-safe.
+    """
+    def __init__(self, storage: Storage):
+        self.storage = storage
+        self._entries = {}
+        # Digests in sorted order, for iteration and prefix queries; rebuilt on
+        # demand after the set of DIDs changes.
+        self._sorted = None
+        self._lock = threading.Lock()
+        for name in storage.names():
+            try:
+                self._entries[did_to_digest(name)] = IndexEntry(name)
+            except ValueError:
+                pass
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, did):
+        try:
+            return did_to_digest(did) in self._entries
+        except (ValueError, AttributeError):
+            return False
+
+    def __iter__(self) -> Iterator[str]:
+        return self.with_prefix('')
+
+    def _order(self):
+        with self._lock:
+            if self._sorted is None:
+                self._sorted = sorted(self._entries)
+            return self._sorted
+
+    def with_prefix(self, prefix: str) -> Iterator[str]:
+        """
+        The DIDs that start with prefix (which may include "did:peer:1z", or not), in
+        sorted order.
+        """
+        low, high = _prefix_range(prefix)
+        if low >= high:
+            return
+        order = self._order()
+        i = bisect_left(order, low.to_bytes(DIGEST_LEN, 'big'))
+        end = len(order) if high == _DIGEST_SPACE else bisect_left(order, high.to_bytes(DIGEST_LEN, 'big'))
+        for digest in order[i:end]:
+            yield digest_to_did(digest)
+
+    def get(self, did) -> IndexEntry:
+        """
+        The entry for did, with its count and when filled in, or None if it isn't
+        indexed.
+        """
+        try:
+            entry = self._entries.get(did_to_digest(did))
+        except ValueError:
+            return
+        if entry is not None and entry.count is None:
+            count, last = 0, None
+            for last in delta_lines(self.storage.iter_records(entry.name)):
+                count += 1
+            entry.count = count
+            entry.when = Delta.from_json(last, True).when if last else None
+        return entry
+
+    def added(self, did, name: str, delta: Delta, new: bool = False):
+        """
+        Record that delta was appended to the log of did; new means it created the log.
+        """
+        digest = did_to_digest(did)
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is None:
+                self._entries[digest] = IndexEntry(name, 1, delta.when) if new else IndexEntry(name)
+                self._sorted = None
+            elif entry.count is not None:
+                entry.count += 1
+                entry.when = delta.when
@@ -1,33 +1,286 @@
+from collections import namedtuple
+import concurrent.futures
+import copy
+import json
 import os
+import threading
 
-from .diddoc import DIDDoc, get_predefined
+from .cache import LRUCache
+from .diddoc import DIDDoc, DocReplay, get_predefined
 from .delta import Delta
-from .file import File, canonical_fname
+from .file import File, canonical_fname, parse_deltas
+from .index import DIDIndex
+from .resolver import Resolver
+from .sidecar import SidecarCache
+from .storage import Storage, DirectoryStorage
 from . import is_valid_peer_did, is_reserved_peer_did
 
 
+ResolveResult = namedtuple('ResolveResult', ['did', 'doc', 'error'])
+
+
+def _resolve_bytes(data: bytes, as_of_time=None) -> dict:
+    """
+    Resolve the raw contents of a .ddd file. A module-level function so it can run in
+    a process pool.
+    """
+    deltas = list(parse_deltas(data.splitlines(), True, as_of_time))
+    if deltas:
+        json_dict = Resolver(DocReplay).resolve(deltas, as_of_time, partial=True)
+        json_dict['id'] = 'did:peer:1z' + deltas[0].encnumbasis
+        return json_dict
+
+
 class Repo:
     """
     Backing storage for a collection of peer DIDs.
     """
-    def __init__(self, path):
+    def __init__(self, path, cache_entries=1024, cache_bytes=32 * 1024 * 1024, storage: Storage = None,
+                 sidecar=False, fanout=None):
+        """
+        Resolved docs are cached in memory, LRU, up to cache_entries docs and
+        cache_bytes of serialized JSON (None = no byte limit; 0 entries = no cache).
+        A cached doc is only served while its file's storage signature (for the
+        default DirectoryStorage, its mtime_ns, size and inode) is unchanged; see
+        .cache.stats to size the cache.
+
+        storage picks the on-disk layout; by default, one .ddd file per DID in path.
+        fanout spreads those files over subfolders, for repos too big for one folder;
+        see DirectoryStorage. A repo keeps the fanout it was created with (use
+        peerdid.storage.reshard() to change it), so it only needs giving once.
+
+        sidecar=True also keeps each DID's latest resolved doc on disk, next to its
+        log (pass a folder to keep them somewhere else), so that after a restart
+        .resolve() can answer without replaying whole histories. See peerdid.sidecar.
+        """
         assert os.path.isdir(path)
         self.path = os.path.normpath(path)
+        self.storage = storage or DirectoryStorage(self.path, fanout)
+        self.cache = LRUCache(cache_entries, cache_bytes)
+        # Resolution checkpoints, by DID, kept across calls to .resolve().
+        self._resolvers = LRUCache(cache_entries)
+        # Loaded Files (with their TimeIndex), by DID, while their logs are unchanged.
+        self._files = LRUCache(cache_entries)
+        self._index = None
+        self._index_lock = threading.Lock()
+        self.sidecars = None
+        if sidecar:
+            self.sidecars = SidecarCache(sidecar if isinstance(sidecar, str) else (self.storage.path or self.path))
+
+    def _file(self, did_or_hash, lazy=False) -> File:
+        return File(os.path.join(self.path, canonical_fname(did_or_hash)), lazy=lazy, storage=self.storage)
+
+    @property
+    def index(self) -> DIDIndex:
+        """
+        An in-memory index of the DIDs in this repo, built on first use by listing
+        storage, and kept current by .new_doc() and .append(). DIDs that other
+        processes add are only seen after .reindex().
+        """
+        if self._index is None:
+            with self._index_lock:
+                if self._index is None:
+                    self._index = DIDIndex(self.storage)
+        return self._index
+
+    def reindex(self):
+        self._index = None
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, did):
+        return did in self.index
+
+    def __iter__(self):
+        """
+        The DIDs in this repo, in sorted order.
+        """
+        return iter(self.index)
+
+    def dids(self, prefix: str = ''):
+        """
+        The DIDs in this repo that start with prefix, in sorted order.
+        """
+        return self.index.with_prefix(prefix)
 
     def new_doc(self, genesis_doc, signatures=[]):
         delta = Delta(genesis_doc, signatures)
-        path = os.path.join(self.path, canonical_fname(delta.encnumbasis))
-        f = File(path)
+        f = self._file(delta.encnumbasis)
         f.append(delta)
+        self.cache.invalidate((f.did, None))
+        if self._index is not None:
+            self._index.added(f.did, f.name, delta, new=len(f.deltas) == 1)
         return f.did
 
+    def append(self, did, delta: Delta):
+        known = self._index is not None and did in self._index
+        if not (is_valid_peer_did(did) and (known or self.storage.exists(canonical_fname(did)))):
+            raise ValueError('Unknown DID "%s".' % did)
+        # Just the new line; there's no need to read the log to add to it.
+        self.storage.append(canonical_fname(did), [delta.to_json()])
+        self.cache.invalidate((did, None))
+        if self._index is not None:
+            self._index.added(did, canonical_fname(did), delta)
+
+    def _resolver(self, did) -> Resolver:
+        resolver = self._resolvers.get(did)
+        if resolver is None:
+            resolver = Resolver(DocReplay)
+            self._resolvers.put(did, resolver)
+        return resolver
+
+    def _loaded_file(self, did, signature):
+        """
+        The File for did, loaded, and a lock to hold while using it. Kept while the
+        log's storage signature stays the same, so that its TimeIndex is built once
+        rather than for every as_of query.
+        """
+        entry = self._files.get(did, signature)
+        if entry is None:
+            f = self._file(did, lazy=True)
+            f.deltas
+            entry = (f, threading.Lock())
+            self._files.put(did, entry, 0, signature)
+        return entry
 
     def resolve(self, did, as_of_time=None):
         if is_valid_peer_did(did):
             if is_reserved_peer_did(did):
                 return get_predefined(did[13])
             else:
-                path = os.path.join(self.path, canonical_fname(did))
-                if os.path.isfile(path):
-                    doc = DIDDoc(path)
-                    return doc.resolve(as_of_time)
+                signature = self.storage.signature(canonical_fname(did))
+                if signature is None:
+                    return
+                key = (did, as_of_time)
+                json_dict = self.cache.get(key, signature)
+                if json_dict is None:
+                    if self.sidecars and not as_of_time:
+                        json_dict = self.sidecars.resolve(self.storage, canonical_fname(did), DocReplay)
+                        if json_dict is not None:
+                            json_dict['id'] = did
+                    else:
+                        f, lock = self._loaded_file(did, signature)
+                        with lock:
+                            json_dict = DIDDoc(f, self._resolver(did)).resolve(as_of_time)
+                    if json_dict is None:
+                        return
+                    self.cache.put(key, json_dict, len(json.dumps(json_dict)), signature)
+                return copy.deepcopy(json_dict)
+
+    def resolve_as_of_times(self, did, times):
+        """
+        Resolve one DID as of each of several times (None meaning now). Returns a doc
+        per time, in the same order. Times that aren't cached are resolved together,
+        with one replay of the DID's history.
+        """
+        if not is_valid_peer_did(did):
+            return [None] * len(times)
+        if is_reserved_peer_did(did):
+            return [get_predefined(did[13]) for t in times]
+        signature = self.storage.signature(canonical_fname(did))
+        if signature is None:
+            return [None] * len(times)
+        found = {}
+        for t in times:
+            if t not in found:
+                found[t] = self.cache.get((did, t), signature)
+        missing = [t for t, json_dict in found.items() if json_dict is None]
+        if missing:
+            f, lock = self._loaded_file(did, signature)
+            with lock:
+                docs = DIDDoc(f, self._resolver(did)).resolve_as_of_times(missing)
+            for t, json_dict in zip(missing, docs):
+                if json_dict is not None:
+                    self.cache.put((did, t), json_dict, len(json.dumps(json_dict)), signature)
+                found[t] = json_dict
+        return [copy.deepcopy(found[t]) for t in times]
+
+    def resolve_many(self, dids, as_of_time=None, executor=None, max_workers=None):
+        """
+        Resolve many DIDs at once. Returns a ResolveResult(did, doc, error) for each
+        item in dids, in the same order; doc is None for unknown DIDs, and error holds
+        the exception if resolving that DID failed.
+
+        Duplicates are resolved once, and cache hits are served directly. Remaining
+        files are read in name order on the calling thread, and the parse-and-replay
+        work is handed to executor: None to do it inline, 'thread' or 'process' for a
+        pool of max_workers that lives for this call, or any concurrent.futures
+        Executor. At most max_workers files are in flight at once (default: the
+        executor's own limit, or os.cpu_count()).
+        """
+        # dids may be an iterator; it is read twice.
+        dids = list(dids)
+        unique = list(dict.fromkeys(dids))
+        results = {}
+        pending = []
+        for did in unique:
+            try:
+                if not is_valid_peer_did(did) or is_reserved_peer_did(did):
+                    results[did] = ResolveResult(did, self.resolve(did, as_of_time), None)
+                    continue
+                name = canonical_fname(did)
+                signature = self.storage.signature(name)
+                if signature is None:
+                    results[did] = ResolveResult(did, None, None)
+                    continue
+                json_dict = self.cache.get((did, as_of_time), signature)
+                if json_dict is None:
+                    pending.append((name, did))
+                else:
+                    results[did] = ResolveResult(did, copy.deepcopy(json_dict), None)
+            except Exception as e:
+                results[did] = ResolveResult(did, None, e)
+        pending.sort()
+
+        own_executor = None
+        if executor == 'thread':
+            executor = own_executor = concurrent.futures.ThreadPoolExecutor(max_workers)
+        elif executor == 'process':
+            executor = own_executor = concurrent.futures.ProcessPoolExecutor(max_workers)
+        elif executor is not None and not isinstance(executor, concurrent.futures.Executor):
+            raise ValueError('executor must be None, "thread", "process", or an Executor.')
+        if max_workers is None:
+            max_workers = getattr(executor, '_max_workers', None) or os.cpu_count() or 1
+
+        def finish(did, signature, json_dict, error=None):
+            if error is None and json_dict is not None:
+                self.cache.put((did, as_of_time), json_dict, len(json.dumps(json_dict)), signature)
+                json_dict = copy.deepcopy(json_dict)
+            results[did] = ResolveResult(did, json_dict, error)
+
+        try:
+            in_flight = {}
+            for name, did in pending:
+                try:
+                    # Signature first: if the log grows in between, the cached result
+                    # is newer than its signature, and just misses next time.
+                    signature = self.storage.signature(name)
+                    data = self.storage.read(name)
+                except Exception as e:
+                    finish(did, None, None, e)
+                    continue
+                if executor is None:
+                    try:
+                        finish(did, signature, _resolve_bytes(data, as_of_time))
+                    except Exception as e:
+                        finish(did, None, None, e)
+                    continue
+                in_flight[executor.submit(_resolve_bytes, data, as_of_time)] = (did, signature)
+                if len(in_flight) >= max_workers:
+                    done, _ = concurrent.futures.wait(in_flight, return_when=concurrent.futures.FIRST_COMPLETED)
+                    for future in done:
+                        finish(*in_flight.pop(future), *self._outcome(future))
+            for future in concurrent.futures.as_completed(in_flight):
+                finish(*in_flight[future], *self._outcome(future))
+        finally:
+            if own_executor:
+                own_executor.shutdown()
+        return [results[did] for did in dids]
+
+    @staticmethod
+    def _outcome(future):
+        try:
+            return future.result(), None
+        except Exception as e:
+            return None, e
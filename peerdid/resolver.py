@@ -0,0 +1,252 @@
+from bisect import bisect_left, bisect_right
+import copy
+import threading
+import weakref
+from typing import Callable, List, Type, Union
+
+from .delta import Delta
+
+
+# How many deltas to replay between resolved-state checkpoints.
+DEFAULT_CHECKPOINT_INTERVAL = 64
+
+
+class Checkpoint:
+    """
+    The resolved state of a DID doc immediately after the delta at .index was applied.
+    .when is the latest timestamp among the deltas that were replayed to reach this
+    state, so the checkpoint can serve any as_of query that is >= .when.
+    """
+    def __init__(self, index: int, when: str, state: dict):
+        self.index = index
+        self.when = when
+        self.state = state
+
+
+class TimeIndex:
+    """
+    Finds where an as_of cutoff falls in a list of deltas by bisection instead of a
+    scan. The cutoff is the first delta after genesis that is newer than as_of. That
+    is also the first place where the running maximum of .when exceeds as_of, and a
+    running maximum never decreases, so it can be bisected even when deltas are out
+    of order. Call .add() for each delta appended to the list.
+    """
+    def __init__(self, deltas: List[Delta] = ()):
+        # latest[i] is the newest .when among deltas[1..i]; genesis never cuts off.
+        self.latest = []
+        for d in deltas:
+            self.add(d)
+
+    def add(self, delta: Delta):
+        latest = self.latest
+        latest.append(max(latest[-1], delta.when) if latest else '')
+
+    def __len__(self):
+        return len(self.latest)
+
+    def cutoff(self, as_of: str = None) -> int:
+        """
+        How many deltas (genesis included) are in effect as of as_of.
+        """
+        n = len(self.latest)
+        if not as_of or not n:
+            return n
+        return bisect_right(self.latest, as_of, 1)
+
+
+def _scan_cutoff(deltas: List[Delta], as_of: str) -> int:
+    for i in range(1, len(deltas)):
+        if deltas[i].when > as_of:
+            return i
+    return len(deltas)
+
+
+class _Indexes:
+    """
+    The .index of each of a (sorted) list of checkpoints, as a sequence for bisect.
+    """
+    def __init__(self, checkpoints: List[Checkpoint]):
+        self.checkpoints = checkpoints
+
+    def __len__(self):
+        return len(self.checkpoints)
+
+    def __getitem__(self, i):
+        return self.checkpoints[i].index
+
+
+class Replay:
+    """
+    Applies a run of deltas, in order, to one resolved state. This default calls an
+    apply_delta function for each; subclasses can keep indexes over the state for as
+    long as the run lasts. .state() returns the state as it stands, as a plain dict.
+    """
+    def __init__(self, state: dict, apply_delta: Callable[[dict, Delta], None] = None):
+        self._state = state
+        self._apply_delta = apply_delta
+
+    def apply(self, delta: Delta):
+        self._apply_delta(self._state, delta)
+
+    def state(self) -> dict:
+        return self._state
+
+
+class Resolver:
+    """
+    Turns a list of deltas into a resolved DID doc, remembering periodic checkpoints
+    of resolved state so later calls only replay the tail of the history. A Resolver
+    can be kept across calls (and across reloads of the underlying file), and shared
+    between threads; checkpoints that no longer match the deltas it is given are
+    discarded.
+
+    To know that, it remembers the hash of every delta its checkpoints were built
+    from, and checks the deltas it is given against them. A list that counts its
+    edits, as File.deltas does, is only checked in full when it is new to the
+    Resolver or was changed other than by appending to it; any other list is
+    checked in full on every call.
+
+    apply is either a function that applies one delta to a state in place, or a
+    Replay subclass, which is instantiated once per replay.
+    """
+    def __init__(self, apply: Union[Callable[[dict, Delta], None], Type[Replay]],
+                 interval: int = DEFAULT_CHECKPOINT_INTERVAL):
+        if isinstance(apply, type) and issubclass(apply, Replay):
+            self._replay = apply
+        else:
+            self._replay = lambda state: Replay(state, apply)
+        self.interval = max(1, interval)
+        # Sorted by .index.
+        self.checkpoints = []
+        self._tip = None
+        # .hash of each delta replayed so far, and the list (with its edit count) that
+        # they were last found to match.
+        self._hashes = []
+        self._checked = None
+        self._checked_edits = None
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        self.checkpoints = []
+        self._tip = None
+        self._hashes = []
+        self._checked = None
+
+    def _forget(self, n: int):
+        # Drop everything built from deltas[n] or later.
+        del self.checkpoints[bisect_left(_Indexes(self.checkpoints), n):]
+        if self._tip and self._tip.index >= n:
+            self._tip = None
+        del self._hashes[n:]
+
+    def _check(self, deltas: List[Delta], partial: bool):
+        """
+        Forget checkpoints built from deltas other than the ones in deltas. With
+        partial, deltas may end early; otherwise, whatever lies past its end is gone.
+        """
+        edits = getattr(deltas, 'edits', None)
+        if edits is not None and self._checked is not None and self._checked() is deltas and \
+                edits == self._checked_edits:
+            # Only appended to since we last looked.
+            return
+        hashes = self._hashes
+        n = min(len(hashes), len(deltas))
+        i = 0
+        while i < n and deltas[i].hash == hashes[i]:
+            i += 1
+        if i < len(hashes) and (i < len(deltas) or not partial):
+            self._forget(i)
+        self._checked = weakref.ref(deltas) if edits is not None else None
+        self._checked_edits = edits
+
+    def _nearest(self, end: int) -> Checkpoint:
+        """
+        The checkpoint furthest along among those before end.
+        """
+        tip = self._tip
+        if tip and tip.index < end:
+            # Nothing has been resolved further than the tip.
+            return tip
+        cps = self.checkpoints
+        i = bisect_left(_Indexes(cps), end) - 1
+        if i >= 0:
+            return cps[i]
+
+    def resolve(self, deltas: List[Delta], as_of: str = None, partial: bool = False, end: int = None) -> dict:
+        """
+        Return a fresh dict holding the resolved state of deltas, ignoring any
+        delta from the first one newer than as_of onward. Caller owns the result.
+        Pass partial=True if deltas is only the part of the history that precedes
+        as_of, so checkpoints beyond its end are kept rather than discarded. If the
+        caller knows where the cutoff is (see TimeIndex), pass it as end instead of
+        as_of, and the deltas aren't scanned for it.
+        """
+        if not deltas:
+            return
+        if end is None:
+            end = _scan_cutoff(deltas, as_of) if as_of else len(deltas)
+        with self._lock:
+            return self._resolve(deltas, [end], partial)[0]
+
+    def resolve_at(self, deltas: List[Delta], ends: List[int], partial: bool = False) -> List[dict]:
+        """
+        Resolve several prefixes of deltas at once: for each n in ends, the state
+        after the first n deltas (None if n is 0), in the same order as ends. The
+        replay starts from the checkpoint nearest the smallest n and walks forward
+        once, so k prefixes cost one replay plus k copies. Caller owns the results.
+        """
+        wanted = sorted(set(n for n in ends if n > 0))
+        if not (deltas and wanted):
+            return [None] * len(ends)
+        with self._lock:
+            states = dict(zip(wanted, self._resolve(deltas, wanted, partial)))
+        results = []
+        given = set()
+        for n in ends:
+            state = states.get(n)
+            if n in given:
+                # Repeats get a copy.
+                state = copy.deepcopy(state)
+            given.add(n)
+            results.append(state)
+        return results
+
+    def _resolve(self, deltas, ends, partial):
+        self._check(deltas, partial)
+        replay, i, latest = None, -1, ''
+        # Only now that _check has dropped any checkpoints past a rewrite, so the
+        # next one is spaced from the last that's left.
+        last = self.checkpoints[-1].index if self.checkpoints else 0
+        hashes = self._hashes
+        states = []
+        for end in ends:
+            # Walk on from where the previous end left us, unless a checkpoint is
+            # closer; then the previous state can be handed out without a copy.
+            cp = self._nearest(end)
+            if cp and cp.index > i:
+                if replay:
+                    states.append(replay.state())
+                replay = self._replay(copy.deepcopy(cp.state))
+                i, latest = cp.index, cp.when
+            elif replay:
+                states.append(copy.deepcopy(replay.state()))
+            else:
+                json_dict = deltas[0].change_json_dict
+                self.checkpoints = [Checkpoint(0, '', copy.deepcopy(json_dict))]
+                hashes[:] = [deltas[0].hash]
+                replay, i, last = self._replay(json_dict), 0, 0
+            for i in range(i + 1, end):
+                item = deltas[i]
+                if i == len(hashes):
+                    hashes.append(item.hash)
+                replay.apply(item)
+                if item.when > latest:
+                    latest = item.when
+                if i - last >= self.interval:
+                    self.checkpoints.append(Checkpoint(i, latest, copy.deepcopy(replay.state())))
+                    last = i
+        json_dict = replay.state()
+        states.append(json_dict)
+        if (not self._tip) or i > self._tip.index:
+            self._tip = Checkpoint(i, latest, copy.deepcopy(json_dict))
+        return states
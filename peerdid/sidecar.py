@@ -0,0 +1,114 @@
+"""
+An on-disk cache of resolved DID docs. Next to each log it keeps the latest
+resolved doc, with the number of deltas that went into it, the hash of the last
+of them, and a digest of their serialized lines. A process that starts cold can
+then answer without parsing and replaying every DID's whole history; when deltas
+have been added since, only those are replayed.
+"""
+
+from collections import namedtuple
+import hashlib
+import json
+import os
+from typing import Type
+
+from .delta import Delta
+from .file import delta_lines
+from .resolver import Replay
+from .storage import DirectoryStorage, Storage
+
+
+Sidecar = namedtuple('Sidecar', ['count', 'hash', 'digest', 'doc'])
+
+
+class SidecarCache:
+    """
+    Sidecars live in a folder (by default, the one that holds the logs), one file
+    per log, named after it. Each file is a single line: a SHA-256 checksum of the
+    payload, a tab, and the payload as JSON. Files are replaced atomically, and one
+    that is missing, damaged, or no longer matches its log is simply ignored, so the
+    worst a bad sidecar can cost is a full replay.
+    """
+    SUFFIX = '.resolved'
+
+    def __init__(self, path, fsync=False):
+        self.path = os.path.normpath(path)
+        self.fsync = fsync
+        self._files = DirectoryStorage(self.path)
+
+    def path_for(self, name):
+        return self._files.path_for(name + self.SUFFIX)
+
+    def load(self, name) -> Sidecar:
+        """
+        The sidecar saved for name, or None if there isn't one or it is damaged.
+        """
+        try:
+            with open(self.path_for(name), 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return
+        checksum, _, payload = data.rstrip(b'\n').partition(b'\t')
+        if hashlib.sha256(payload).hexdigest().encode('ascii') != checksum:
+            return
+        try:
+            x = json.loads(payload.decode('utf-8'))
+            sidecar = Sidecar(x['count'], x['hash'], x['digest'], x['doc'])
+        except (ValueError, KeyError, TypeError):
+            return
+        if isinstance(sidecar.count, int) and sidecar.count > 0 and isinstance(sidecar.doc, dict):
+            return sidecar
+
+    def save(self, name, sidecar: Sidecar):
+        payload = json.dumps(sidecar._asdict())
+        checksum = hashlib.sha256(payload.encode('utf-8')).hexdigest()
+        self._files.replace(name + self.SUFFIX, [checksum + '\t' + payload], self.fsync)
+
+    def discard(self, name):
+        try:
+            os.unlink(self.path_for(name))
+        except FileNotFoundError:
+            pass
+
+    def resolve(self, storage: Storage, name: str, replay: Type[Replay]) -> dict:
+        """
+        Return the current resolved state of the log called name in storage, or None
+        if there is no such log. Starts from the sidecar if it still describes the
+        head of the log, replaying only the deltas added since; otherwise replays
+        everything. The sidecar is rewritten whenever anything was replayed.
+        """
+        lines = list(delta_lines(storage.iter_records(name)))
+        if not lines:
+            return
+        digest = hashlib.sha256()
+        sidecar = self.load(name)
+        if sidecar and sidecar.count <= len(lines):
+            for line in lines[:sidecar.count]:
+                digest.update(line)
+                digest.update(b'\n')
+            if digest.hexdigest() == sidecar.digest and \
+                    Delta.from_json(lines[sidecar.count - 1], True).hexhash == sidecar.hash:
+                if sidecar.count == len(lines):
+                    return sidecar.doc
+                start, json_dict = sidecar.count, sidecar.doc
+            else:
+                sidecar = None
+        else:
+            sidecar = None
+        if sidecar is None:
+            digest = hashlib.sha256()
+            digest.update(lines[0])
+            digest.update(b'\n')
+            start, json_dict = 1, Delta.from_json(lines[0], True).change_json_dict
+        r = replay(json_dict)
+        delta = None
+        for line in lines[start:]:
+            delta = Delta.from_json(line, True)
+            r.apply(delta)
+            digest.update(line)
+            digest.update(b'\n')
+        json_dict = r.state()
+        if delta is None:
+            delta = Delta.from_json(lines[0], True)
+        self.save(name, Sidecar(len(lines), delta.hexhash, digest.hexdigest(), json_dict))
+        return json_dict
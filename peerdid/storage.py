@@ -0,0 +1,594 @@
+"""
+Storage backends for delta logs. A backend holds one append-only log per name (for
+a Repo, the name is the DID's canonical_fname); each log is a sequence of text
+lines, one serialized delta per line. File and Repo do all their I/O through a
+backend, so the on-disk layout can change without touching them.
+
+Run "python -m peerdid.storage --help" for the compaction and migration tools.
+"""
+
+import argparse
+import json
+import mmap
+import os
+import sqlite3
+import tempfile
+import threading
+from typing import Iterable, Iterator, List
+
+
+class Storage:
+    """
+    Interface for storage backends.
+    """
+    path = None
+
+    def exists(self, name: str) -> bool:
+        raise NotImplementedError()
+
+    def signature(self, name: str):
+        """
+        A hashable value that changes whenever the log changes, or None if the log
+        doesn't exist. Used to tell whether cached results are still current.
+        """
+        raise NotImplementedError()
+
+    def iter_lines(self, name: str) -> Iterator[str]:
+        raise NotImplementedError()
+
+    def iter_records(self, name: str) -> Iterator[bytes]:
+        """
+        Like .iter_lines(), but yields raw UTF-8 bytes, which is all that parsing
+        needs. Backends override this when they can skip decoding to str.
+        """
+        for line in self.iter_lines(name):
+            yield line.encode('utf-8')
+
+    def read(self, name: str) -> bytes:
+        return ''.join(line + '\n' for line in self.iter_lines(name)).encode('utf-8')
+
+    def append(self, name: str, lines: List[str], fsync: bool = False):
+        """
+        Add lines to the end of a log, creating it if needed.
+        """
+        raise NotImplementedError()
+
+    def replace(self, name: str, lines: List[str], fsync: bool = False):
+        """
+        Atomically replace the whole content of a log.
+        """
+        raise NotImplementedError()
+
+    def names(self) -> Iterator[str]:
+        raise NotImplementedError()
+
+
+class DirectoryStorage(Storage):
+    """
+    The classic layout: one file per log, named after it, in a single folder.
+    Appends use O_APPEND; replacements write a temp file and atomically rename it.
+
+    Past a few hundred thousand files a flat folder gets slow, so the files can
+    instead fan out into subfolders named after the leading chars of each name:
+    with fanout (2, 2), "AbCdEf....ddd" lives in Ab/Cd/. The fanout of a folder is
+    recorded in its LAYOUT_FILE, which only exists if the folder isn't flat; pass
+    fanout when creating a storage to choose it for a new folder, and use reshard()
+    to change it for one that already holds logs.
+    """
+    LAYOUT_FILE = 'layout.json'
+
+    def __init__(self, path, fanout=None):
+        self.path = os.path.normpath(path)
+        self._layout_stamp = None
+        self._load_layout()
+        if fanout is not None and tuple(fanout) != self.fanout:
+            if self.previous is not None or next(self.names(), None) is not None:
+                raise ValueError('%s already has fanout %s; use reshard() to change it.' % (
+                    self.path, list(self.fanout)))
+            self._save_layout(tuple(fanout))
+
+    def _layout_path(self):
+        return os.path.join(self.path, self.LAYOUT_FILE)
+
+    def _load_layout(self):
+        """
+        Read the layout file. .previous is the fanout that a reshard in progress is
+        moving files away from, or None.
+        """
+        try:
+            with open(self._layout_path(), 'rt') as f:
+                stamp = os.fstat(f.fileno()).st_mtime_ns
+                layout = json.load(f)
+            self.fanout = tuple(layout.get('fanout', ()))
+            previous = layout.get('previous')
+            self.previous = tuple(previous) if previous is not None else None
+        except FileNotFoundError:
+            stamp = None
+            self.fanout, self.previous = (), None
+        self._layout_stamp = stamp
+
+    def _layout_changed(self) -> bool:
+        """
+        Reload the layout if another process has changed it since we read it.
+        """
+        try:
+            stamp = os.stat(self._layout_path()).st_mtime_ns
+        except FileNotFoundError:
+            stamp = None
+        if stamp == self._layout_stamp:
+            return False
+        self._load_layout()
+        return True
+
+    def _save_layout(self, fanout, previous=None):
+        path = self._layout_path()
+        if not fanout and previous is None:
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+        else:
+            layout = {"fanout": list(fanout)}
+            if previous is not None:
+                layout["previous"] = list(previous)
+            fd, tmp = tempfile.mkstemp(dir=self.path, prefix='.' + self.LAYOUT_FILE, suffix='.tmp')
+            with os.fdopen(fd, 'wt') as f:
+                json.dump(layout, f)
+            os.replace(tmp, path)
+        self._load_layout()
+
+    def _path_in(self, name, fanout):
+        parts = []
+        stem = name.split('.', 1)[0]
+        if fanout and len(stem) >= sum(fanout):
+            i = 0
+            for width in fanout:
+                parts.append(stem[i:i + width])
+                i += width
+        return os.path.join(self.path, *parts, name)
+
+    def path_for(self, name):
+        """
+        Where the file for name is, or will be created. While a reshard is under way,
+        that may be either of two places.
+        """
+        path = self._path_in(name, self.fanout)
+        if self.previous is not None and not os.path.exists(path):
+            old = self._path_in(name, self.previous)
+            if os.path.exists(old):
+                return old
+        return path
+
+    def _retry(self, name, func):
+        """
+        Return func(self.path_for(name)). If the file isn't there, it may have just
+        been moved by a reshard; if the layout changed, look again.
+        """
+        try:
+            return func(self.path_for(name))
+        except FileNotFoundError:
+            if not self._layout_changed():
+                raise
+        return func(self.path_for(name))
+
+    def exists(self, name):
+        if os.path.exists(self.path_for(name)):
+            return True
+        return self._layout_changed() and os.path.exists(self.path_for(name))
+
+    def signature(self, name):
+        try:
+            st = self._retry(name, os.stat)
+        except FileNotFoundError:
+            return
+        return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+    def iter_lines(self, name):
+        with self._retry(name, lambda path: open(path, 'rt')) as f:
+            yield from f
+
+    def iter_records(self, name):
+        # Map the file and slice out one line at a time, rather than reading it
+        # through a text buffer; peak memory is one line, whatever the file size.
+        with self._retry(name, lambda path: open(path, 'rb')) as f:
+            size = os.fstat(f.fileno()).st_size
+            if not size:
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                start = 0
+                while start < size:
+                    end = mm.find(b'\n', start)
+                    if end < 0:
+                        end = size
+                    yield mm[start:end]
+                    start = end + 1
+
+    def read(self, name):
+        with self._retry(name, lambda path: open(path, 'rb')) as f:
+            return f.read()
+
+    def _open_existing(self, path):
+        try:
+            return os.open(path, os.O_RDWR | os.O_APPEND)
+        except FileNotFoundError:
+            return None
+
+    def _create(self, path):
+        # O_EXCL, so that we know whether we made the file, and never O_CREAT a log
+        # that someone else has already made.
+        try:
+            return os.open(path, os.O_RDWR | os.O_APPEND | os.O_CREAT | os.O_EXCL, 0o644)
+        except FileNotFoundError:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            return self._create(path)
+        except FileExistsError:
+            return None
+
+    def _open_for_append(self, name):
+        # A reshard may have changed the layout since we last looked. Check before
+        # any open that can create a file, so that it isn't made where no one will
+        # look; and check again after, in case the layout changed in between.
+        self._layout_changed()
+        while True:
+            path = self.path_for(name)
+            created = False
+            fd = self._open_existing(path)
+            if fd is None and path == self._path_in(name, self.fanout):
+                fd = self._create(path)
+                created = fd is not None
+            if fd is None:
+                # Moved or made by someone else just now; look again.
+                self._layout_changed()
+                continue
+            if not self._layout_changed():
+                return fd
+            # A file we made must be at the primary path of the new layout, or a
+            # reshard that has already listed the folder would leave it behind. One
+            # we found only has to still be where the new layout looks.
+            if path == (self._path_in(name, self.fanout) if created else self.path_for(name)):
+                return fd
+            if created and os.fstat(fd).st_size == 0:
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+            os.close(fd)
+
+    def append(self, name, lines, fsync=False):
+        if not lines:
+            return
+        data = ''.join(line + '\n' for line in lines).encode('utf-8')
+        fd = self._open_for_append(name)
+        try:
+            # If an earlier write was cut short, don't glue our first line onto the
+            # torn one; readers skip the fragment as long as it is on its own line.
+            size = os.fstat(fd).st_size
+            if size:
+                os.lseek(fd, size - 1, os.SEEK_SET)
+                if os.read(fd, 1) != b'\n':
+                    data = b'\n' + data
+            while data:
+                data = data[os.write(fd, data):]
+            if fsync:
+                os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def replace(self, name, lines, fsync=False):
+        lines = list(lines)
+        self._layout_changed()
+        while not self._replace_at(name, lines, fsync):
+            pass
+
+    def _replace_at(self, name, lines, fsync):
+        # Returns False if the layout changed under us and the new content isn't
+        # where it now belongs; then it has to be written again.
+        old = self.path_for(name)
+        path = self._path_in(name, self.fanout)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.' + name, suffix='.tmp')
+        try:
+            try:
+                os.chmod(tmp, os.stat(old).st_mode)
+            except FileNotFoundError:
+                os.chmod(tmp, 0o644)
+            with os.fdopen(fd, 'wt') as f:
+                for line in lines:
+                    f.write(line + '\n')
+                if fsync:
+                    f.flush()
+                    os.fsync(f.fileno())
+            os.replace(tmp, path)
+        except:
+            os.unlink(tmp)
+            raise
+        if old != path:
+            # Mid-reshard; the new content is in its new home, so retire the old file.
+            try:
+                os.unlink(old)
+            except FileNotFoundError:
+                pass
+        return not self._layout_changed() or path == self._path_in(name, self.fanout)
+
+    def _scan(self, path, depth):
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.name.endswith('.ddd') and entry.is_file():
+                    yield entry.name
+                elif depth and entry.is_dir():
+                    yield from self._scan(entry.path, depth - 1)
+
+    def names(self):
+        depth = len(self.fanout)
+        if self.previous is None:
+            yield from self._scan(self.path, depth)
+        else:
+            # During a reshard a file can briefly be in both places.
+            yield from set(self._scan(self.path, max(depth, len(self.previous))))
+
+
+def _move(src, dest, fsync):
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    try:
+        os.link(src, dest)
+    except FileExistsError:
+        # Already linked by an interrupted run, or rewritten in its new place.
+        pass
+    if fsync:
+        fd = os.open(os.path.dirname(dest), os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+    os.unlink(src)
+
+
+def reshard(path, fanout, fsync: bool = False) -> int:
+    """
+    Move the logs in a DirectoryStorage folder into the layout given by fanout (() for
+    flat), while the folder stays in use: the layout file records both layouts until
+    the move is done, and readers and writers look in both. Each file is hard-linked
+    into its new place and then unlinked from the old one, so an append that
+    already has the old path open lands in the same file. An interrupted reshard is
+    finished by running it again. Returns the number of files moved.
+    """
+    storage = DirectoryStorage(path)
+    fanout = tuple(fanout)
+    if storage.previous is not None:
+        if fanout != storage.fanout:
+            raise ValueError('Finish the reshard of %s to %s first.' % (storage.path, list(storage.fanout)))
+        old = storage.previous
+    elif fanout == storage.fanout:
+        return 0
+    else:
+        old = storage.fanout
+        storage._save_layout(fanout, old)
+    # Sidecars (see sidecar.py) are named after their log, and move with it.
+    from .sidecar import SidecarCache
+    n = 0
+    dirs = set()
+    moved = True
+    # A writer that read the layout just before we changed it can still create a
+    # log in the old place; it can't once it sees the change, so another pass after
+    # one that moved anything picks up any such stragglers.
+    while moved:
+        moved = False
+        for name in list(storage.names()):
+            for fname in (name, name + SidecarCache.SUFFIX):
+                src = storage._path_in(fname, old)
+                dest = storage._path_in(fname, fanout)
+                if src == dest or not os.path.exists(src):
+                    continue
+                _move(src, dest, fsync)
+                dirs.add(os.path.dirname(src))
+                if fname == name:
+                    n += 1
+                    moved = True
+    storage._save_layout(fanout)
+    # Tidy up the shard folders the old layout leaves behind, if they're empty.
+    for d in sorted(dirs, key=len, reverse=True):
+        while d != storage.path:
+            try:
+                os.rmdir(d)
+            except OSError:
+                break
+            d = os.path.dirname(d)
+    return n
+
+
+_PACKED_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS records (
+    name TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    offset INTEGER NOT NULL,
+    length INTEGER NOT NULL,
+    PRIMARY KEY (name, seq)
+) WITHOUT ROWID;
+"""
+
+
+class PackedStorage(Storage):
+    """
+    Keeps every log in one append-only segment file, with a sqlite3 index that maps
+    each name to the offsets of its lines. Millions of logs cost two files instead of
+    millions of inodes.
+
+    Each segment record is "<name>\\t<line>\\n", so the segment is self-describing.
+    A record only becomes visible once its index rows commit; a crash in between
+    leaves unreferenced bytes that .compact() reclaims. .replace() appends the new
+    lines and swaps the index rows in one transaction. Meant for a single writing
+    process; threads within it are fine.
+    """
+    INDEX_FILE = 'index.sqlite'
+
+    def __init__(self, path):
+        self.path = os.path.normpath(path)
+        os.makedirs(self.path, exist_ok=True)
+        self._lock = threading.RLock()
+        self._db = sqlite3.connect(os.path.join(self.path, self.INDEX_FILE), check_same_thread=False)
+        with self._lock, self._db:
+            self._db.executescript(_PACKED_SCHEMA)
+            self._db.execute("INSERT OR IGNORE INTO meta VALUES ('segment', 'segment-0.log')")
+        self._segment = None
+        self._open_segment()
+
+    def _open_segment(self):
+        if self._segment:
+            self._segment.close()
+        name = self._db.execute("SELECT value FROM meta WHERE key = 'segment'").fetchone()[0]
+        self.segment_path = os.path.join(self.path, name)
+        self._segment = open(self.segment_path, 'a+b')
+
+    def close(self):
+        with self._lock:
+            self._segment.close()
+            self._db.close()
+
+    def exists(self, name):
+        with self._lock:
+            return self._db.execute("SELECT 1 FROM records WHERE name = ? LIMIT 1", (name,)).fetchone() is not None
+
+    def signature(self, name):
+        with self._lock:
+            count, last = self._db.execute(
+                "SELECT COUNT(*), MAX(offset) FROM records WHERE name = ?", (name,)).fetchone()
+        if count:
+            return (self.segment_path, count, last)
+
+    def _records(self, name):
+        with self._lock:
+            return self._db.execute(
+                "SELECT offset, length FROM records WHERE name = ? ORDER BY seq", (name,)).fetchall()
+
+    def iter_lines(self, name):
+        for record in self.iter_records(name):
+            yield record.decode('utf-8')
+
+    def iter_records(self, name):
+        prefix = len(name.encode('utf-8')) + 1
+        for offset, length in self._records(name):
+            with self._lock:
+                self._segment.seek(offset)
+                record = self._segment.read(length)
+            yield record[prefix:-1]
+
+    def _write(self, name, lines, fsync):
+        """
+        Append records to the segment; return their (offset, length) pairs.
+        """
+        prefix = name.encode('utf-8') + b'\t'
+        records = [prefix + line.encode('utf-8') + b'\n' for line in lines]
+        f = self._segment
+        f.seek(0, os.SEEK_END)
+        offset = f.tell()
+        f.write(b''.join(records))
+        f.flush()
+        if fsync:
+            os.fsync(f.fileno())
+        spans = []
+        for r in records:
+            spans.append((offset, len(r)))
+            offset += len(r)
+        return spans
+
+    def append(self, name, lines, fsync=False):
+        if not lines:
+            return
+        with self._lock:
+            spans = self._write(name, lines, fsync)
+            with self._db:
+                first = self._db.execute(
+                    "SELECT COALESCE(MAX(seq) + 1, 0) FROM records WHERE name = ?", (name,)).fetchone()[0]
+                self._db.executemany("INSERT INTO records VALUES (?, ?, ?, ?)",
+                                     [(name, first + i, o, n) for i, (o, n) in enumerate(spans)])
+
+    def replace(self, name, lines, fsync=False):
+        with self._lock:
+            spans = self._write(name, lines, fsync)
+            with self._db:
+                self._db.execute("DELETE FROM records WHERE name = ?", (name,))
+                self._db.executemany("INSERT INTO records VALUES (?, ?, ?, ?)",
+                                     [(name, i, o, n) for i, (o, n) in enumerate(spans)])
+
+    def names(self):
+        with self._lock:
+            rows = self._db.execute("SELECT DISTINCT name FROM records ORDER BY name").fetchall()
+        for row in rows:
+            yield row[0]
+
+    def compact(self, fsync=True):
+        """
+        Rewrite the segment so it holds only live records, grouped by name, then
+        switch the index over to it in one transaction and delete the old segment.
+        """
+        with self._lock:
+            old_path = self.segment_path
+            n = int(os.path.basename(old_path)[len('segment-'):-len('.log')]) + 1
+            new_name = 'segment-%d.log' % n
+            new_path = os.path.join(self.path, new_name)
+            rows = []
+            with open(new_path, 'wb') as out:
+                offset = 0
+                for name in list(self.names()):
+                    for seq, (o, length) in enumerate(self._records(name)):
+                        self._segment.seek(o)
+                        out.write(self._segment.read(length))
+                        rows.append((name, seq, offset, length))
+                        offset += length
+                out.flush()
+                if fsync:
+                    os.fsync(out.fileno())
+            with self._db:
+                self._db.execute("DELETE FROM records")
+                self._db.executemany("INSERT INTO records VALUES (?, ?, ?, ?)", rows)
+                self._db.execute("UPDATE meta SET value = ? WHERE key = 'segment'", (new_name,))
+            self._open_segment()
+            os.unlink(old_path)
+
+
+def migrate(src: Storage, dest: Storage, names: Iterable[str] = None, fsync: bool = False) -> int:
+    """
+    Copy logs from one backend to another (for example, from a DirectoryStorage to a
+    PackedStorage). Logs that already exist in dest are replaced. Returns the number
+    of logs copied.
+    """
+    n = 0
+    for name in (names if names is not None else list(src.names())):
+        lines = [line.strip() for line in src.iter_lines(name)]
+        dest.replace(name, [line for line in lines if line], fsync)
+        n += 1
+    return n
+
+
+def main(argv=None):
+    syntax = argparse.ArgumentParser(description='Maintain peer DID storage.')
+    sub = syntax.add_subparsers(dest='cmd')
+    cmd = sub.add_parser('migrate', help='Copy a folder of .ddd files into a packed store.')
+    cmd.add_argument('src', help='folder of .ddd files')
+    cmd.add_argument('dest', help='folder for the packed store (created if needed)')
+    cmd = sub.add_parser('compact', help='Reclaim space in a packed store.')
+    cmd.add_argument('path', help='folder of the packed store')
+    cmd = sub.add_parser('reshard', help='Change the subfolder fanout of a folder of .ddd files, online.')
+    cmd.add_argument('path', help='folder of .ddd files')
+    cmd.add_argument('fanout', type=int, nargs='*',
+                     help='chars of the name per level of subfolders, e.g. "2 2"; none for flat')
+    args = syntax.parse_args(argv)
+    if args.cmd == 'migrate':
+        dest = PackedStorage(args.dest)
+        n = migrate(DirectoryStorage(args.src), dest)
+        dest.compact()
+        dest.close()
+        print('Migrated %d DIDs.' % n)
+    elif args.cmd == 'compact':
+        store = PackedStorage(args.path)
+        store.compact()
+        store.close()
+    elif args.cmd == 'reshard':
+        print('Moved %d DIDs.' % reshard(args.path, args.fanout, fsync=True))
+    else:
+        syntax.print_help()
+
+
+if __name__ == '__main__':
+    main()
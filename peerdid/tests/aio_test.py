@@ -0,0 +1,50 @@
+import asyncio
+import pytest
+
+from ..aio import AsyncRepo
+from ..delta import Delta
+from ..diddoc import get_predefined
+
+
+def run(coro):
+    return asyncio.new_event_loop().run_until_complete(coro)
+
+
+def test_matches_sync_repo(scratch_repo):
+    async def go():
+        async with AsyncRepo(scratch_repo) as repo:
+            did = await repo.new_doc('{"rules": []}')
+            await repo.append(did, Delta('{"rules": ["r1"]}', []))
+            reserved = await repo.resolve('did:peer:1z' + '1' * 45)
+            return did, await repo.resolve(did), reserved
+    did, resolved, reserved = run(go())
+    assert resolved == scratch_repo.resolve(did)
+    assert resolved['rules'] == ['r1']
+    assert reserved == get_predefined('1')
+
+
+def test_concurrent_appends_are_serialized(scratch_repo):
+    async def go():
+        async with AsyncRepo(scratch_repo, max_workers=8) as repo:
+            did = await repo.new_doc('{"rules": []}')
+            await asyncio.gather(*[
+                repo.append(did, Delta('{"rules": ["r%d"]}' % i, [])) for i in range(20)])
+            return await repo.resolve(did)
+    resolved = run(go())
+    assert sorted(resolved['rules']) == sorted('r%d' % i for i in range(20))
+
+
+def test_cancellation(scratch_repo):
+    async def go():
+        async with AsyncRepo(scratch_repo) as repo:
+            did = await repo.new_doc('{"rules": []}')
+            task = asyncio.ensure_future(repo.append(did, Delta('{"rules": ["r1"]}', [])))
+            await asyncio.sleep(0)
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+            await repo.append(did, Delta('{"rules": ["r2"]}', []))
+            return await repo.resolve(did)
+    rules = run(go())['rules']
+    assert rules[-1] == 'r2'
+    assert len(rules) in (1, 2)
@@ -0,0 +1,15 @@
+import json
+
+from .. import bench
+
+
+def test_run_and_compare(scratch_space, capsys):
+    out = scratch_space.name + '/a.json'
+    bench.main(['run', '--dids', '2', '--deltas', '12', '--repeat', '1', '--out', out])
+    with open(out, 'rt') as f:
+        report = json.load(f)
+    assert set(report['results']) == set(name for name, _ in bench.CASES)
+    assert bench.main(['compare', out, out]) == 0
+    slower = json.loads(json.dumps(report))
+    slower['results']['file.load']['median'] *= 2
+    assert [r[0] for r in bench.compare(report, slower)] == ['file.load']
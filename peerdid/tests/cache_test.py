@@ -0,0 +1,40 @@
+from ..cache import LRUCache
+
+
+def test_lru_eviction():
+    c = LRUCache(max_entries=2)
+    c.put('a', 1)
+    c.put('b', 2)
+    assert c.get('a') == 1
+    c.put('c', 3)
+    assert 'b' not in c
+    assert c.get('a') == 1
+    assert c.get('c') == 3
+    assert c.stats['evictions'] == 1
+
+
+def test_byte_limit():
+    c = LRUCache(max_entries=10, max_bytes=100)
+    c.put('a', 'x', 60)
+    c.put('b', 'y', 60)
+    assert 'a' not in c
+    assert c.bytes == 60
+    c.put('huge', 'z', 1000)
+    assert 'huge' not in c
+    assert 'b' in c
+
+
+def test_version_mismatch_is_a_miss():
+    c = LRUCache()
+    c.put('a', 1, version=(1, 2, 3))
+    assert c.get('a', (1, 2, 3)) == 1
+    assert c.get('a', (1, 2, 4)) is None
+    assert 'a' not in c
+    assert c.stats['hits'] == 1
+    assert c.stats['misses'] == 1
+
+
+def test_disabled():
+    c = LRUCache(max_entries=0)
+    c.put('a', 1)
+    assert len(c) == 0
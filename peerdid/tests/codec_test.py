@@ -0,0 +1,41 @@
+import base58
+import hashlib
+import pytest
+
+from ..codec import did_to_digest, digest_to_did, encnumbasis
+from ..delta import Delta
+from ..file import canonical_fname
+
+
+def digests():
+    yield b'\x00' * 32
+    yield b'\xff' * 32
+    for i in range(200):
+        yield hashlib.sha256(str(i).encode('ascii')).digest()
+
+
+def test_encode_matches_base58():
+    for digest in digests():
+        assert encnumbasis(digest) == base58.b58encode(b'\x12' + digest).decode('ascii')
+
+
+def test_round_trip():
+    for digest in digests():
+        did = digest_to_did(digest)
+        assert did_to_digest(did) == digest
+        assert did_to_digest(canonical_fname(did)) == digest
+        assert did_to_digest(did[11:]) == digest
+
+
+def test_delta_uses_codec(sample_delta):
+    assert sample_delta.encnumbasis == encnumbasis(sample_delta.hash)
+    assert did_to_digest(sample_delta.encnumbasis) == sample_delta.hash
+
+
+def test_bad_input():
+    with pytest.raises(ValueError):
+        encnumbasis(b'\x01' * 31)
+    for bad in ['', 'did:peer:1z' + '1' * 45, 'did:peer:1z' + '0' * 45, 'x' * 44,
+                base58.b58encode(b'\x13' + b'\x01' * 32).decode('ascii')]:
+        with pytest.raises(ValueError):
+            did_to_digest(bad)
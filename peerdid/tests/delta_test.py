@@ -1,7 +1,8 @@
 import json
+import pytest
 import re
 
-from ..delta import Delta
+from ..delta import Delta, thaw_json
 
 
 SAMPLE_CHANGE = '{"deleted": ["key-1"]}'
@@ -71,4 +72,30 @@ def test_comparison(sample_delta):
 def test_hashable(sample_delta):
     x = [sample_delta, Delta(SAMPLE_CHANGE, [])]
     y = set(x)
-    assert len(y) == 1
\ No newline at end of file
+    assert len(y) == 1
+
+def test_memoized(sample_delta):
+    assert sample_delta.encnumbasis is sample_delta.encnumbasis
+    assert sample_delta.change_json_view is sample_delta.change_json_view
+    assert sample_delta.hexhash == sample_delta.hash.hex()
+
+
+def test_view_is_read_only(sample_delta):
+    v = sample_delta.change_json_view
+    assert v["deleted"] == ("key-1",)
+    with pytest.raises(TypeError):
+        v["deleted"] = []
+    assert thaw_json(v) == sample_delta.change_json_dict
+
+
+def test_lazy_round_trip(sample_delta):
+    d = Delta.from_json(sample_delta.to_json(), lazy=True)
+    assert d.change == SAMPLE_CHANGE_BASE64
+    assert d.hash == sample_delta.hash
+    assert d.change == SAMPLE_CHANGE_BASE64
+    assert d.to_json() == sample_delta.to_json()
+
+
+def test_slots(sample_delta):
+    with pytest.raises(AttributeError):
+        sample_delta.extra = 1
@@ -91,4 +91,119 @@ def test_get_path_where_diddocs_differ():
 def test_resolve(scratch_space):
     dd = make_genesis_doc(scratch_space.name, BOGUS_CHANGE)
     assert get_path_where_diddocs_differ(dd.resolve(),
-        '{"id": "did:peer:1z6NRwAcQAJP8iFvVT3XqYcp97vtcuChXu9EzbZ9zJcMqdq", "say": "hello, world"}') is None
\ No newline at end of file
+        '{"id": "did:peer:1z6NRwAcQAJP8iFvVT3XqYcp97vtcuChXu9EzbZ9zJcMqdq", "say": "hello, world"}') is None
+
+def test_sets_compare_without_order():
+    a = {"publicKey": [{"id": "k1", "x": ["a", "b"]}, {"id": "k2"}], "authentication": ["#k1", "#k2"]}
+    b = {"authentication": ["#k2", "#k1", "#k1"], "publicKey": [{"id": "k2"}, {"x": ["b", "a"], "id": "k1"}]}
+    assert get_path_where_diddocs_differ(a, b) is None
+    b["publicKey"].append({"id": "k2"})
+    assert get_path_where_diddocs_differ(a, b) == '.publicKey'
+    assert get_path_where_diddocs_differ(b, a) == '.publicKey[2]'
+
+
+def test_nested_lists_of_sets():
+    a = {"x": [[1, 2], [3]]}
+    assert get_path_where_diddocs_differ(a, {"x": [[3], [2, 1]]}) is None
+    assert get_path_where_diddocs_differ(a, {"x": [[3], [2, 4]]}) == '.x[0]'
+
+
+def test_nested_object_path():
+    a = {"authorization": {"rules": [{"grant": ["register"]}]}}
+    b = {"authorization": {"rules": [{"grant": ["route"]}]}}
+    assert get_path_where_diddocs_differ(a, b) == '.authorization.rules[0]'
+
+
+def test_many_keys_compare_quickly():
+    a = {"publicKey": [{"id": "key-%d" % i, "type": "t"} for i in range(3000)]}
+    b = {"publicKey": list(reversed(a["publicKey"]))}
+    assert get_path_where_diddocs_differ(a, b) is None
+
+
+def test_diff_identical_docs_is_empty():
+    assert diff_diddocs(get_predefined('1'), get_predefined('1')) == []
+
+
+def test_diff_reports_everything():
+    a = json.loads(get_predefined('1'))
+    b = json.loads(get_predefined('2'))
+    b['publicKey'][0]['controller'] = '#id'
+    b['publicKey'] = [k for k in b['publicKey'] if k['id'] != 'key-5']
+    b['publicKey'].append({'id': 'key-6', 'type': 'Ed25519VerificationKey2018', 'publicKeyBase58': 'abc'})
+    b['authentication'].remove('#key-5')
+    b['authentication'].append('#key-6')
+    del b['service']
+    b['authorization'] = {'rules': []}
+    patch = diff_diddocs(a, b)
+    assert {"op": "changed", "path": ["id"], "value": b['id']} in patch
+    assert {"op": "added", "path": ["publicKey", {"id": "key-1"}, "controller"], "value": "#id"} in patch
+    assert {"op": "removed", "path": ["publicKey"], "member": a['publicKey'][2]} in patch
+    assert {"op": "added", "path": ["publicKey"], "member": b['publicKey'][-1]} in patch
+    assert {"op": "removed", "path": ["authentication"], "member": "#key-5"} in patch
+    assert {"op": "added", "path": ["authentication"], "member": "#key-6"} in patch
+    assert {"op": "removed", "path": ["service"]} in patch
+    assert {"op": "added", "path": ["authorization"], "value": {"rules": []}} in patch
+    assert len(patch) == 8
+    patched = apply_patch(a, json.loads(json.dumps(patch)))
+    assert get_path_where_diddocs_differ(patched, b) is None
+    assert get_path_where_diddocs_differ(a, json.loads(get_predefined('1'))) is None
+
+
+def test_patch_respects_set_semantics():
+    a = {"x": [{"n": 1}, {"n": 1}, {"n": 2}], "y": ["a", "b", "a"]}
+    b = {"x": [{"n": 2}, {"n": 1}], "y": ["b", "c"]}
+    patch = diff_diddocs(a, b)
+    assert get_path_where_diddocs_differ(apply_patch(a, patch), b) is None
+
+
+def test_patch_with_duplicate_ids_round_trips():
+    a = {"service": [{"id": "#s", "type": "A", "n": 1}, {"id": "#s", "type": "B", "n": 2}]}
+    b = {"service": [{"id": "#s", "type": "A", "n": 1}, {"id": "#s", "type": "B", "n": 3}]}
+    patch = diff_diddocs(a, b)
+    assert all(len(op["path"]) == 1 for op in patch)
+    patched = apply_patch(a, json.loads(json.dumps(patch)))
+    assert get_path_where_diddocs_differ(patched, b) is None
+    with pytest.raises(KeyError):
+        apply_patch(a, [{"op": "changed", "path": ["service", {"id": "#s"}, "n"], "value": 3}])
+
+
+def test_patch_for_missing_target_raises():
+    with pytest.raises(KeyError):
+        apply_patch({"publicKey": []}, [{"op": "changed", "path": ["publicKey", {"id": "k"}, "type"], "value": 1}])
+
+
+def _key_delta(n):
+    return Delta(json.dumps({
+        "publicKey": [{"id": "key-r%d" % n, "type": "Ed25519VerificationKey2018",
+                       "publicKeyBase58": "GBMBzuhw7XgSdbNffh8HpoKWEdEN6hU2Q5WqL1KQTG5Z"}],
+        "authentication": ["#key-r%d" % n],
+        "authorization": {"profiles": [{"key": "#key-r%d" % n, "roles": ["edge"]}]}}), [])
+
+
+def test_delete_removes_key_everywhere():
+    doc = json.loads(get_predefined('1'))
+    DIDDoc.apply_delta(doc, _key_delta(1))
+    DIDDoc.apply_delta(doc, Delta('{"deleted": ["key-1", "#key-r1"]}', []))
+    assert [k['id'] for k in doc['publicKey']] == ['key-3', 'key-5']
+    assert doc['authentication'] == ['#key-3', '#key-5']
+    assert doc['authorization']['profiles'] == []
+    # Deleting something that isn't there is harmless.
+    DIDDoc.apply_delta(doc, Delta('{"deleted": ["key-404"]}', []))
+
+
+def test_replay_with_key_rotation_matches_one_at_a_time():
+    deltas = []
+    for n in range(200):
+        deltas.append(_key_delta(n))
+        if n:
+            deltas.append(Delta('{"deleted": ["key-r%d"]}' % (n - 1), []))
+    one_at_a_time = json.loads(get_predefined('1'))
+    for d in deltas:
+        DIDDoc.apply_delta(one_at_a_time, d)
+    replay = DocReplay(json.loads(get_predefined('1')))
+    for d in deltas:
+        replay.apply(d)
+    doc = replay.state()
+    assert doc == one_at_a_time
+    assert [k['id'] for k in doc['publicKey']] == ['key-1', 'key-3', 'key-5', 'key-r199']
+    assert doc['authorization']['profiles'] == [{"key": "#key-r199", "roles": ["edge"]}]
@@ -1,7 +1,9 @@
+import json
 import os
 import pytest
 
 from ..delta import Delta
+from ..file import File
 
 
 def test_genesis(scratch_file, sample_delta):
@@ -28,4 +30,100 @@ def test_autosave_false(scratch_file, sample_delta):
     scratch_file.append(sample_delta)
     assert not os.path.exists(scratch_file.path)
     scratch_file.save()
-    assert os.path.exists(scratch_file.path)
\ No newline at end of file
+    assert os.path.exists(scratch_file.path)
+
+def test_append_only_writes_new_lines(scratch_file, sample_delta):
+    scratch_file.append(sample_delta)
+    ino = os.stat(scratch_file.path).st_ino
+    with open(scratch_file.path, 'rt') as f:
+        first = f.read()
+    scratch_file.append(Delta('{"deleted": ["key-2"]}', []))
+    assert os.stat(scratch_file.path).st_ino == ino
+    with open(scratch_file.path, 'rt') as f:
+        lines = f.read()
+    assert lines.startswith(first)
+    assert lines.count('\n') == 2
+
+
+def test_batched_appends(scratch_file, sample_delta):
+    scratch_file.autosave = False
+    scratch_file.fsync = True
+    scratch_file.append(sample_delta)
+    scratch_file.append(Delta('{"deleted": ["key-2"]}', []))
+    scratch_file.save()
+    assert len(File(scratch_file.path).deltas) == 2
+
+
+def test_rewrite_is_atomic_replace(scratch_file, sample_delta):
+    scratch_file.append(sample_delta)
+    scratch_file.append(Delta('{"deleted": ["key-2"]}', []))
+    ino = os.stat(scratch_file.path).st_ino
+    del scratch_file.deltas[1]
+    assert scratch_file.history_rewritten
+    scratch_file.dirty = True
+    scratch_file.save()
+    assert os.stat(scratch_file.path).st_ino != ino
+    assert len(File(scratch_file.path).deltas) == 1
+    assert len(os.listdir(os.path.dirname(scratch_file.path))) == 1
+
+
+def test_append_after_torn_write(scratch_file, sample_delta):
+    scratch_file.append(sample_delta)
+    with open(scratch_file.path, 'at') as f:
+        f.write('{"change": "eyJ')
+    f = File(scratch_file.path)
+    assert len(f.deltas) == 1
+    f.append(Delta('{"deleted": ["key-2"]}', []))
+    assert len(File(scratch_file.path).deltas) == 2
+
+
+def make_history(path, n):
+    f = File(path)
+    for i in range(n):
+        f.append(Delta('{"rules": ["rule-%d"]}' % i, [], '2019-01-01T00:00:%02d' % i))
+    return f
+
+
+def test_lazy_reads_nothing_up_front(scratch_file):
+    eager = make_history(scratch_file.path, 5)
+    lazy = File(scratch_file.path, lazy=True)
+    assert not lazy.loaded
+    assert lazy.genesis == eager.genesis
+    assert lazy.did == eager.did
+    assert not lazy.loaded
+    assert lazy.deltas == eager.deltas
+    assert lazy.loaded
+
+
+def test_lazy_defers_decoding(scratch_file):
+    make_history(scratch_file.path, 2)
+    with open(scratch_file.path, 'at') as f:
+        f.write('{"change": "not base64!", "by": [], "when": "2019-01-01T00:00:59"}\n')
+    with pytest.raises(ValueError):
+        File(scratch_file.path)
+    lazy = File(scratch_file.path, lazy=True)
+    assert len(lazy.deltas) == 3
+
+
+def test_iter_deltas_stops_at_cutoff(scratch_file):
+    make_history(scratch_file.path, 10)
+    lazy = File(scratch_file.path, lazy=True)
+    got = list(lazy.iter_deltas('2019-01-01T00:00:03'))
+    assert len(got) == 4
+    assert not lazy.loaded
+    lazy.load()
+    assert len(list(lazy.iter_deltas('2019-01-01T00:00:03'))) == 4
+    assert len(list(lazy.iter_deltas())) == 10
+
+
+def test_editing_an_earlier_delta_rewrites(scratch_file, sample_delta):
+    for i in range(3):
+        scratch_file.append(Delta({'n': i}, []))
+    scratch_file.deltas[0] = Delta({'n': 99}, [])
+    assert scratch_file.history_rewritten
+    scratch_file.dirty = True
+    scratch_file.save()
+    assert [json.loads(d.change_json_str)["n"] for d in File(scratch_file.path).deltas] == [99, 1, 2]
+    scratch_file.append(Delta({'n': 3}, []))
+    assert not scratch_file.history_rewritten
+    assert len(File(scratch_file.path).deltas) == 4
@@ -6,6 +6,7 @@ import os
 import pytest
 
 from .. import is_valid_peer_did, compare_peer_dids, is_reserved_peer_did
+from .. import are_valid_peer_dids, are_reserved_peer_dids, sort_peer_dids
 
 data_folder = os.path.normpath(os.path.join(os.path.abspath(os.path.dirname(__file__)),
                                             'compliance/level-1'))
@@ -90,4 +91,20 @@ def test_is_reserved():
         assert is_reserved_peer_did(did)
         assert is_reserved_peer_did(did[:11] + did[11:].upper())
         assert is_reserved_peer_did(did[:-5] + did[-5:].upper())
-        assert not is_reserved_peer_did(did[:-1] + chars[i + 1])
\ No newline at end of file
+        assert not is_reserved_peer_did(did[:-1] + chars[i + 1])
+
+
+def test_batch_matches_scalar():
+    dids = [value for path, value in all_files_by_prefix('')]
+    dids += ['did:peer:1z' + 45 * c for c in '1aB'] + ['did:peer:1z' + 44 * 'a' + 'A', None, '', 'did:peer:1z' + 44 * 'a' + 'b']
+    assert are_valid_peer_dids(dids) == [bool(is_valid_peer_did(d)) for d in dids]
+    assert are_reserved_peer_dids(iter(dids)) == [is_reserved_peer_did(d) for d in dids]
+
+
+def test_sort_peer_dids():
+    dids = [a for a, b in comparable_pairs('compare-lt.txt')] + [b for a, b in comparable_pairs('compare-lt.txt')]
+    order = sort_peer_dids(dids)
+    ordered = [dids[i] for i in order]
+    assert sorted(order) == list(range(len(dids)))
+    for a, b in zip(ordered, ordered[1:]):
+        assert compare_peer_dids(a, b) <= 0
@@ -1,7 +1,11 @@
 import json
 import os
+import pytest
 
+from ..delta import Delta
 from ..diddoc import get_predefined, get_path_where_diddocs_differ
+from ..file import File, canonical_fname
+from ..repo import Repo
 
 
 def test_repo_empty_on_creation(scratch_repo):
@@ -31,3 +35,114 @@ def test_repo_resolves_correctly(scratch_repo):
     assert get_path_where_diddocs_differ(resolved, doc_1) == '.{id}'
     del resolved['id']
     assert get_path_where_diddocs_differ(resolved, doc_1) is None
+
+
+def test_repo_caches_resolved_docs(scratch_repo):
+    did = scratch_repo.new_doc('{"rules": []}')
+    first = scratch_repo.resolve(did)
+    first['rules'].append('mutated')
+    assert scratch_repo.resolve(did) == {"rules": [], "id": did}
+    assert scratch_repo.cache.stats['hits'] == 1
+    assert scratch_repo.cache.stats['misses'] == 1
+
+
+def test_repo_cache_sees_appends(scratch_repo):
+    did = scratch_repo.new_doc('{"rules": []}')
+    scratch_repo.resolve(did)
+    scratch_repo.append(did, Delta('{"rules": ["r1"]}', []))
+    assert scratch_repo.resolve(did)['rules'] == ['r1']
+    # Writes that bypass the repo are caught by the file's stat signature.
+    File(os.path.join(scratch_repo.path, canonical_fname(did))).append(Delta('{"rules": ["r2"]}', []))
+    assert scratch_repo.resolve(did)['rules'] == ['r1', 'r2']
+
+
+def test_repo_cache_evicts(scratch_space):
+    repo = Repo(scratch_space.name, cache_entries=2)
+    dids = [repo.new_doc('{"n": %d}' % i) for i in range(3)]
+    for did in dids:
+        repo.resolve(did)
+    assert repo.cache.stats['evictions'] == 1
+    assert len(repo.cache) == 2
+
+
+def test_append_does_not_read_the_log(scratch_repo, monkeypatch):
+    did = scratch_repo.new_doc('{"rules": []}')
+    scratch_repo.append(did, Delta('{"rules": ["r0"]}', []))
+    parsed = []
+    real = Delta.from_dict
+    monkeypatch.setattr(Delta, 'from_dict', lambda src, lazy=False: (parsed.append(src), real(src, lazy))[1])
+    for i in range(1, 20):
+        scratch_repo.append(did, Delta('{"rules": ["r%d"]}' % i, []))
+    assert parsed == []
+    monkeypatch.undo()
+    assert scratch_repo.resolve(did)['rules'] == ['r%d' % i for i in range(20)]
+
+
+def test_append_unknown_did(scratch_repo):
+    with pytest.raises(ValueError):
+        scratch_repo.append('did:peer:1z' + 'a' * 45, Delta('{}', []))
+
+
+@pytest.mark.parametrize('executor', [None, 'thread', 'process'])
+def test_resolve_many(scratch_repo, executor):
+    dids = [scratch_repo.new_doc('{"n": %d}' % i) for i in range(5)]
+    scratch_repo.append(dids[0], Delta('{"rules": ["r1"]}', []))
+    scratch_repo.resolve(dids[1])
+    unknown = 'did:peer:1z' + 'a' * 44 + 'b'
+    reserved = 'did:peer:1z' + '1' * 45
+    query = dids + [dids[0], unknown, reserved, 'not a did']
+    results = scratch_repo.resolve_many(query, executor=executor, max_workers=2)
+    assert [r.did for r in results] == query
+    for r, did in zip(results, dids):
+        assert r.error is None
+        assert r.doc == scratch_repo.resolve(did)
+    assert results[0].doc['rules'] == ['r1']
+    assert results[5].doc == results[0].doc
+    assert results[6].doc is None
+    assert results[7].doc == get_predefined('1')
+    assert results[8].doc is None
+
+
+def test_resolve_many_takes_a_generator(scratch_repo):
+    dids = [scratch_repo.new_doc('{"n": %d}' % i) for i in range(3)]
+    results = scratch_repo.resolve_many(did for did in dids + dids[:1])
+    assert [r.did for r in results] == dids + dids[:1]
+    assert [r.doc['n'] for r in results] == [0, 1, 2, 0]
+
+
+def test_resolve_many_reports_errors(scratch_repo):
+    good = scratch_repo.new_doc('{"n": 1}')
+    bad = 'did:peer:1z' + 'b' * 44 + 'c'
+    with open(os.path.join(scratch_repo.path, canonical_fname(bad)), 'wt') as f:
+        f.write('{"change": "eyJuIjogMX0=", "by": [], "when": "2019"}\n')
+        f.write('{"change": "eyJy", "by": [], "when": "2019"}\n')
+    results = scratch_repo.resolve_many([bad, good], executor='thread')
+    assert results[0].doc is None
+    assert results[0].error is not None
+    assert results[1].doc['n'] == 1
+
+
+def test_repo_index(scratch_space):
+    dids = []
+    repo = Repo(scratch_space.name)
+    for i in range(20):
+        dids.append(repo.new_doc('{"rules": ["r%d"]}' % i))
+    # Noise that the index should skip.
+    open(os.path.join(scratch_space.name, 'notes.txt'), 'w').close()
+    repo = Repo(scratch_space.name)
+    assert len(repo) == 20
+    assert list(repo) == sorted(dids)
+    assert dids[0] in repo and 'did:peer:1z' + 45 * '1' not in repo and 'junk' not in repo
+    late = repo.new_doc('{"rules": ["late"]}')
+    assert late in repo and len(repo) == 21
+    repo.append(late, Delta('{"rules": ["again"]}', [], '2019-01-02'))
+    entry = repo.index.get(late)
+    assert (entry.count, entry.when) == (2, '2019-01-02')
+    assert repo.index.get(dids[0]).count == 1
+
+
+def test_repo_prefix_query(scratch_space):
+    repo = Repo(scratch_space.name)
+    dids = sorted(repo.new_doc('{"rules": ["r%d"]}' % i) for i in range(200))
+    for prefix in ['', 'did:peer', 'did:peer:1z', dids[7][:12], dids[7][:13], dids[7], dids[7][11:14], 'did:peer:1z0', 'nope']:
+        assert list(repo.dids(prefix)) == [d for d in dids if d.startswith(prefix) or d[11:].startswith(prefix)]
@@ -0,0 +1,227 @@
+import copy
+import os
+
+from ..delta import Delta
+from ..diddoc import DIDDoc, DocReplay
+from ..file import File, canonical_fname, parse_deltas
+from ..repo import Repo
+from ..resolver import Resolver, TimeIndex
+
+
+def make_deltas(n):
+    deltas = [Delta('{"rules": []}', [], '2019-01-01T00:00:00')]
+    for i in range(1, n):
+        deltas.append(Delta('{"rules": ["rule-%d"]}' % i, [], '2019-01-01T00:00:%02d' % i))
+    return deltas
+
+
+def replay(deltas, as_of=None):
+    json_dict = deltas[0].change_json_dict
+    for item in deltas[1:]:
+        if as_of and item.when > as_of:
+            break
+        DIDDoc.apply_delta(json_dict, item)
+    return json_dict
+
+
+def replay_prefix(deltas, as_of):
+    return list(parse_deltas([d.to_json() for d in deltas], as_of=as_of))
+
+
+def test_matches_full_replay():
+    deltas = make_deltas(20)
+    r = Resolver(DIDDoc.apply_delta, interval=4)
+    assert r.resolve(deltas) == replay(deltas)
+    assert [cp.index for cp in r.checkpoints] == [0, 4, 8, 12, 16]
+    # Served from checkpoints this time.
+    assert r.resolve(deltas) == replay(deltas)
+
+
+def test_as_of_uses_checkpoints():
+    deltas = make_deltas(20)
+    r = Resolver(DIDDoc.apply_delta, interval=4)
+    r.resolve(deltas)
+    for as_of in ['2019-01-01T00:00:00', '2019-01-01T00:00:05', '2019-01-01T00:00:13', '2019-01-02']:
+        assert r.resolve(deltas, as_of) == replay(deltas, as_of)
+
+
+def test_as_of_respects_out_of_order_when():
+    deltas = make_deltas(10)
+    deltas[3] = Delta('{"rules": ["late"]}', [], '2019-01-01T00:00:59')
+    r = Resolver(DIDDoc.apply_delta, interval=2)
+    r.resolve(deltas)
+    as_of = '2019-01-01T00:00:08'
+    assert r.resolve(deltas, as_of) == replay(deltas, as_of)
+
+
+def test_append_extends_tip():
+    deltas = make_deltas(10)
+    r = Resolver(DIDDoc.apply_delta, interval=4)
+    r.resolve(deltas)
+    deltas.append(Delta('{"rules": ["extra"]}', [], '2019-01-01T00:01:00'))
+    assert r.resolve(deltas) == replay(deltas)
+
+
+def test_rewritten_history_invalidates_checkpoints():
+    deltas = make_deltas(10)
+    r = Resolver(DIDDoc.apply_delta, interval=2)
+    r.resolve(deltas)
+    rewritten = deltas[:5] + [Delta('{"rules": ["other"]}', [], '2019-01-01T00:00:05')]
+    assert r.resolve(rewritten) == replay(rewritten)
+    assert max(cp.index for cp in r.checkpoints) <= 4
+
+
+def test_checkpoints_after_a_rewrite_keep_their_spacing():
+    deltas = make_deltas(20)
+    r = Resolver(DIDDoc.apply_delta, interval=4)
+    r.resolve(deltas)
+    deltas[6] = Delta('{"rules": ["other"]}', [], '2019-01-01T00:00:06')
+    assert r.resolve(deltas) == replay(deltas)
+    assert [cp.index for cp in r.checkpoints] == [0, 4, 8, 12, 16]
+
+
+def test_result_is_owned_by_caller():
+    deltas = make_deltas(5)
+    r = Resolver(DIDDoc.apply_delta, interval=2)
+    x = r.resolve(deltas)
+    expected = copy.deepcopy(x)
+    x['rules'].append('mutated')
+    assert r.resolve(deltas) == expected
+
+
+def test_repo_reuses_resolver_across_appends(scratch_repo):
+    did = scratch_repo.new_doc('{"rules": []}')
+    assert scratch_repo.resolve(did)['rules'] == []
+    f = File(os.path.join(scratch_repo.path, canonical_fname(did)))
+    f.append(Delta('{"rules": ["r1"]}', []))
+    assert scratch_repo.resolve(did)['rules'] == ['r1']
+
+
+def test_lazy_as_of_matches_loaded(scratch_space):
+    path = os.path.join(scratch_space.name, 'x.ddd')
+    f = File(path)
+    for d in make_deltas(12):
+        f.append(d)
+    r = Resolver(DIDDoc.apply_delta, interval=3)
+    as_of = '2019-01-01T00:00:05'
+    lazy = DIDDoc(File(path, lazy=True), r).resolve(as_of)
+    assert lazy == DIDDoc(File(path)).resolve(as_of)
+    assert r.resolve(f.deltas) == replay(f.deltas)
+
+
+def test_time_index_handles_out_of_order_when():
+    deltas = make_deltas(10)
+    deltas[3] = Delta('{"rules": ["late"]}', [], '2019-01-01T00:00:59')
+    index = TimeIndex(deltas)
+    for as_of in [None, '2018', '2019-01-01T00:00:02', '2019-01-01T00:00:05', '2019-01-01T00:00:59', '2020']:
+        assert index.cutoff(as_of) == len(replay_prefix(deltas, as_of))
+
+
+def test_resolve_at_matches_individual_resolves():
+    deltas = make_deltas(40)
+    r = Resolver(DocReplay, interval=4)
+    index = TimeIndex(deltas)
+    times = ['2019-01-01T00:00:30', None, '2019-01-01T00:00:03', '2019-01-01T00:00:30', '2018']
+    docs = r.resolve_at(deltas, [index.cutoff(t) for t in times])
+    assert docs[0] == docs[3] and docs[0] is not docs[3]
+    for t, doc in zip(times, docs):
+        assert doc == replay(deltas, t)
+        assert Resolver(DocReplay).resolve(deltas, t, end=index.cutoff(t)) == doc
+
+
+def test_diddoc_resolve_as_of_times(scratch_space):
+    path = os.path.join(scratch_space.name, 'x.ddd')
+    f = File(path)
+    for d in make_deltas(12):
+        f.append(d)
+    times = ['2019-01-01T00:00:07', '2019-01-01T00:00:02', None]
+    doc = DIDDoc(f)
+    docs = doc.resolve_as_of_times(times)
+    assert docs == [DIDDoc(File(path)).resolve(t) for t in times]
+    f.append(Delta('{"rules": ["late"]}', [], '2019-01-01T00:01:00'))
+    assert doc.resolve_as_of_times(times)[2]['rules'][-1] == 'late'
+    assert len(f.time_index) == 13
+
+
+def test_repo_resolve_as_of_times(scratch_repo):
+    did = scratch_repo.new_doc('{"rules": []}')
+    f = File(os.path.join(scratch_repo.path, canonical_fname(did)))
+    for d in make_deltas(6)[1:]:
+        f.append(d)
+    times = ['2019-01-01T00:00:03', None, '2019-01-01T00:00:03']
+    docs = scratch_repo.resolve_as_of_times(did, times)
+    assert docs[0]['rules'] == ['rule-1', 'rule-2', 'rule-3']
+    assert docs[0] == docs[2] and docs[0] is not docs[2]
+    assert docs[1] == scratch_repo.resolve(did)
+    assert scratch_repo.resolve_as_of_times(did, times) == docs
+
+
+def test_repo_reuses_time_index(scratch_space, monkeypatch):
+    repo = Repo(scratch_space.name, cache_entries=16)
+    did = repo.new_doc('{"rules": []}')
+    f = File(os.path.join(repo.path, canonical_fname(did)))
+    for d in make_deltas(6)[1:]:
+        f.append(d)
+    added = []
+    real_add = TimeIndex.add
+    monkeypatch.setattr(TimeIndex, 'add', lambda self, d: (added.append(d), real_add(self, d)))
+    repo.resolve(did, '2019-01-01T00:00:03')
+    built = len(added)
+    assert built == 6
+    repo.resolve(did, '2019-01-01T00:00:02')
+    repo.resolve_as_of_times(did, ['2019-01-01T00:00:04', '2019-01-01T00:00:01'])
+    assert len(added) == built
+    # A change to the log means a new index.
+    repo.append(did, Delta('{"rules": ["late"]}', [], '2019-01-01T00:01:00'))
+    assert repo.resolve(did, '2019-01-01T00:01:00')['rules'][-1] == 'late'
+    assert len(added) == built + 7
+
+
+def test_rewrite_behind_tip_or_checkpoint(scratch_space):
+    path = os.path.join(scratch_space.name, 'x.ddd')
+    f = File(path)
+    for d in make_deltas(10):
+        f.append(d)
+    doc = DIDDoc(f, Resolver(DocReplay, interval=4))
+    assert doc.resolve()['rules'][-1] == 'rule-9'
+    # Behind the tip, between checkpoints 0 and 4.
+    f.deltas[2] = Delta('{"rules": ["edited"]}', [], '2019-01-01T00:00:02')
+    f.save(rewrite=True)
+    assert doc.resolve() == DIDDoc(File(path)).resolve()
+    assert 'edited' in doc.resolve()['rules']
+    # Behind checkpoint 8, in a plain list.
+    deltas = make_deltas(12)
+    r = Resolver(DIDDoc.apply_delta, interval=4)
+    r.resolve(deltas)
+    deltas[6] = Delta('{"rules": ["other"]}', [], '2019-01-01T00:00:06')
+    assert r.resolve(deltas) == replay(deltas)
+    assert r.resolve(deltas, '2019-01-01T00:00:09') == replay(deltas, '2019-01-01T00:00:09')
+
+
+def test_repo_sees_rewrite_by_another_writer(scratch_repo):
+    did = scratch_repo.new_doc('{"rules": []}')
+    g = File(os.path.join(scratch_repo.path, canonical_fname(did)))
+    for d in make_deltas(6)[1:]:
+        g.append(d)
+    assert scratch_repo.resolve(did)['rules'][-1] == 'rule-5'
+    g.deltas[3] = Delta('{"rules": ["edit"]}', [], '2019-01-01T00:00:03')
+    g.save(rewrite=True)
+    assert scratch_repo.resolve(did) == Repo(scratch_repo.path).resolve(did)
+    assert 'rule-3' not in scratch_repo.resolve(did)['rules']
+
+
+def test_time_index_follows_edits(scratch_space):
+    f = File(os.path.join(scratch_space.name, 'x.ddd'))
+    for d in make_deltas(8):
+        f.append(d)
+    as_of = '2019-01-01T00:00:04'
+    assert f.time_index.cutoff(as_of) == 5
+    # An edit before the end, saved or not, changes where the cutoff falls.
+    f.deltas[2] = Delta('{"rules": ["late"]}', [], '2019-01-01T00:00:59')
+    assert f.time_index.cutoff(as_of) == 2
+    f.save(rewrite=True)
+    assert f.time_index.cutoff(as_of) == 2
+    assert DIDDoc(f).resolve(as_of)['rules'] == ['rule-1']
+    f.deltas[2] = make_deltas(3)[2]
+    f.save(rewrite=True)
+    assert f.time_index.cutoff(as_of) == 5
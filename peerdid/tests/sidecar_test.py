@@ -0,0 +1,70 @@
+import os
+
+from ..delta import Delta
+from ..diddoc import DIDDoc, DocReplay
+from ..file import File, canonical_fname
+from ..repo import Repo
+from ..sidecar import SidecarCache
+from ..storage import DirectoryStorage
+
+
+class CountingReplay(DocReplay):
+    applied = 0
+
+    def apply(self, delta):
+        CountingReplay.applied += 1
+        DocReplay.apply(self, delta)
+
+
+def make_repo(path, n):
+    repo = Repo(path, sidecar=True)
+    did = repo.new_doc('{"rules": []}')
+    for i in range(n):
+        repo.append(did, Delta('{"rules": ["r%d"]}' % i, []))
+    return repo, did
+
+
+def resolve(path, name):
+    CountingReplay.applied = 0
+    return SidecarCache(path).resolve(DirectoryStorage(path), name, CountingReplay)
+
+
+def test_cold_start_serves_sidecar(scratch_space):
+    repo, did = make_repo(scratch_space.name, 5)
+    expected = repo.resolve(did)
+    assert os.path.isfile(repo.sidecars.path_for(canonical_fname(did)))
+    assert Repo(scratch_space.name, sidecar=True).resolve(did) == expected
+    assert resolve(scratch_space.name, canonical_fname(did))['rules'] == expected['rules']
+    assert CountingReplay.applied == 0
+
+
+def test_new_deltas_replay_incrementally(scratch_space):
+    repo, did = make_repo(scratch_space.name, 5)
+    repo.resolve(did)
+    repo.append(did, Delta('{"rules": ["new"]}', []))
+    assert resolve(scratch_space.name, canonical_fname(did))['rules'][-1] == 'new'
+    assert CountingReplay.applied == 1
+    assert Repo(scratch_space.name, sidecar=True).resolve(did) == Repo(scratch_space.name).resolve(did)
+
+
+def test_damaged_sidecar_is_ignored(scratch_space):
+    repo, did = make_repo(scratch_space.name, 5)
+    expected = repo.resolve(did)
+    path = repo.sidecars.path_for(canonical_fname(did))
+    with open(path, 'rb') as f:
+        data = f.read()
+    for damaged in [b'', data[:len(data) // 2], data.replace(b'r3', b'r9'), b'garbage\tgarbage']:
+        with open(path, 'wb') as f:
+            f.write(damaged)
+        assert Repo(scratch_space.name, sidecar=True).resolve(did) == expected
+
+
+def test_rewritten_history_is_detected(scratch_space):
+    repo, did = make_repo(scratch_space.name, 5)
+    repo.resolve(did)
+    f = File(os.path.join(scratch_space.name, canonical_fname(did)), autosave=False)
+    f.deltas[2] = Delta('{"rules": ["other"]}', [])
+    f.save(rewrite=True)
+    resolved = Repo(scratch_space.name, sidecar=True).resolve(did)
+    assert resolved == DIDDoc(f).resolve()
+    assert 'other' in resolved['rules']
@@ -0,0 +1,203 @@
+import os
+import pytest
+
+from ..delta import Delta
+from ..repo import Repo
+from ..storage import DirectoryStorage, PackedStorage, migrate, main, reshard
+
+
+@pytest.fixture(params=['directory', 'packed'])
+def storage(request, scratch_space):
+    if request.param == 'directory':
+        yield DirectoryStorage(scratch_space.name)
+    else:
+        x = PackedStorage(scratch_space.name)
+        yield x
+        x.close()
+
+
+def lines_of(storage, name):
+    return [line.strip() for line in storage.iter_lines(name)]
+
+
+def test_append_and_read(storage):
+    assert not storage.exists('a.ddd')
+    assert storage.signature('a.ddd') is None
+    storage.append('a.ddd', ['{"x": 1}'])
+    sig = storage.signature('a.ddd')
+    storage.append('a.ddd', ['{"x": 2}', '{"x": 3}'], fsync=True)
+    storage.append('b.ddd', ['{"y": 1}'])
+    assert storage.exists('a.ddd')
+    assert storage.signature('a.ddd') != sig
+    assert lines_of(storage, 'a.ddd') == ['{"x": 1}', '{"x": 2}', '{"x": 3}']
+    assert storage.read('b.ddd') == b'{"y": 1}\n'
+    assert sorted(storage.names()) == ['a.ddd', 'b.ddd']
+
+
+def test_replace(storage):
+    storage.append('a.ddd', ['{"x": 1}', '{"x": 2}'])
+    storage.replace('a.ddd', ['{"x": 9}'])
+    assert lines_of(storage, 'a.ddd') == ['{"x": 9}']
+
+
+def test_repo_on_storage(storage, scratch_space):
+    repo = Repo(scratch_space.name, storage=storage)
+    did = repo.new_doc('{"rules": []}')
+    repo.append(did, Delta('{"rules": ["r1"]}', []))
+    assert repo.resolve(did)['rules'] == ['r1']
+    assert repo.resolve_many([did])[0].doc == repo.resolve(did)
+
+
+def test_packed_compaction(scratch_space):
+    store = PackedStorage(scratch_space.name)
+    store.append('a.ddd', ['{"x": 1}'])
+    store.append('b.ddd', ['{"y": 1}'])
+    store.append('a.ddd', ['{"x": 2}'])
+    store.replace('b.ddd', ['{"y": 2}'])
+    # Simulate a crash after writing to the segment but before indexing.
+    store._write('c.ddd', ['{"z": 1}'], False)
+    assert not store.exists('c.ddd')
+    old = store.segment_path
+    store.compact()
+    assert not os.path.exists(old)
+    assert lines_of(store, 'a.ddd') == ['{"x": 1}', '{"x": 2}']
+    assert lines_of(store, 'b.ddd') == ['{"y": 2}']
+    with open(store.segment_path, 'rb') as f:
+        assert f.read() == b'a.ddd\t{"x": 1}\na.ddd\t{"x": 2}\nb.ddd\t{"y": 2}\n'
+    store.close()
+    reopened = PackedStorage(scratch_space.name)
+    assert lines_of(reopened, 'a.ddd') == ['{"x": 1}', '{"x": 2}']
+    reopened.close()
+
+
+def test_migrate(scratch_space):
+    src = os.path.join(scratch_space.name, 'src')
+    dest = os.path.join(scratch_space.name, 'dest')
+    os.mkdir(src)
+    repo = Repo(src)
+    dids = [repo.new_doc('{"n": %d}' % i) for i in range(3)]
+    repo.append(dids[0], Delta('{"rules": ["r1"]}', []))
+    main(['migrate', src, dest])
+    packed = Repo(dest, storage=PackedStorage(dest))
+    for did in dids:
+        assert packed.resolve(did) == repo.resolve(did)
+    assert migrate(DirectoryStorage(src), packed.storage, [dids[1][11:] + '.ddd']) == 1
+    packed.storage.close()
+
+
+def test_directory_records_are_mapped_lines(scratch_space):
+    store = DirectoryStorage(scratch_space.name)
+    with open(store.path_for('a.ddd'), 'wb') as f:
+        f.write(b'{"x": 1}\r\n\n{"x": 2}')
+    assert list(store.iter_records('a.ddd')) == [b'{"x": 1}\r', b'', b'{"x": 2}']
+    open(store.path_for('empty.ddd'), 'wb').close()
+    assert list(store.iter_records('empty.ddd')) == []
+
+
+def test_load_from_records(scratch_space):
+    repo = Repo(scratch_space.name)
+    did = repo.new_doc('{"rules": []}')
+    for i in range(50):
+        repo.append(did, Delta('{"rules": ["r%d"]}' % i, []))
+    f = repo._file(did)
+    assert len(f.deltas) == 51
+    assert f.deltas[-1].change_json_dict == {"rules": ["r49"]}
+
+
+def test_sharded_repo(scratch_space):
+    repo = Repo(scratch_space.name, fanout=(2, 1))
+    did = repo.new_doc('{"rules": []}')
+    repo.append(did, Delta('{"rules": ["r1"]}', []))
+    name = did[11:] + '.ddd'
+    assert os.path.isfile(os.path.join(scratch_space.name, name[:2], name[2], name))
+    # The layout is remembered.
+    again = Repo(scratch_space.name)
+    assert again.storage.fanout == (2, 1)
+    assert again.resolve(did)['rules'] == ['r1']
+    assert list(again) == [did]
+    with pytest.raises(ValueError):
+        Repo(scratch_space.name, fanout=(3,))
+
+
+def test_reshard_online(scratch_space):
+    repo = Repo(scratch_space.name)
+    dids = [repo.new_doc('{"rules": ["r%d"]}' % i) for i in range(10)]
+    expected = [repo.resolve(did) for did in dids]
+    # Another process has this storage open, and keeps using it across the reshard.
+    other = Repo(scratch_space.name, cache_entries=0)
+    assert main(['reshard', scratch_space.name, '2', '2']) is None
+    assert sorted(os.listdir(scratch_space.name)) == sorted(set(d[11:13] for d in dids) | {'layout.json'})
+    assert [other.resolve(did) for did in dids] == expected
+    other.append(dids[0], Delta('{"rules": ["after"]}', []))
+    assert Repo(scratch_space.name).resolve(dids[0])['rules'][-1] == 'after'
+    assert reshard(scratch_space.name, ()) == 10
+    assert sorted(os.listdir(scratch_space.name)) == sorted(d[11:] + '.ddd' for d in dids)
+
+
+def test_mid_reshard_finds_both_layouts(scratch_space):
+    repo = Repo(scratch_space.name)
+    dids = [repo.new_doc('{"rules": ["r%d"]}' % i) for i in range(4)]
+    store = DirectoryStorage(scratch_space.name)
+    # What an interrupted reshard leaves: two files moved, two not.
+    store._save_layout((1,), ())
+    for did in dids[:2]:
+        name = did[11:] + '.ddd'
+        os.makedirs(os.path.join(scratch_space.name, name[0]), exist_ok=True)
+        os.rename(os.path.join(scratch_space.name, name), os.path.join(scratch_space.name, name[0], name))
+    repo = Repo(scratch_space.name)
+    assert sorted(repo) == sorted(dids)
+    for did in dids:
+        assert repo.resolve(did)['id'] == did
+    repo.append(dids[3], Delta('{"rules": ["x"]}', []))
+    did = repo.new_doc('{"rules": ["new"]}')
+    assert os.path.isfile(os.path.join(scratch_space.name, did[11], did[11:] + '.ddd'))
+    assert reshard(scratch_space.name, (1,)) == 2
+    assert Repo(scratch_space.name).resolve(dids[3])['rules'] == ['r3', 'x']
+
+
+def test_stale_instance_appends_across_reshard(scratch_space):
+    d = scratch_space.name
+    store = DirectoryStorage(d)
+    store.append('abcdefgh.ddd', ['line1'])
+    store.replace('ijklmnop.ddd', ['old'])
+    reshard(d, (2,))
+    # store still has the flat layout in mind.
+    store.append('abcdefgh.ddd', ['line2'])
+    store.replace('ijklmnop.ddd', ['new'])
+    assert sorted(os.listdir(d)) == ['ab', 'ij', 'layout.json']
+    fresh = DirectoryStorage(d)
+    assert lines_of(fresh, 'abcdefgh.ddd') == ['line1', 'line2']
+    assert lines_of(fresh, 'ijklmnop.ddd') == ['new']
+
+
+def test_append_racing_reshard_leaves_no_orphan(scratch_space):
+    d = scratch_space.name
+    store = DirectoryStorage(d)
+    store.append('abcdefgh.ddd', ['line1'])
+    reshard(d, (2,))
+    # As if the reshard happened between the check before the open and the open.
+    real = store._layout_changed
+    calls = []
+
+    def late(*args):
+        calls.append(1)
+        return False if len(calls) == 1 else real()
+    store._layout_changed = late
+    store.append('qrstuvwx.ddd', ['made'])
+    assert sorted(os.listdir(d)) == ['ab', 'layout.json', 'qr']
+    assert lines_of(DirectoryStorage(d), 'qrstuvwx.ddd') == ['made']
+
+
+def test_reshard_moves_sidecars(scratch_space):
+    repo = Repo(scratch_space.name, sidecar=True)
+    did = repo.new_doc('{"rules": []}')
+    repo.append(did, Delta('{"rules": ["r1"]}', []))
+    expected = repo.resolve(did)
+    name = did[11:] + '.ddd'
+    assert os.path.isfile(os.path.join(scratch_space.name, name + '.resolved'))
+    reshard(scratch_space.name, (2,))
+    assert sorted(os.listdir(scratch_space.name)) == [name[:2], 'layout.json']
+    assert sorted(os.listdir(os.path.join(scratch_space.name, name[:2]))) == [name, name + '.resolved']
+    again = Repo(scratch_space.name, sidecar=True)
+    assert again.sidecars.load(name) is not None
+    assert again.resolve(did) == expected
@@ -0,0 +1,60 @@
+import json
+import pytest
+
+from ..delta import Delta
+from ..diddoc import get_predefined
+from ..validation import ValidationError, validate, validate_many, validation_errors
+
+
+def test_valid_docs_have_no_errors():
+    for which in '12345d':
+        assert validation_errors(get_predefined(which)) == []
+
+
+def test_all_errors_are_collected():
+    doc = json.loads(get_predefined('1'))
+    doc['@context'] = 'https://example.com'
+    del doc['publicKey'][0]['type']
+    doc['service'][0]['serviceEndpoint'] = 42
+    doc['authentication'].append('#nope')
+    with pytest.raises(ValidationError) as e:
+        validate(doc)
+    errors = e.value.errors
+    assert len(errors) == 4
+    assert any('@context' in err for err in errors)
+    assert any('"type"' in err and 'publicKey[0]' in err for err in errors)
+    assert any('serviceEndpoint' in err for err in errors)
+    assert any('#nope' in err for err in errors)
+
+
+def test_authorization_shape():
+    doc = json.loads(get_predefined('1'))
+    doc['authorization'] = {
+        "profiles": [{"key": "#key-1", "roles": ["edge"]}, {"key": "#key-9", "roles": []}],
+        "rules": [{"grant": ["register"], "when": {"roles": "edge"}}, {"grant": ["route"]}]
+    }
+    errors = validation_errors(doc)
+    assert len(errors) == 3
+    assert any('roles cannot be empty' in err for err in errors)
+    assert any('"when"' in err for err in errors)
+    assert any('key-9' in err for err in errors)
+
+
+def test_validate_many_over_docs():
+    docs = [get_predefined('1'), {}, 'hello']
+    results = list(validate_many(docs))
+    assert results[0] == []
+    assert results[1] and results[2]
+
+
+def test_validate_many_over_file(scratch_file):
+    genesis = json.loads(get_predefined('1'))
+    del genesis['id']
+    scratch_file.append(Delta(json.dumps(genesis), []))
+    # Fragments may refer to keys defined by earlier deltas.
+    scratch_file.append(Delta('{"authentication": ["#key-3"], "deleted": ["key-5"]}', []))
+    scratch_file.append(Delta('{"service": [{"type": "x"}]}', []))
+    results = list(validate_many(scratch_file.path))
+    assert results[0] == []
+    assert results[1] == []
+    assert len(results[2]) == 1 and 'serviceEndpoint' in results[2][0]
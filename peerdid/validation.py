@@ -0,0 +1,219 @@
+"""
+Validation of peer DID docs (and of the fragments that later deltas carry). The
+expected shape is declared once below, compiled into a tree of checkers at import
+time, and each doc is checked in a single traversal that collects every error
+instead of stopping at the first.
+"""
+
+import json
+import re
+from typing import Iterable, Iterator, List, Union
+
+from .file import File
+
+
+class ValidationError(BaseException):
+    def __init__(self, msg, errors: List[str] = None):
+        BaseException.__init__(self, msg)
+        self.errors = errors or [msg]
+
+
+class _Check:
+    """
+    Base class for compiled checkers. .check() appends messages to errors; path is
+    the JSON path of value, for messages.
+    """
+    def check(self, value, path: str, errors: List[str], ctx: dict):
+        raise NotImplementedError()
+
+
+class _Str(_Check):
+    def __init__(self, regex: str = None):
+        self.regex = re.compile(regex) if regex else None
+
+    def check(self, value, path, errors, ctx):
+        if not isinstance(value, str):
+            errors.append('%s should be a string, not %s.' % (path, type(value).__name__))
+        elif self.regex and not self.regex.match(value):
+            errors.append('%s doesn\'t match regex "%s".' % (path, self.regex.pattern))
+
+
+class _Ref(_Str):
+    """
+    A string that refers to something declared elsewhere in the doc (a key). The
+    reference is recorded in ctx, and resolved once the whole doc has been seen.
+    """
+    def __init__(self, kind: str):
+        _Str.__init__(self)
+        self.kind = kind
+
+    def check(self, value, path, errors, ctx):
+        n = len(errors)
+        _Str.check(self, value, path, errors, ctx)
+        if len(errors) == n:
+            ctx.setdefault('refs', []).append((self.kind, value, path))
+
+
+class _List(_Check):
+    def __init__(self, item: _Check, allow_empty: bool = True):
+        self.item = item
+        self.allow_empty = allow_empty
+
+    def check(self, value, path, errors, ctx):
+        if not isinstance(value, list):
+            errors.append('%s should be a list, not %s.' % (path, type(value).__name__))
+        elif not value and not self.allow_empty:
+            errors.append('%s cannot be empty.' % path)
+        else:
+            for i, item in enumerate(value):
+                self.item.check(item, '%s[%d]' % (path, i), errors, ctx)
+
+
+class _Obj(_Check):
+    """
+    An object with known properties. Unknown properties are allowed, as JSON-LD is
+    extensible. declares names a ctx bucket to record this object's "id" in.
+    """
+    def __init__(self, properties: dict, required=(), require_one_of=(), declares: str = None):
+        self.properties = properties
+        self.required = tuple(required)
+        self.require_one_of = tuple(require_one_of)
+        self.declares = declares
+
+    def check(self, value, path, errors, ctx):
+        if not isinstance(value, dict):
+            errors.append('%s should be an object, not %s.' % (path or 'DID doc', type(value).__name__))
+            return
+        for key in self.required:
+            if key not in value:
+                errors.append('Missing "%s" property%s.' % (key, (' in ' + path) if path else ''))
+        if self.require_one_of and not any(key in value for key in self.require_one_of):
+            errors.append('%s needs one of: %s.' % (path, ', '.join(self.require_one_of)))
+        for key, item in value.items():
+            checker = self.properties.get(key)
+            if checker:
+                checker.check(item, path + '.' + key, errors, ctx)
+        if self.declares and isinstance(value.get('id'), str):
+            ctx.setdefault(self.declares, set()).add(fragment(value['id']))
+
+
+class _Either(_Check):
+    """
+    Strings are checked with one checker, objects with another.
+    """
+    def __init__(self, if_str: _Check, if_obj: _Check):
+        self.if_str = if_str
+        self.if_obj = if_obj
+
+    def check(self, value, path, errors, ctx):
+        (self.if_obj if isinstance(value, dict) else self.if_str).check(value, path, errors, ctx)
+
+
+def fragment(ref: str) -> str:
+    """
+    "#key-1", "key-1" and "did:peer:...#key-1" all name key-1.
+    """
+    return ref[ref.rfind('#') + 1:]
+
+
+_PUBLIC_KEY = _Obj({
+    'id': _Str(), 'type': _Str(), 'controller': _Str(),
+    'publicKeyBase58': _Str(r'^[1-9A-HJ-NP-Za-km-z]+$'),
+    'publicKeyHex': _Str(r'^[0-9a-fA-F]+$'),
+    'publicKeyPem': _Str(r'^-----BEGIN '),
+    'publicKeyJwk': _Obj({}),
+}, required=('id', 'type'),
+    require_one_of=('publicKeyBase58', 'publicKeyHex', 'publicKeyPem', 'publicKeyJwk'), declares='keys')
+
+_PROFILE = _Obj({'key': _Ref('key'), 'roles': _List(_Str(), allow_empty=False)}, required=('key', 'roles'))
+
+_RULE = _Obj({'id': _Str(), 'grant': _List(_Str(), allow_empty=False), 'when': _Obj({})},
+             required=('grant', 'when'))
+
+_AUTHORIZATION = _Obj({'profiles': _List(_PROFILE), 'rules': _List(_RULE)})
+
+_SERVICE = _Obj({'id': _Str(), 'type': _Str(), 'serviceEndpoint': _Str()}, required=('type', 'serviceEndpoint'))
+
+_COMMON = {
+    'publicKey': _List(_PUBLIC_KEY),
+    'authentication': _List(_Either(_Ref('key'), _PUBLIC_KEY)),
+    'authorization': _AUTHORIZATION,
+    'service': _List(_SERVICE),
+}
+
+# A whole (stored or resolved) DID doc.
+DIDDOC_PLAN = _Obj(dict(_COMMON, **{
+    '@context': _Str(r'https://w3id.org/did/v1'),
+    'id': _Str(r'^did:[a-z0-9]+:'),
+}), required=('@context',))
+
+# The change carried by a delta after genesis.
+FRAGMENT_PLAN = _Obj(dict(_COMMON, **{
+    'deleted': _List(_Str()),
+    'rules': _List(_RULE),
+}))
+
+
+def _as_json(doc):
+    if isinstance(doc, bytes):
+        doc = doc.decode('utf-8')
+    if isinstance(doc, str):
+        return json.loads(doc)
+    if isinstance(doc, dict):
+        return doc
+    raise ValueError('Bad datatype. Expected bytes, string, or JSON dict, not %s.' % doc.__class__.__name__)
+
+
+def validation_errors(did_doc, plan: _Check = DIDDOC_PLAN) -> List[str]:
+    """
+    Return a list of everything wrong with did_doc (bytes, str or dict); empty if
+    it is valid.
+    """
+    try:
+        json_dict = _as_json(did_doc)
+    except ValueError as e:
+        return [str(e)]
+    errors = []
+    ctx = {}
+    plan.check(json_dict, '', errors, ctx)
+    refs = ctx.get('refs')
+    if refs and plan is DIDDOC_PLAN:
+        # Fragments can refer to keys added by earlier deltas; only whole docs are
+        # expected to be self-contained.
+        keys = ctx.get('keys', set())
+        for kind, ref, path in refs:
+            if fragment(ref) not in keys:
+                errors.append('%s refers to unknown %s "%s".' % (path, kind, ref))
+    return errors
+
+
+def validate(did_doc):
+    """
+    Raise ValidationError, listing every problem, unless did_doc is a valid DID doc.
+    """
+    errors = validation_errors(did_doc)
+    if errors:
+        raise ValidationError(' '.join(errors), errors)
+
+
+def validate_many(source: Union[Iterable, File, str]) -> Iterator[List[str]]:
+    """
+    Yield the list of validation errors (empty if valid) for each doc in source.
+    source can be any iterable of docs, or a File (or the path of a .ddd file), in
+    which case the genesis delta is checked as a whole doc and each later delta as
+    a fragment.
+    """
+    if isinstance(source, str):
+        source = File(source, lazy=True)
+    if isinstance(source, File):
+        plan = DIDDOC_PLAN
+        for delta in source.iter_deltas():
+            try:
+                doc = delta.change_json_bytes
+            except ValueError as e:
+                doc = e
+            yield [str(doc)] if isinstance(doc, ValueError) else validation_errors(doc, plan)
+            plan = FRAGMENT_PLAN
+    else:
+        for doc in source:
+            yield validation_errors(doc)
@@ -1,4 +1,8 @@
+import bisect
+import collections
 import copy
+import functools
+import hashlib
 import random
 import re
 import threading
@@ -11,6 +15,118 @@ simple_pat = re.compile(r'simple(?:\s+by\s+([1-9]@[a-z]))?$')
 add_rem_pat = re.compile(r'([a-z]+)\s+(%s)(?:\s+by\s+([1-9]@[a-z]))?$' % valid_spec)
 
 
+# Bytes of hash that stand for one delta, and for a party's whole list, when
+# agents compare what they know.
+DELTA_HASH_LEN = 8
+DIGEST_LEN = 32
+
+
+@functools.lru_cache(maxsize=65536)
+def delta_hash(delta):
+    return hashlib.sha256(delta.encode('utf-8')).digest()[:DELTA_HASH_LEN]
+
+
+def party_digest(deltas):
+    # Lists are kept sorted, so agents that know the same deltas get the same digest.
+    return hashlib.sha256('\n'.join(deltas).encode('utf-8')).digest()
+
+
+def bucket_count(n):
+    # About sqrt(n) buckets, so that their digests and the hashes in one bucket cost
+    # about the same to send.
+    count = 1
+    while count * count < n and count < 256:
+        count *= 2
+    return count
+
+
+def buckets(deltas, count):
+    # Split deltas into count lists of (hash, delta), by hash, keeping their order.
+    out = [[] for _ in range(count)]
+    for d in deltas:
+        h = delta_hash(d)
+        out[h[0] % count].append((h, d))
+    return out
+
+
+def bucket_digest(bucket):
+    return hashlib.sha256(b''.join(h for h, d in bucket)).digest()[:DELTA_HASH_LEN]
+
+
+class PartyDeltas:
+    """
+    The deltas an agent knows for one party. Behaves like the sorted list of them,
+    but finds a delta in O(1) and inserts one with a binary search. The m-of-n
+    deltas are also indexed by their base (the part before the endorsers), so a
+    new endorsement of a change we know merges without a scan. The joined string,
+    the digest and the total size are kept up to date as deltas come and go.
+    """
+
+    def __init__(self, deltas=()):
+        self.items = []
+        self.members = set()
+        # base -> (delta, its endorsers) for each m-of-n delta.
+        self.bases = {}
+        self.size = 0
+        self._joined = self._digest = None
+        for d in deltas:
+            self.add(d)
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __getitem__(self, i):
+        return self.items[i]
+
+    def __contains__(self, delta):
+        return delta in self.members
+
+    def add(self, delta):
+        if delta in self.members:
+            return False
+        bisect.insort(self.items, delta)
+        self.members.add(delta)
+        self.size += len(delta)
+        m = m_of_n_of_group_pat.match(delta)
+        if m:
+            self.bases[m.group(1)] = (delta, frozenset(m.group(2).split(',')) if m.group(2) else frozenset())
+        self._joined = self._digest = None
+        return True
+
+    def remove(self, delta):
+        if delta not in self.members:
+            return False
+        del self.items[bisect.bisect_left(self.items, delta)]
+        self.members.discard(delta)
+        self.size -= len(delta)
+        m = m_of_n_of_group_pat.match(delta)
+        if m and self.bases.get(m.group(1), (None,))[0] == delta:
+            del self.bases[m.group(1)]
+        self._joined = self._digest = None
+        return True
+
+    def endorsed(self, base):
+        """
+        The (delta, endorsers) we hold for the m-of-n change with this base, or None.
+        """
+        return self.bases.get(base)
+
+    @property
+    def joined(self):
+        if self._joined is None:
+            self._joined = '+'.join(self.items)
+        return self._joined
+
+    @property
+    def digest(self):
+        if self._digest is None:
+            self._digest = party_digest(self.items)
+        return self._digest
+
+
 def split_spec(spec):
     m = valid_spec_pat.match(spec)
     return spec[0], spec[2], m.group(1), m.group(2)
@@ -28,9 +144,21 @@ class Agent:
     all_lock = threading.Lock()
     all = []
     thread_main = None
+    # When set, a scheduler.Scheduler delivers messages on a virtual clock instead
+    # of each agent running in its own thread.
+    scheduler = None
+    # When set, a transport.Transport queues messages for agents instead of
+    # send() calling receive() on them directly.
+    transport = None
     stdout = None
     cmds_lock = threading.Lock()
     cmds = []
+    # How gossip decides what to send: 'digest' compares hashes first and sends
+    # what's missing in one batch; 'naive' checks every delta against the peer's
+    # list and sends each one by itself.
+    gossip_mode = 'digest'
+    stats_lock = threading.Lock()
+    stats = collections.Counter()
 
     def __init__(self, spec, initial_state=None):
         self.party, self.num, self.groups, self.cant_reach = norm_spec(spec)
@@ -39,14 +167,20 @@ class Agent:
             initial_state = {}
         self.deltas_lock = threading.Lock()
         self.deltas = initial_state
-        self.thread = threading.Thread(target=Agent.thread_main, args=(self,), daemon=True)
+        self.thread = None
+        if Agent.thread_main:
+            self.thread = threading.Thread(target=Agent.thread_main, args=(self,), daemon=True)
         with Agent.all_lock:
             Agent.all.append(self)
-        self.thread.start()
+        if self.thread:
+            self.thread.start()
 
     def next(self):
+        self.run(self.cmds[self.cmd_idx])
+        self.cmd_idx += 1
+
+    def run(self, cmd):
         handled = True
-        cmd = self.cmds[self.cmd_idx]
         if cmd.startswith(self.id):
             rest = cmd[4:].lstrip()
             m = simple_pat.match(rest)
@@ -70,11 +204,10 @@ class Agent:
                     handled = False
         if not handled:
                 self.say('Huh? Try "help".')
-        self.cmd_idx += 1
 
     def init_parties(self, parties):
         for p in parties:
-            self.deltas[p] = ['#']
+            self.deltas[p] = PartyDeltas(['#'])
 
     def simple(self, auth=None):
         """
@@ -123,7 +256,8 @@ class Agent:
         pass
 
     def say(self, msg):
-        Agent.stdout.say(self.id + ' -- ' + msg)
+        if Agent.stdout is not None:
+            Agent.stdout.say(self.id + ' -- ' + msg)
 
     @property
     def all_deltas(self):
@@ -147,7 +281,7 @@ class Agent:
     def get_state(self, party=None):
         if party is None:
             party = self.party
-        return '+'.join(self.deltas[party])
+        return self.deltas[party].joined
 
     @property
     def full_id(self):
@@ -164,12 +298,42 @@ class Agent:
         return self.id
 
     def receive(self, msg):
-        party = msg[0]
-        self.append_delta(msg[2:], party)
-        self.say('Received delta. I now see ' + self.all_deltas)
+        # msg is "P+delta", or a list of them sent as one batch.
+        if isinstance(msg, str):
+            self.append_delta(msg[2:], msg[0])
+        else:
+            for m in msg:
+                self.append_delta(m[2:], m[0])
+        # Only build the report if someone will see it; it costs more than the change.
+        if Agent.stdout is not None:
+            if isinstance(msg, str):
+                self.say('Received delta. I now see ' + self.all_deltas)
+            else:
+                self.say('Received %d deltas. I now see %s' % (len(msg), self.all_deltas))
         # Introduce some randomness so order of events from other agents
-        # can vary.
-        time.sleep(random.random() / 8)
+        # can vary. (A scheduler or transport does this with delivery times instead.)
+        if Agent.scheduler is None and Agent.transport is None:
+            time.sleep(random.random() / 8)
+
+    @staticmethod
+    def tally(messages, nbytes, tab=None):
+        # tab, if given, counts the same traffic for one exchange alone; Agent.stats
+        # also counts other agents' traffic, from other threads.
+        with Agent.stats_lock:
+            Agent.stats['messages'] += messages
+            Agent.stats['bytes'] += nbytes
+        if tab is not None:
+            tab['messages'] += messages
+            tab['bytes'] += nbytes
+
+    def send(self, target, msg, tab=None):
+        Agent.tally(1, len(msg) if isinstance(msg, str) else sum(len(m) for m in msg), tab)
+        if Agent.transport is not None:
+            Agent.transport.send(self, target, msg)
+        elif Agent.scheduler is None:
+            target.receive(msg)
+        else:
+            Agent.scheduler.after(random.random() / 8, target.receive, msg)
 
     def append_delta(self, delta, party=None):
         if party is None:
@@ -182,35 +346,29 @@ class Agent:
                 match = m_of_n_of_group_pat.match(delta)
                 if match:
                     # Figure out endorsers, n, and group name.
-                    endorsers = match.group(2).split(',') if match.group(2) else []
+                    base = match.group(1)
+                    endorsers = set(match.group(2).split(',')) if match.group(2) else set()
                     n = int(match.group(3))
                     group = match.group(4)
                     # Do we already know about this delta, but with different
                     # endorsers?
-                    old_idx = -1
-                    i = 0
-                    for old in lst:
-                        if old.startswith(match.group(1)):
-                            old_match = m_of_n_of_group_pat.match(old)
-                            old_endorsers = old_match.group(2).split(',') if old_match.group(2) else []
-                            endorsers = sorted(list(set(endorsers + old_endorsers)))
-                            old_idx = i
-                            break
-                        i += 1
+                    old = lst.endorsed(base)
+                    if old:
+                        merged = endorsers | old[1]
+                    else:
+                        merged = set(endorsers)
                     # Can we endorse this change?
-                    if len(endorsers) < n and (party == self.party) and (group in self.groups) and self.id not in endorsers:
+                    if len(merged) < n and (party == self.party) and (group in self.groups) and self.id not in merged:
                         # A newly added agent can't endorse the txn that adds itself.
                         if not delta.startswith('add-' + self.id):
-                            endorsers.append(self.id)
-                            endorsers.sort()
-                            delta = '%s by {%s}/%s@%s' % (match.group(1), ','.join(endorsers), n, group)
-                    if old_idx > -1:
-                        lst[old_idx] = delta
-                    else:
-                        lst.append(delta)
-                else:
-                    lst.append(delta)
-                lst.sort()
+                            merged.add(self.id)
+                    if merged != endorsers:
+                        delta = '%s by {%s}/%s@%s' % (base, ','.join(sorted(merged)), n, group)
+                    if old:
+                        if old[0] == delta:
+                            return delta
+                        lst.remove(old[0])
+                lst.add(delta)
         return delta
 
     @property
@@ -222,7 +380,7 @@ class Agent:
         targets = self.reachable
         if targets:
             for a in targets:
-                a.receive(delta)
+                self.send(a, delta)
 
     def gossip(self, targets=None):
         """
@@ -231,15 +389,77 @@ class Agent:
         if targets is None:
             targets = self.reachable
         if targets:
-            def sync(s, t):
+            def sync(s, t, tab):
+                # s reads t's lists directly; over a network, t would have to send
+                # them, so count that.
+                Agent.tally(1, sum(len(key) * len(lst) + lst.size for key, lst in t.deltas.items()), tab)
                 for key in s.deltas:
                     for delta in s.deltas[key]:
                         if delta not in t.deltas[key]:
                             s.say('%s+%s--> %s' % (key, delta, t.id))
-                            t.receive(key + '+' + delta)
+                            s.send(t, key + '+' + delta, tab)
             for t in targets:
-                sync(self, t)
-                sync(t, self)
+                tab = collections.Counter()
+                if Agent.gossip_mode == 'naive':
+                    sync(self, t, tab)
+                    sync(t, self, tab)
+                else:
+                    self.reconcile(t, tab)
+                messages, nbytes = tab['messages'], tab['bytes']
+                with Agent.stats_lock:
+                    Agent.stats['rounds'] += 1
+                    Agent.stats['gossip messages'] += messages
+                    Agent.stats['gossip bytes'] += nbytes
+                self.say('Gossip with %s took %d messages, %d bytes.' % (t.id, messages, nbytes))
+
+    def reconcile(self, peer, tab=None):
+        """
+        Bring self and peer up to date with each other. We send a digest of each
+        party's deltas; for parties whose digests differ, peer answers with digests
+        of buckets of its deltas; we send our delta hashes from the buckets that
+        differ; peer sends the deltas we lack in one batch, with the hashes of the
+        ones it lacks; and we send those in one batch. So a round costs at most five
+        messages, and bytes grow with what differs rather than with history. (Each
+        side reads the other's state when the exchange starts; only the batches of
+        deltas travel through send(). The other messages are just counted.) The
+        round's traffic is also counted in tab, if given.
+        """
+        Agent.tally(1, sum(len(key) + DIGEST_LEN for key in self.deltas), tab)
+        with self.deltas_lock:
+            my_digests = {key: lst.digest for key, lst in self.deltas.items()}
+        with peer.deltas_lock:
+            their_digests = {key: lst.digest for key, lst in peer.deltas.items()}
+        differ = [key for key in sorted(set(my_digests) | set(their_digests))
+                  if my_digests.get(key) != their_digests.get(key)]
+        if not differ:
+            return
+        with self.deltas_lock:
+            mine = {key: list(self.deltas.get(key, ())) for key in differ}
+        with peer.deltas_lock:
+            theirs = {key: list(peer.deltas.get(key, ())) for key in differ}
+        mismatched = []
+        for key in differ:
+            count = bucket_count(len(theirs.get(key, [])))
+            Agent.tally(0, len(key) + 1 + DELTA_HASH_LEN * count, tab)
+            ours, their_buckets = buckets(mine.get(key, []), count), buckets(theirs.get(key, []), count)
+            mismatched.extend((key, a, b) for a, b in zip(ours, their_buckets) if bucket_digest(a) != bucket_digest(b))
+        Agent.tally(1, 0, tab)
+        Agent.tally(1, sum(DELTA_HASH_LEN * len(a) for key, a, b in mismatched), tab)
+        give, want = [], []
+        for key, ours, their_bucket in mismatched:
+            known = dict(ours)
+            for h, d in their_bucket:
+                if known.pop(h, None) is None:
+                    want.append(key + '+' + d)
+            give.extend(key + '+' + d for d in known.values())
+        if want or give:
+            Agent.tally(0 if want else 1, DELTA_HASH_LEN * len(give), tab)
+            if want:
+                peer.say('%d deltas--> %s' % (len(want), self.id))
+                peer.send(self, want, tab)
+        if give:
+            self.say('%d deltas--> %s' % (len(give), peer.id))
+            self.send(peer, give, tab)
 
     def autogossip(self):
         if random.random() < 0.05:
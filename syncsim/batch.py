@@ -0,0 +1,257 @@
+"""
+Run a scripted simulation without a console, and report how it went as JSON.
+
+A scenario file looks like this:
+
+    # Alice has two agents that can endorse; B.2 can't reach A.1.
+    agents A.1@x A.2@x B.1 B.2-A.1
+    seed 7
+    until 600
+    loss 0.05
+    0    A.1: simple by 2@x
+    0.5  B.1: simple
+    1    autogossip on
+
+"agents" takes the same specs as syncsim.py. Each other line starts with a time in
+virtual seconds, followed by a command: an agent command, "autogossip on|off", or
+"mode digest|naive" to choose how gossip works. seed (default 0) and until (the
+virtual time to give up at, default 3600) are optional, as are settings for the
+transport.Transport that carries messages: latency, jitter, loss, reorder, queue
+(inbox capacity) and batch. The run ends when all agents agree after the last
+command, when nothing more can happen, or at until.
+
+    python batch.py scenario.txt                      -- one run
+    python batch.py scenario.txt --sweep 100 --jobs 8 -- seeds 0..99, in parallel
+"""
+
+import argparse
+import collections
+import concurrent.futures
+import json
+import re
+import statistics
+import sys
+import time
+
+from agent import Agent, valid_spec_pat
+from scheduler import Scheduler
+from transport import Transport
+
+
+timed_cmd_pat = re.compile(r'^(\d+(?:\.\d*)?)\s+(.+)$')
+agent_cmd_pat = re.compile(r'^([a-z]\.[1-9])\s*:\s*(.+)$', re.I)
+# Scenario settings passed on to Transport, and their types.
+transport_settings = {'latency': float, 'jitter': float, 'loss': float, 'reorder': float,
+                      'queue': int, 'batch': int}
+
+
+class Scenario:
+    def __init__(self, specs, script, seed=0, until=3600.0, transport=None):
+        self.specs = specs
+        # (time, command), in time order.
+        self.script = sorted(script, key=lambda item: item[0])
+        self.seed = seed
+        self.until = until
+        self.transport = transport or {}
+
+    @staticmethod
+    def parse(text):
+        specs, script, seed, until, transport = None, [], 0, 3600.0, {}
+        for n, line in enumerate(text.splitlines(), 1):
+            line = line.split('#', 1)[0].strip()
+            if not line:
+                continue
+            word, _, rest = line.partition(' ')
+            try:
+                if word == 'agents':
+                    specs = rest.split()
+                    for spec in specs:
+                        if not valid_spec_pat.match(spec):
+                            raise ValueError('Bad spec "%s".' % spec)
+                elif word == 'seed':
+                    seed = int(rest)
+                elif word == 'until':
+                    until = float(rest)
+                elif word in transport_settings:
+                    transport[word] = transport_settings[word](rest)
+                else:
+                    m = timed_cmd_pat.match(line)
+                    if not m:
+                        raise ValueError('Expected "agents", a setting, or "<time> <command>".')
+                    script.append((float(m.group(1)), m.group(2).strip()))
+            except ValueError as e:
+                raise ValueError('Line %d: %s' % (n, e))
+        if not specs:
+            raise ValueError('Scenario has no "agents" line.')
+        if len(set(spec[0].upper() for spec in specs)) < 2:
+            raise ValueError('Must have at least two parties.')
+        return Scenario(specs, script, seed, until, transport)
+
+    @staticmethod
+    def load(path):
+        with open(path, 'rt') as f:
+            return Scenario.parse(f.read())
+
+
+def reset():
+    # Agent keeps the simulation in class attributes; a worker process runs many.
+    Agent.all = []
+    Agent.cmds = []
+    Agent.stats = collections.Counter()
+    Agent.gossip_mode = 'digest'
+    Agent.transport = None
+
+
+def states():
+    by_state = collections.defaultdict(list)
+    for a in Agent.all:
+        by_state[a.all_deltas].append(a.id)
+    return by_state
+
+
+def run(scenario, seed=None, resolution=0.1, include_states=True):
+    """
+    Run scenario (with seed in place of its own, if given) and return its metrics.
+    Agreement is checked every resolution virtual seconds once the script is done,
+    so times to convergence are accurate to about that.
+    """
+    if seed is None:
+        seed = scenario.seed
+    started = time.perf_counter()
+    reset()
+    Agent.stdout = None
+    scheduler = Scheduler(seed)
+    settings = dict(scenario.transport)
+    if 'queue' in settings:
+        settings['capacity'] = settings.pop('queue')
+    transport = Transport(scheduler, **settings)
+    agents = [Agent(spec) for spec in scenario.specs]
+    parties = set(a.party for a in agents)
+    for a in agents:
+        a.init_parties(sorted(parties))
+
+    pending = [len(scenario.script)]
+
+    def do(cmd):
+        pending[0] -= 1
+        m = agent_cmd_pat.match(cmd)
+        if m:
+            if not scheduler.command(m.group(1).upper() + ': ' + m.group(2)):
+                raise ValueError('No such agent as %s.' % m.group(1))
+        else:
+            word, _, arg = cmd.partition(' ')
+            arg = arg.strip().lower()
+            if word == 'autogossip':
+                scheduler.set_autogossip(arg == 'on')
+            elif word == 'mode' and arg in ('digest', 'naive'):
+                Agent.gossip_mode = arg
+            else:
+                raise ValueError('Unknown command "%s".' % cmd)
+
+    for when, cmd in scenario.script:
+        scheduler.at(when, do, cmd)
+
+    converged_at, converged_rounds = None, None
+    next_check = 0
+    while scheduler.queue and scheduler.queue[0][0] <= scenario.until:
+        scheduler.step()
+        if not pending[0] and scheduler.now >= next_check:
+            if len(states()) == 1:
+                converged_at, converged_rounds = scheduler.now, Agent.stats['rounds']
+                break
+            next_check = scheduler.now + resolution
+    if converged_at is None and not pending[0] and len(states()) == 1:
+        converged_at, converged_rounds = scheduler.now, Agent.stats['rounds']
+
+    by_state = states()
+    metrics = {
+        'seed': seed,
+        'agents': len(Agent.all),
+        'converged': converged_at is not None,
+        'converged_at': converged_at,
+        'rounds_to_converge': converged_rounds,
+        'last_command_at': scenario.script[-1][0] if scenario.script else 0,
+        'end_time': scheduler.now,
+        'events': scheduler.events,
+        'messages': Agent.stats['messages'],
+        'bytes': Agent.stats['bytes'],
+        'gossip_rounds': Agent.stats['rounds'],
+        'gossip_messages': Agent.stats['gossip messages'],
+        'gossip_bytes': Agent.stats['gossip bytes'],
+        'delivered': transport.stats['delivered'],
+        'dropped': transport.stats['dropped'],
+        'lost': transport.stats['lost'],
+        'reordered': transport.stats['reordered'],
+        'unreachable': transport.stats['unreachable'],
+        'max_queue_depth': transport.max_depth,
+        'distinct_states': len(by_state),
+        'wall_time': time.perf_counter() - started,
+    }
+    if include_states:
+        metrics['states'] = {a.id: a.all_deltas for a in Agent.all}
+    return metrics
+
+
+def _run_seed(args):
+    scenario, seed, resolution, include_states = args
+    return run(scenario, seed, resolution, include_states)
+
+
+def summarize(runs):
+    converged = [r for r in runs if r['converged']]
+    summary = {
+        'runs': len(runs),
+        'converged': len(converged),
+        'mean_messages': statistics.mean(r['messages'] for r in runs),
+        'mean_bytes': statistics.mean(r['bytes'] for r in runs),
+        'mean_lost': statistics.mean(r['lost'] for r in runs),
+        'mean_dropped': statistics.mean(r['dropped'] for r in runs),
+        'wall_time': sum(r['wall_time'] for r in runs),
+    }
+    if converged:
+        times = [r['converged_at'] for r in converged]
+        summary.update({
+            'mean_converged_at': statistics.mean(times),
+            'median_converged_at': statistics.median(times),
+            'max_converged_at': max(times),
+            'mean_rounds_to_converge': statistics.mean(r['rounds_to_converge'] for r in converged),
+        })
+    return summary
+
+
+def sweep(scenario, seeds, jobs=None, resolution=0.1, include_states=False):
+    """
+    Run scenario once per seed, across a pool of jobs processes (default: one per CPU).
+    """
+    work = [(scenario, seed, resolution, include_states) for seed in seeds]
+    with concurrent.futures.ProcessPoolExecutor(jobs) as pool:
+        runs = list(pool.map(_run_seed, work))
+    return {'summary': summarize(runs), 'runs': runs}
+
+
+def main(argv=None):
+    syntax = argparse.ArgumentParser(description='Run a syncsim scenario headless and report metrics as JSON.')
+    syntax.add_argument('scenario', help='Scenario file (see the top of batch.py).')
+    syntax.add_argument('--seed', type=int, help="Seed to use instead of the scenario's; first seed of a sweep.")
+    syntax.add_argument('--sweep', type=int, metavar='N', help='Run N seeds in parallel and summarize them.')
+    syntax.add_argument('--jobs', type=int, help='Processes for a sweep (default: one per CPU).')
+    syntax.add_argument('--resolution', type=float, default=0.1,
+                        help='Virtual seconds between checks for agreement (default 0.1).')
+    syntax.add_argument('--states', action='store_true', help="Include each agent's state in a sweep's runs.")
+    args = syntax.parse_args(argv)
+    try:
+        scenario = Scenario.load(args.scenario)
+    except (OSError, ValueError) as e:
+        sys.stderr.write('Error: %s\n' % e)
+        return 1
+    first = scenario.seed if args.seed is None else args.seed
+    if args.sweep:
+        result = sweep(scenario, range(first, first + args.sweep), args.jobs, args.resolution, args.states)
+    else:
+        result = run(scenario, first, args.resolution)
+    json.dump(result, sys.stdout, indent=2)
+    sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    sys.exit(main())
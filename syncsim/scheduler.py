@@ -0,0 +1,116 @@
+import heapq
+import itertools
+import random
+
+from agent import Agent
+
+
+class Scheduler:
+    """
+    A single-threaded discrete-event engine for the simulation. Instead of a thread
+    per agent that sleeps and polls, there is a virtual clock and a priority queue
+    of events (commands, message deliveries, background gossip); running the
+    queue calls the same Agent methods the threads would, in time order. With a
+    seed, a run is fully reproducible.
+    """
+
+    # Each agent gossips on its own with this chance every this many seconds, as
+    # thread_main does.
+    gossip_period = 0.33
+    gossip_chance = 0.05
+
+    def __init__(self, seed=None):
+        if seed is not None:
+            random.seed(seed)
+        self.now = 0.0
+        self.queue = []
+        # Breaks ties between events at the same time, in the order they were scheduled.
+        self.seq = itertools.count()
+        self.events = 0
+        self.autogossip = False
+        # True while a _gossip event is in the queue, so that turning autogossip off
+        # and on again doesn't start a second chain of them.
+        self.gossip_pending = False
+        Agent.thread_main = None
+        Agent.scheduler = self
+
+    def __len__(self):
+        return len(self.queue)
+
+    def at(self, when, func, *args):
+        heapq.heappush(self.queue, (max(when, self.now), next(self.seq), func, args))
+
+    def after(self, delay, func, *args):
+        self.at(self.now + delay, func, *args)
+
+    def command(self, cmd, delay=0):
+        """
+        Have the agent that cmd starts with ("A.1: gossip") run it. Returns False if
+        there is no such agent.
+        """
+        for a in Agent.all:
+            if cmd.startswith(a.id):
+                self.after(delay, a.run, cmd)
+                return True
+        return False
+
+    def set_autogossip(self, on):
+        if on and not self.gossip_pending:
+            self._schedule_gossip()
+        self.autogossip = on
+
+    def _schedule_gossip(self):
+        # Rather than ticking every agent every gossip_period, draw the time until
+        # the next agent gossips from the combined rate of all of them.
+        rate = len(Agent.all) * self.gossip_chance / self.gossip_period
+        if rate:
+            self.gossip_pending = True
+            self.after(random.expovariate(rate), self._gossip)
+
+    def _gossip(self):
+        self.gossip_pending = False
+        if not self.autogossip:
+            return
+        agent = random.choice(Agent.all)
+        target = self._peer(agent)
+        if target:
+            agent.gossip([target])
+        self._schedule_gossip()
+
+    def _peer(self, agent):
+        # A random agent that agent can reach. Most agents can reach most others, so
+        # a few random draws usually find one without building agent.reachable,
+        # which costs O(agents).
+        for _ in range(8):
+            a = random.choice(Agent.all)
+            if a is not agent and a.id not in agent.cant_reach:
+                return a
+        targets = agent.reachable
+        return random.choice(targets) if targets else None
+
+    def step(self):
+        """
+        Run the next event, advancing the clock to its time. Returns False if
+        there are none.
+        """
+        if not self.queue:
+            return False
+        when, _, func, args = heapq.heappop(self.queue)
+        self.now = when
+        self.events += 1
+        func(*args)
+        return True
+
+    def run(self, until=None):
+        """
+        Run events in time order until the queue is empty or, if until is given,
+        until the next one is later than that; then the clock reads until. With
+        autogossip on, the queue never empties, so pass until. Returns the number
+        of events run.
+        """
+        start = self.events
+        while self.queue and (until is None or self.queue[0][0] <= until):
+            self.step()
+        if until is not None and until > self.now:
+            self.now = until
+        return self.events - start
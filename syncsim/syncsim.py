@@ -1,5 +1,6 @@
 import argparse
 import os
+import random
 import re
 import sys
 import time
@@ -9,10 +10,14 @@ import types
 from agent import Agent
 import console
 import cmdlog
+from scheduler import Scheduler
+from transport import Transport
 
 
 agent_cmd_pat = re.compile(r'\s*([a-z]\.[1-9])\s*:\s*(.+)', re.I)
 should_autogossip = False
+# Set when running on a virtual clock (--events) instead of a thread per agent.
+scheduler = None
 
 
 def quit():
@@ -30,6 +35,8 @@ def autogossip(*args):
     stdout.say('Turning autogossip %s.' % mode)
     global should_autogossip
     should_autogossip = bool(mode == 'on')
+    if scheduler is not None:
+        scheduler.set_autogossip(should_autogossip)
 
 
 def check(*args):
@@ -52,6 +59,44 @@ def check(*args):
             report += '\n   %d agents see state as: %s  (%s)' % (len(agents), key, ', '.join([a.id for a in agents]))
         stdout.say(report)
 
+def stats(*args):
+    """
+    stats [digest|naive]  -- report messages and bytes sent, optionally switching how
+                             gossip decides what to send
+    """
+    if args and args[0].lower() in ('digest', 'naive'):
+        Agent.gossip_mode = args[0].lower()
+    with Agent.stats_lock:
+        counts = dict(Agent.stats)
+        if args:
+            Agent.stats.clear()
+    report = 'Sent %d messages, %d bytes in all. Gossip mode is %s.' % (
+        counts.get('messages', 0), counts.get('bytes', 0), Agent.gossip_mode)
+    rounds = counts.get('rounds')
+    if rounds:
+        report += '\n   %d gossip rounds, averaging %.1f messages, %.1f bytes.' % (
+            rounds, counts['gossip messages'] / rounds, counts['gossip bytes'] / rounds)
+    stdout.say(report)
+
+
+def queues(*args):
+    """
+    queues                -- report how full agents' inboxes are, and lost messages
+    """
+    transport = Agent.transport
+    if transport is None:
+        stdout.say('Messages are delivered directly; there are no queues.')
+        return
+    with Agent.all_lock:
+        depths = ['%s=%d' % (a.id, transport.depth(a)) for a in Agent.all if transport.depth(a)]
+    counts = transport.stats
+    stdout.say('Queued now: %s. Deepest so far: %d of %d.\n'
+               '   %d sent, %d delivered, %d dropped (inbox full), %d lost, %d unreachable, %d reordered.' % (
+                   ', '.join(depths) or 'none', transport.max_depth, transport.capacity, counts['sent'],
+                   counts['delivered'], counts['dropped'], counts['lost'], counts['unreachable'],
+                   counts['reordered']))
+
+
 def describe(*args):
     """
     describe [agentpat]   -- summarize all or some agents (wildcards ok).
@@ -97,6 +142,10 @@ def thread_main(agent):
                 n = len(Agent.cmds)
             while agent.cmd_idx < n:
                 agent.next()
+            if Agent.transport is not None:
+                # deliver() hands over at most a batch at a time; take all that's ready.
+                while Agent.transport.deliver(agent):
+                    pass
             if should_autogossip:
                 agent.autogossip()
     except:
@@ -107,7 +156,8 @@ def thread_main(agent):
 def get_agents(participants):
     if len(participants) < 2:
         abort('Must have at least 2 participants.')
-    Agent.thread_main = thread_main
+    if scheduler is None:
+        Agent.thread_main = thread_main
     Agent.stdout = stdout
     agents = []
     for p in participants:
@@ -116,7 +166,7 @@ def get_agents(participants):
     if len(parties) < 2:
         abort('Must have at least two parties.')
     for a in agents:
-        a.init_parties(parties)
+        a.init_parties(sorted(parties))
     return agents
 
 
@@ -150,13 +200,21 @@ def main():
             cmd = get_next_command()
             m = agent_cmd_pat.match(cmd)
             if m:
-                with Agent.cmds_lock:
-                    Agent.cmds.append(m.group(1).upper() + ': ' + m.group(2))
+                cmd = m.group(1).upper() + ': ' + m.group(2)
+                if scheduler is not None:
+                    if not scheduler.command(cmd):
+                        stdout.say('No such agent.')
+                else:
+                    with Agent.cmds_lock:
+                        Agent.cmds.append(cmd)
             elif ':' in cmd:
                 stdout.say('No such agent.')
             else:
                 dispatch(cmd)
-            time.sleep(1)
+            if scheduler is not None:
+                scheduler.run(until=scheduler.now + 1)
+            else:
+                time.sleep(1)
     except KeyboardInterrupt:
         stdout.say('')
 
@@ -169,6 +227,23 @@ for Alice and Bob; use any letters you like. They are not case-sensitive. Dotted
 identifies specific agents. @letters notation puts the agents into one or more permission group, each
 identified by a letter--so B.1@yz puts B.1 into the 'y' and the 'z' permission groups. The minus
 notation says that a particular agent cannot talk to the agents that are subtracted.""")
+    syntax.add_argument('--events', action='store_true', help="""
+Run all agents in one thread on a virtual clock, instead of a thread per agent. Each command then
+advances the clock by one second, without waiting.""")
+    syntax.add_argument('--seed', type=int, help='Seed for random choices; with --events, runs are repeatable.')
+    syntax.add_argument('--latency', type=float, default=0.0, help='Seconds every message takes (default 0).')
+    syntax.add_argument('--jitter', type=float, default=0.125,
+                        help='Up to this many more seconds, at random (default 0.125).')
+    syntax.add_argument('--loss', type=float, default=0.0, help='Chance that a message is lost (default 0).')
+    syntax.add_argument('--reorder', type=float, default=0.0,
+                        help='Chance that a message is held back so later ones overtake it (default 0).')
+    syntax.add_argument('--queue', type=int, default=1000,
+                        help="Messages an agent's inbox holds before new ones are dropped (default 1000).")
     args = syntax.parse_args()
+    if args.events:
+        scheduler = Scheduler(args.seed)
+    elif args.seed is not None:
+        random.seed(args.seed)
+    Transport(scheduler, args.queue, args.latency, args.jitter, args.loss, args.reorder)
     all_agents = get_agents(args.participants)
     main()
\ No newline at end of file
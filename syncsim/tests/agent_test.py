@@ -0,0 +1,94 @@
+import itertools
+
+import pytest
+
+from agent import Agent, PartyDeltas, m_of_n_of_group_pat, party_digest
+
+
+def test_party_deltas_add_and_remove():
+    lst = PartyDeltas(['#c', '#a'])
+    assert list(lst) == ['#a', '#c']
+    assert lst.add('#b')
+    assert not lst.add('#b')
+    assert list(lst) == ['#a', '#b', '#c']
+    assert len(lst) == 3 and lst[1] == '#b'
+    assert '#b' in lst and '#d' not in lst
+    assert lst.size == 6
+    assert lst.remove('#a')
+    assert not lst.remove('#a')
+    assert list(lst) == ['#b', '#c']
+    assert lst.size == 4
+
+
+def test_party_deltas_index_endorsements():
+    lst = PartyDeltas(['#'])
+    assert lst.endorsed('#x') is None
+    lst.add('#x by {A.1,A.2}/3@x')
+    lst.add('#y 1@z')
+    assert lst.endorsed('#x') == ('#x by {A.1,A.2}/3@x', frozenset(['A.1', 'A.2']))
+    assert lst.endorsed('#y ') == ('#y 1@z', frozenset())
+    # Removing a delta that's no longer the one indexed for its base leaves the index alone.
+    lst.add('#x by {A.1,A.2,A.3}/3@x')
+    assert lst.endorsed('#x')[0] == '#x by {A.1,A.2,A.3}/3@x'
+    lst.remove('#x by {A.1,A.2}/3@x')
+    assert lst.endorsed('#x')[0] == '#x by {A.1,A.2,A.3}/3@x'
+    lst.remove('#x by {A.1,A.2,A.3}/3@x')
+    assert lst.endorsed('#x') is None
+    assert list(lst) == ['#', '#y 1@z']
+
+
+def test_party_deltas_caches_follow_changes():
+    lst = PartyDeltas(['#', '#b'])
+    assert lst.joined == '#+#b'
+    assert lst.digest == party_digest(['#', '#b'])
+    lst.add('#a')
+    assert lst.joined == '#+#a+#b'
+    assert lst.digest == party_digest(['#', '#a', '#b'])
+    lst.remove('#b')
+    assert lst.joined == '#+#a'
+    assert lst.digest == party_digest(['#', '#a'])
+    # A failed add or remove keeps what's cached.
+    digest = lst.digest
+    assert not lst.add('#a') and not lst.remove('#z')
+    assert lst.digest is digest
+    assert PartyDeltas(['#', '#a']).digest == digest
+
+
+def endorsers_of(agent, party='A'):
+    found = [m_of_n_of_group_pat.match(d) for d in agent.deltas[party]]
+    found = [m for m in found if m and m.group(2)]
+    assert len(found) == 1
+    return set(found[0].group(2).split(','))
+
+
+@pytest.mark.parametrize('order', list(itertools.permutations(['A.1', 'A.2', 'A.1,A.3'])))
+def test_endorsements_merge_in_any_order(order):
+    # B.1 can't endorse Alice's changes, so it only merges what it hears.
+    b = Agent('B.1')
+    b.init_parties(['A', 'B'])
+    for endorsers in order:
+        b.append_delta('#c by {%s}/3@x' % endorsers, 'A')
+    assert endorsers_of(b) == {'A.1', 'A.2', 'A.3'}
+    assert list(b.deltas['A']) == ['#', '#c by {A.1,A.2,A.3}/3@x']
+
+
+def test_endorsements_already_known_change_nothing():
+    b = Agent('B.1')
+    b.init_parties(['A', 'B'])
+    held = b.append_delta('#c by {A.1,A.2}/3@x', 'A')
+    assert b.append_delta('#c by {A.2}/3@x', 'A') == held
+    assert b.append_delta('#c by {}/3@x', 'A') == held
+    assert list(b.deltas['A']) == ['#', held]
+
+
+def test_agent_in_group_adds_its_endorsement():
+    a1 = Agent('A.1@x')
+    a3 = Agent('A.3')
+    for a in (a1, a3):
+        a.init_parties(['A', 'B'])
+    assert a1.append_delta('#c by {A.2}/3@x') == '#c by {A.1,A.2}/3@x'
+    # Not in group x; and endorsements from another party's agents aren't added.
+    assert a3.append_delta('#c by {A.2}/3@x') == '#c by {A.2}/3@x'
+    assert a1.append_delta('#d by {B.2}/3@x', 'B') == '#d by {B.2}/3@x'
+    # Enough endorsers already.
+    assert a1.append_delta('#e by {A.2,A.3}/2@x') == '#e by {A.2,A.3}/2@x'
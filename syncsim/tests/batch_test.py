@@ -0,0 +1,80 @@
+import json
+import os
+
+import pytest
+
+from batch import Scenario, main, run, summarize
+
+partition = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'scenarios', 'partition.txt')
+
+
+def test_partition_converges_repeatably():
+    scenario = Scenario.load(partition)
+    assert scenario.seed == 7
+    assert scenario.specs == ['A.1@x', 'A.2@x', 'A.3-B.1,B.2', 'B.1', 'B.2-A.1']
+    first = run(scenario)
+    assert first['converged']
+    assert first['distinct_states'] == 1
+    assert len(set(first['states'].values())) == 1
+    assert first['converged_at'] >= first['last_command_at'] == 3
+    # B.2 can't reach A.1, so A.1's broadcast doesn't get there.
+    assert first['unreachable'] >= 1
+    assert first['lost'] == first['dropped'] == 0
+    assert (first['seed'], first['agents'], first['events'], first['messages'], first['bytes'],
+            first['rounds_to_converge']) == (7, 5, 37, 39, 1117, 7)
+    again = run(scenario)
+    del first['wall_time'], again['wall_time']
+    assert again == first
+
+
+def test_seed_overrides_the_scenarios():
+    scenario = Scenario.load(partition)
+    other = run(scenario, seed=8, include_states=False)
+    assert other['seed'] == 8
+    assert 'states' not in other
+    summary = summarize([run(scenario), other])
+    assert summary['runs'] == 2
+    assert summary['converged'] == 2
+
+
+def test_main_reports_json(capsys):
+    assert main([partition]) is None
+    metrics = json.loads(capsys.readouterr().out)
+    assert metrics['converged']
+    assert metrics['seed'] == 7
+
+
+def test_parse():
+    scenario = Scenario.parse('''
+        # comment
+        agents A.1 B.1
+        seed 3
+        until 60
+        loss 0.5
+        queue 10
+        2   autogossip on
+        0.5 A.1: simple  # trailing comment
+    ''')
+    assert scenario.specs == ['A.1', 'B.1']
+    assert (scenario.seed, scenario.until) == (3, 60.0)
+    assert scenario.transport == {'loss': 0.5, 'queue': 10}
+    assert scenario.script == [(0.5, 'A.1: simple'), (2.0, 'autogossip on')]
+
+
+@pytest.mark.parametrize('text, error', [
+    ('agents A.1 B.x', 'Line 1: Bad spec "B.x"'),
+    ('seed 1\n0 A.1: simple', 'no "agents" line'),
+    ('agents A.1 A.2@x a.3', 'at least two parties'),
+    ('agents A.1 B.1\nseed many', 'Line 2:'),
+    ('agents A.1 B.1\nsoon A.1: simple', 'Line 2: Expected'),
+])
+def test_parse_errors(text, error):
+    with pytest.raises(ValueError, match=error):
+        Scenario.parse(text)
+
+
+def test_main_reports_a_bad_scenario(tmp_path, capsys):
+    path = tmp_path / 'bad.txt'
+    path.write_text('agents A.1\n')
+    assert main([str(path)]) == 1
+    assert 'at least two parties' in capsys.readouterr().err
@@ -0,0 +1,23 @@
+import os
+import sys
+
+import pytest
+
+# The simulator's modules import each other as top-level modules.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agent import Agent
+import batch
+
+
+@pytest.fixture(autouse=True)
+def fresh_sim():
+    # Agent keeps the simulation in class attributes; start and end each test clean.
+    def clear():
+        batch.reset()
+        Agent.scheduler = None
+        Agent.thread_main = None
+        Agent.stdout = None
+    clear()
+    yield
+    clear()
@@ -0,0 +1,69 @@
+import pytest
+
+from agent import Agent, PartyDeltas
+from scheduler import Scheduler
+
+
+def two_agents(shared=200, own=5):
+    # A long history both agents know, and a few deltas each that the other doesn't.
+    a, b = Agent('A.1'), Agent('B.1')
+    history = ['#%04d' % i for i in range(shared)]
+    for agent in (a, b):
+        agent.deltas = {'A': PartyDeltas(['#'] + history), 'B': PartyDeltas(['#'])}
+    for i in range(own):
+        a.append_delta('#a%03d' % i)
+        b.append_delta('#b%03d' % i)
+    return a, b
+
+
+def gossip_once(mode):
+    Agent.gossip_mode = mode
+    s = Scheduler(5)
+    a, b = two_agents()
+    assert a.all_deltas != b.all_deltas
+    assert s.command('A.1: gossip')
+    s.run()
+    assert a.all_deltas == b.all_deltas
+    assert Agent.stats['rounds'] == 1
+    # Nothing else was sent, so the round accounts for all of the traffic.
+    assert Agent.stats['gossip messages'] == Agent.stats['messages']
+    assert Agent.stats['gossip bytes'] == Agent.stats['bytes']
+    return a.all_deltas, dict(Agent.stats)
+
+
+def test_both_modes_converge_and_digest_sends_less():
+    naive_state, naive = gossip_once('naive')
+    Agent.stats.clear()
+    Agent.all = []
+    digest_state, digest = gossip_once('digest')
+    assert digest_state == naive_state
+    assert '#a004' in digest_state and '#b004' in digest_state
+    assert digest['bytes'] < naive['bytes']
+    assert digest['messages'] <= 5 < naive['messages']
+
+
+def test_agents_that_agree_exchange_one_digest():
+    s = Scheduler()
+    a, b = two_agents(own=0)
+    a.gossip([b])
+    assert len(s) == 0
+    assert Agent.stats['messages'] == 1
+
+
+@pytest.mark.parametrize('mode', ['naive', 'digest'])
+def test_round_counts_only_its_own_traffic(mode):
+    Agent.gossip_mode = mode
+    Scheduler()
+    a, b = two_agents()
+    calls = []
+
+    def busy(msg):
+        # Other agents' traffic, counted while this round is under way.
+        calls.append(msg)
+        Agent.tally(100, 10000)
+    a.say = b.say = busy
+    a.gossip([b])
+    stats = Agent.stats
+    assert calls
+    assert stats['messages'] == stats['gossip messages'] + 100 * len(calls)
+    assert stats['bytes'] == stats['gossip bytes'] + 10000 * len(calls)
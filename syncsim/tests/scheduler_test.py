@@ -0,0 +1,113 @@
+from agent import Agent
+from scheduler import Scheduler
+
+
+def make_agents(*specs):
+    agents = [Agent(spec) for spec in specs]
+    parties = sorted(set(a.party for a in agents))
+    for a in agents:
+        a.init_parties(parties)
+    return agents
+
+
+def test_runs_events_in_time_order():
+    s = Scheduler()
+    seen = []
+    s.at(3, lambda: seen.append((3, s.now)))
+    s.at(1, lambda: seen.append((1, s.now)))
+    s.after(2, lambda: seen.append((2, s.now)))
+    assert len(s) == 3
+    assert s.run() == 3
+    assert seen == [(1, 1), (2, 2), (3, 3)]
+    assert s.events == 3
+    assert not s.step()
+
+
+def test_ties_run_in_the_order_scheduled():
+    s = Scheduler()
+    seen = []
+    for i in range(5):
+        s.at(1, seen.append, i)
+    # An event scheduled in the past runs now, after those already due now.
+    s.at(1, lambda: s.at(0, seen.append, 'late'))
+    s.at(1, seen.append, 5)
+    s.run()
+    assert seen == [0, 1, 2, 3, 4, 5, 'late']
+    assert s.now == 1
+
+
+def test_run_until():
+    s = Scheduler()
+    seen = []
+    s.at(1, seen.append, 1)
+    s.at(5, seen.append, 5)
+    assert s.run(until=2) == 1
+    assert s.now == 2
+    assert seen == [1]
+    assert len(s) == 1
+    s.after(1, seen.append, 3)
+    assert s.run(until=10) == 2
+    assert seen == [1, 3, 5]
+    assert s.now == 10
+
+
+def simulate(seed):
+    Agent.all = []
+    Agent.stats.clear()
+    s = Scheduler(seed)
+    make_agents('A.1', 'A.2', 'B.1', 'B.2-A.1')
+    assert s.command('A.1: simple')
+    assert s.command('B.2: simple', 0.5)
+    s.set_autogossip(True)
+    s.run(until=30)
+    return s.events, dict(Agent.stats), [a.all_deltas for a in Agent.all]
+
+
+def test_a_seed_makes_a_run_repeatable():
+    first = simulate(3)
+    assert first == simulate(3)
+    assert first[1]['rounds'] > 0
+    assert simulate(4) != first
+
+
+def test_command():
+    s = Scheduler()
+    a1, b1 = make_agents('A.1', 'B.1')
+    assert not s.command('C.1: simple')
+    assert len(s) == 0
+    assert s.command('A.1: simple', delay=2)
+    assert s.run(until=1) == 0
+    assert a1.get_state() == '#'
+    s.run(until=2)
+    assert a1.get_state() != '#'
+    # The broadcast went straight to the other agent, a moment later.
+    assert b1.get_state('A') == '#'
+    s.run()
+    assert b1.get_state('A') == a1.get_state()
+
+
+def test_set_autogossip():
+    s = Scheduler(1)
+    make_agents('A.1', 'B.1')
+    s.set_autogossip(True)
+    assert len(s) == 1
+    # Turning it on again, or off and on before the next gossip, adds no second chain.
+    s.set_autogossip(True)
+    s.set_autogossip(False)
+    s.set_autogossip(True)
+    assert len(s) == 1
+    s.run(until=60)
+    assert Agent.stats['rounds'] > 0
+    assert len(s) == 1
+    s.set_autogossip(False)
+    rounds = Agent.stats['rounds']
+    # The pending gossip finds autogossip off and doesn't come back.
+    s.run()
+    assert len(s) == 0
+    assert Agent.stats['rounds'] == rounds
+
+
+def test_autogossip_without_agents_schedules_nothing():
+    s = Scheduler()
+    s.set_autogossip(True)
+    assert len(s) == 0
@@ -0,0 +1,109 @@
+from agent import Agent
+from scheduler import Scheduler
+from transport import Transport
+
+
+class Inbox:
+    # Stands in for an agent, keeping what it receives.
+    def __init__(self, id, cant_reach=()):
+        self.id = id
+        self.cant_reach = list(cant_reach)
+        self.received = []
+
+    def receive(self, msg):
+        self.received.append(msg)
+
+
+def test_full_inbox_drops():
+    t = Transport(capacity=2, jitter=0)
+    a, b = Inbox('A.1'), Inbox('B.1')
+    assert t.send(a, b, 'A+#1')
+    assert t.send(a, b, 'A+#2')
+    assert not t.send(a, b, 'A+#3')
+    assert (t.stats['sent'], t.stats['dropped']) == (3, 1)
+    assert t.depth(b) == t.max_depth == 2
+    assert t.deliver(b) == 2
+    assert b.received == [['A+#1', 'A+#2']]
+    assert t.depth(b) == 0 and t.max_depth == 2
+    assert t.send(a, b, 'A+#3')
+
+
+def test_unreachable():
+    t = Transport()
+    a, b = Inbox('A.1', ['B.1']), Inbox('B.1')
+    assert not t.send(a, b, 'A+#1')
+    assert t.send(b, a, 'B+#1')
+    assert (t.stats['sent'], t.stats['unreachable']) == (2, 1)
+    assert t.depth(b) == 0
+
+
+def test_loss():
+    t = Transport(loss=1.0)
+    a, b = Inbox('A.1'), Inbox('B.1')
+    for i in range(5):
+        assert not t.send(a, b, 'A+#%d' % i)
+    assert (t.stats['sent'], t.stats['lost'], t.depth(b)) == (5, 5, 0)
+
+
+def test_reorder_lets_later_messages_overtake():
+    s = Scheduler()
+    t = Transport(s, latency=1, jitter=0, reorder=1.0)
+    a, b = Inbox('A.1'), Inbox('B.1')
+    t.send(a, b, 'A+#1')
+    t.reorder = 0
+    t.send(a, b, 'A+#2')
+    assert t.stats['reordered'] == 1
+    s.run()
+    assert b.received == ['A+#2', 'A+#1']
+    assert s.now == 2
+    assert t.stats['delivered'] == 2
+
+
+def test_deliver_takes_only_ready_messages():
+    s = Scheduler()
+    t = Transport(s, latency=1, jitter=0)
+    a, b = Inbox('A.1'), Inbox('B.1')
+    t.send(a, b, 'A+#1')
+    assert t.deliver(b) == 0
+    assert b.received == []
+    s.run()
+    assert b.received == ['A+#1']
+
+
+def test_batch_limit_and_rescheduling():
+    s = Scheduler()
+    t = Transport(s, jitter=0, batch=2)
+    a, b = Inbox('A.1'), Inbox('B.1')
+    for i in range(5):
+        t.send(a, b, 'A+#%d' % i)
+    # A batch sent as one message counts once against the limit.
+    t.send(a, b, ['A+#5', 'A+#6'])
+    # One delivery is scheduled for the inbox, however many messages wait in it.
+    assert len(s) == 1
+    assert s.step()
+    assert b.received == [['A+#0', 'A+#1']]
+    assert t.depth(b) == 4
+    # Cut short by the batch limit, so the rest is due now too.
+    assert len(s) == 1 and s.queue[0][0] == s.now
+    s.run()
+    assert b.received == [['A+#0', 'A+#1'], ['A+#2', 'A+#3'], ['A+#4', 'A+#5', 'A+#6']]
+    assert s.now == 0
+    assert t.stats['delivered'] == 6
+
+
+def test_agents_on_a_transport():
+    s = Scheduler(2)
+    t = Transport(s)
+    assert Agent.transport is t
+    agents = [Agent(spec) for spec in ('A.1', 'B.1', 'B.2-A.1')]
+    for agent in agents:
+        agent.init_parties(['A', 'B'])
+    s.command('B.2: simple')
+    s.run()
+    assert agents[1].get_state('B') == agents[2].get_state() != '#'
+    assert agents[0].get_state('B') == '#'
+    # B.2 can't answer A.1 with what A.1 lacks.
+    agents[0].gossip([agents[2]])
+    s.run()
+    assert t.stats['unreachable'] == 1
+    assert agents[0].get_state('B') == '#'
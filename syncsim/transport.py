@@ -0,0 +1,110 @@
+import collections
+import heapq
+import itertools
+import random
+import threading
+import time
+
+from agent import Agent
+
+
+class Transport:
+    """
+    Carries messages between agents. Each agent has a bounded inbox. send() only
+    puts a message in the target's inbox, or drops it if the inbox is full, so a
+    sender never waits on a receiver. An agent's inbox is delivered to it in
+    batches: by a scheduler event when running on a scheduler.Scheduler, or by the
+    agent's own thread. Either way, only the agent changes its own state.
+
+    Each message is ready for delivery after latency plus up to jitter seconds. With
+    probability loss it is lost; with probability reorder it is held back a while
+    longer, so that later messages overtake it. A message from an agent to one it
+    can't reach (see cant_reach) goes nowhere. stats counts what happened to
+    messages; depth() and max_depth show how full the inboxes are and have been.
+    """
+
+    def __init__(self, scheduler=None, capacity=1000, latency=0.0, jitter=0.125, loss=0.0, reorder=0.0,
+                 batch=100):
+        self.scheduler = scheduler
+        self.capacity = capacity
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.reorder = reorder
+        self.batch = batch
+        # agent -> heap of (ready time, seq, msg)
+        self.inboxes = collections.defaultdict(list)
+        # agent -> time its next delivery is scheduled for
+        self.due = {}
+        self.seq = itertools.count()
+        self.lock = threading.Lock()
+        self.stats = collections.Counter()
+        self.max_depth = 0
+        Agent.transport = self
+
+    def now(self):
+        return self.scheduler.now if self.scheduler is not None else time.monotonic()
+
+    def depth(self, agent):
+        return len(self.inboxes.get(agent, ()))
+
+    def send(self, sender, target, msg):
+        """
+        Queue msg for target. Returns False if it was dropped or lost.
+        """
+        with self.lock:
+            self.stats['sent'] += 1
+            if target.id in sender.cant_reach:
+                self.stats['unreachable'] += 1
+                return False
+            if self.loss and random.random() < self.loss:
+                self.stats['lost'] += 1
+                return False
+            inbox = self.inboxes[target]
+            if len(inbox) >= self.capacity:
+                self.stats['dropped'] += 1
+                return False
+            delay = self.latency + random.random() * self.jitter
+            if self.reorder and random.random() < self.reorder:
+                self.stats['reordered'] += 1
+                delay += self.latency + self.jitter
+            ready = self.now() + delay
+            heapq.heappush(inbox, (ready, next(self.seq), msg))
+            self.max_depth = max(self.max_depth, len(inbox))
+        if self.scheduler is not None:
+            self._wake(target, ready)
+        return True
+
+    def _wake(self, target, when):
+        # Deliver target's inbox at when, unless that's already due to happen sooner.
+        due = self.due.get(target)
+        if due is None or when < due:
+            self.due[target] = when
+            self.scheduler.at(when, self.deliver, target)
+
+    def deliver(self, agent):
+        """
+        Hand agent up to batch of the messages in its inbox that are ready, as one
+        batch. Returns how many it got.
+        """
+        with self.lock:
+            now = self.now()
+            if self.due.get(agent) == now:
+                del self.due[agent]
+            inbox = self.inboxes.get(agent)
+            msgs = []
+            count = 0
+            while inbox and inbox[0][0] <= now and count < self.batch:
+                msg = heapq.heappop(inbox)[2]
+                if isinstance(msg, str):
+                    msgs.append(msg)
+                else:
+                    msgs.extend(msg)
+                count += 1
+            self.stats['delivered'] += count
+            next_ready = inbox[0][0] if inbox else None
+        if msgs:
+            agent.receive(msgs[0] if len(msgs) == 1 else msgs)
+        if self.scheduler is not None and next_ready is not None:
+            self._wake(agent, max(next_ready, now))
+        return count